@@ -3,12 +3,20 @@
 # Sidebar: users list → chat sessions → click to view chat in bubble format.
 # ──────────────────────────────────────────────────────────────────────────────
 
+import html
 import streamlit as st
 from datetime import datetime
 from auth import (
-    list_all_users, list_histories, load_history_file,
-    delete_history_file, is_admin,
+    list_all_users, list_histories, load_history_page, user_chat_stats,
+    delete_history_file, is_admin, persistence_stats,
 )
+from tts_cache import audio_cache
+from tts_service import transport_stats
+from ai_services import generation_stats, scheduler_stats
+from admission import admission_stats
+from latency_trace import tracer
+from stream_render import render_stats, message_html
+from config import TRANSCRIPT_WINDOW
 
 
 def render_admin_dashboard():
@@ -29,6 +37,23 @@ def render_admin_dashboard():
         st.session_state.admin_messages = []
     if "admin_chat_title" not in st.session_state:
         st.session_state.admin_chat_title = ""
+    if "admin_first_turn" not in st.session_state:
+        st.session_state.admin_first_turn = None   # oldest turn_idx loaded
+    if "admin_window" not in st.session_state:
+        st.session_state.admin_window = TRANSCRIPT_WINDOW
+
+    # ── One fetch per rerun feeds both the sidebar and the overview ──
+    try:
+        all_users = list_all_users()
+    except Exception:
+        all_users = []
+    try:
+        chat_stats = user_chat_stats()
+    except Exception:
+        chat_stats = {}
+
+    regular_users = [u for u in all_users if u.get("role") != "admin"]
+    empty_stats = {"chat_count": 0, "message_pairs": 0, "last_activity": 0.0}
 
     # ── Sidebar ──
     with st.sidebar:
@@ -54,13 +79,6 @@ def render_admin_dashboard():
         # ── Users list ──
         st.markdown("### Users")
 
-        try:
-            all_users = list_all_users()
-        except Exception:
-            all_users = []
-
-        regular_users = [u for u in all_users if u.get("role") != "admin"]
-
         if not regular_users:
             st.markdown(
                 "<small style='color:#4b5563'>No users registered yet.</small>",
@@ -79,12 +97,7 @@ def render_admin_dashboard():
             if st.session_state.admin_selected_user is None:
                 # Show user list
                 for u in regular_users:
-                    # Count chats for this user
-                    try:
-                        user_chats = list_histories(u["key"])
-                        chat_count = len(user_chats)
-                    except Exception:
-                        chat_count = 0
+                    chat_count = chat_stats.get(u["key"], empty_stats)["chat_count"]
 
                     label = f"{u['company']} ({u['name']})"
                     if st.button(
@@ -111,7 +124,7 @@ def render_admin_dashboard():
                 st.markdown("### Chat History")
 
                 try:
-                    histories = list_histories(sel_user["key"])
+                    histories = list_histories(sel_user["key"], limit=None)
                 except Exception:
                     histories = []
 
@@ -128,7 +141,7 @@ def render_admin_dashboard():
                             datetime.fromtimestamp(ts).strftime("%b %d, %I:%M %p")
                             if ts else ""
                         )
-                        n_msg = len(meta.get("messages", []))
+                        n_msg = meta.get("message_count", 0)
                         is_cur = st.session_state.admin_loaded_chat == fname
 
                         col_open, col_del = st.columns([5, 1])
@@ -141,8 +154,13 @@ def render_admin_dashboard():
                                 help=f"{n_msg} messages · {date}",
                             ):
                                 try:
-                                    data = load_history_file(sel_user["key"], fname)
-                                    st.session_state.admin_messages = data["messages"]
+                                    # Newest page only; older turns load on demand
+                                    page = load_history_page(sel_user["key"], fname)
+                                    st.session_state.admin_messages = page["messages"]
+                                    st.session_state.admin_first_turn = (
+                                        page["first_turn"] if page["has_more"] else None
+                                    )
+                                    st.session_state.admin_window = TRANSCRIPT_WINDOW
                                     st.session_state.admin_loaded_chat = fname
                                     st.session_state.admin_chat_title = title
                                 except Exception:
@@ -170,6 +188,82 @@ def render_admin_dashboard():
                 f"**Messages:** {len(st.session_state.admin_messages)}"
             )
 
+        # ── TTS cache stats ──
+        cache = audio_cache.snapshot()
+        st.markdown(
+            f"<small>TTS cache · {cache['hit_rate']:.0%} hit rate · "
+            f"{cache['memory_hits'] + cache['disk_hits']} hits / {cache['misses']} misses · "
+            f"~{cache['seconds_saved']:.1f}s saved · "
+            f"{cache['memory_evictions'] + cache['disk_evictions']} evictions</small>",
+            unsafe_allow_html=True,
+        )
+        pool = transport_stats()
+        if pool:
+            st.markdown(
+                f"<small>TTS pool · {pool['idle']} idle · "
+                f"{pool['connects']} connects / {pool['reused']} reused · "
+                f"{pool['errors']} errors</small>",
+                unsafe_allow_html=True,
+            )
+
+        # ── Streaming render stats ──
+        render = render_stats()
+        if render["replies"]:
+            st.markdown(
+                f"<small>Streaming · {render['flushes'] / render['replies']:.1f} flushes/reply · "
+                f"{render['tokens'] / max(render['flushes'], 1):.1f} tokens/flush · "
+                f"{render['bytes'] / render['replies'] / 1024:.1f} KB/reply</small>",
+                unsafe_allow_html=True,
+            )
+
+        # ── Groq rate-limit scheduler ──
+        sched = scheduler_stats()
+        if sched["calls"]:
+            backing_off = f" · <b>{sched['blocked']} backing off</b>" if sched["blocked"] else ""
+            st.markdown(
+                f"<small>Groq queue · {sched['queued']}/{sched['calls']} calls waited · "
+                f"wait p50 {sched['wait_p50']:.1f}s / p95 {sched['wait_p95']:.1f}s · "
+                f"{sched['retries']} retries · {sched['rate_limited']} 429s · "
+                f"{sched['gave_up']} gave up{backing_off}</small>",
+                unsafe_allow_html=True,
+            )
+
+        # ── Admission queues (live, all sessions) ──
+        for gate in admission_stats():
+            if not (gate["admitted"] or gate["waiting"]):
+                continue
+            waiting = sorted(
+                (u, v["waiting"]) for u, v in gate["users"].items() if v["waiting"]
+            )
+            queue = " · ".join(f"{html.escape(u or 'anonymous')} {n}" for u, n in waiting)
+            st.markdown(
+                f"<small>Admission {gate['name'].upper()} · {gate['active']}/{gate['limit']} active · "
+                f"<b>{gate['waiting']} waiting</b> · wait p50 {gate['wait_p50']:.1f}s / "
+                f"p95 {gate['wait_p95']:.1f}s · {gate['timeouts']} turned away"
+                f"{' · queued: ' + queue if queue else ''}</small>",
+                unsafe_allow_html=True,
+            )
+
+        # ── Cancelled generations ──
+        gen = generation_stats()
+        if gen["cancelled"] or gen["hedge_lost"]:
+            hedges = f" · {gen['hedge_lost']} hedge losers closed" if gen["hedge_lost"] else ""
+            st.markdown(
+                f"<small>Generation · {gen['completed']} finished / {gen['cancelled']} stopped early · "
+                f"~{gen['tokens_saved']} tokens saved{hedges}</small>",
+                unsafe_allow_html=True,
+            )
+
+        # ── Write-behind persistence stats ──
+        wb = persistence_stats()
+        st.markdown(
+            f"<small>Saves · queue {wb['queue_depth']} · "
+            f"flush p50 {wb['flush_ms_p50']:.0f}ms / p95 {wb['flush_ms_p95']:.0f}ms · "
+            f"{wb['spooled']} spooled / {wb['replayed']} replayed"
+            f"{' · <b>DB unreachable</b>' if wb['db_down'] else ''}</small>",
+            unsafe_allow_html=True,
+        )
+
     # ══════════════════════════════════════════════════════════════════════════
     # ─── Main Content Area ────────────────────────────────────────────────────
     # ══════════════════════════════════════════════════════════════════════════
@@ -187,13 +281,6 @@ def render_admin_dashboard():
 
     # ── No user selected — show overview ──
     if st.session_state.admin_selected_user is None:
-        try:
-            all_users = list_all_users()
-        except Exception:
-            all_users = []
-
-        regular_users = [u for u in all_users if u.get("role") != "admin"]
-
         st.markdown(
             "<div style='text-align:center;padding:40px 0 20px;color:#6b7280;"
             "font-size:0.95rem;'>Select a user from the sidebar to view their chats</div>",
@@ -202,13 +289,13 @@ def render_admin_dashboard():
 
         # Show a nice user overview
         for u in regular_users:
-            try:
-                user_chats = list_histories(u["key"])
-                chat_count = len(user_chats)
-                total_msgs = sum(len(m.get("messages", [])) for _, m in user_chats)
-            except Exception:
-                chat_count = 0
-                total_msgs = 0
+            stats = chat_stats.get(u["key"], empty_stats)
+            chat_count = stats["chat_count"]
+            total_msgs = stats["message_pairs"]
+            last_active = (
+                datetime.fromtimestamp(stats["last_activity"]).strftime("%b %d, %I:%M %p")
+                if stats["last_activity"] else "no activity yet"
+            )
 
             created = ""
             if u.get("created_at"):
@@ -237,10 +324,50 @@ def render_admin_dashboard():
                   {chat_count} chat(s)</span>
                 <span style="color:#9ca3af;font-size:0.8rem;">
                   {total_msgs} message pairs</span>
+                <span style="color:#6b7280;font-size:0.8rem;">
+                  last active {last_active}</span>
               </div>
             </div>
             """, unsafe_allow_html=True)
 
+        # ── Turn latency percentiles (this process, last N turns) ──
+        latency = tracer.percentiles()
+        if latency:
+            rows = "".join(
+                f"<tr><td>{stage}</td><td>{p['p50']:.0f}</td><td>{p['p95']:.0f}</td>"
+                f"<td>{p['p99']:.0f}</td><td>{p['count']}</td></tr>"
+                for stage, p in latency.items()
+            )
+            upload, stt_in = tracer.tag_percentiles("upload_bytes"), tracer.tag_percentiles("stt_bytes")
+            upload_line = ""
+            if upload and stt_in:
+                upload_line = (
+                    f"<div style='margin-top:8px;'>Voice upload · p50 {upload['p50'] / 1024:.0f} KB · "
+                    f"p95 {upload['p95'] / 1024:.0f} KB · to STT p50 {stt_in['p50'] / 1024:.0f} KB · "
+                    f"{tracer.prepared_share():.0%} prepared in browser</div>"
+                )
+            routing_line = "".join(
+                f"<div style='margin-top:4px;'>{html.escape(route)} · {r['count']} turns · "
+                f"first token p50 {r['ttft_p50']:.0f} / p95 {r['ttft_p95']:.0f} ms · "
+                f"{r['hedged']} hedged, {r['hedge_wins']} won by the hedge</div>"
+                for route, r in sorted(tracer.routing_summary().items())
+            )
+            if routing_line:
+                routing_line = f"<div style='margin-top:8px;'>Model routing</div>{routing_line}"
+            st.markdown(f"""
+            <div style="background:#1c1c2a;border:1px solid #2a2a3e;border-radius:14px;
+                 padding:16px 18px;margin-top:18px;color:#9ca3af;font-size:0.8rem;">
+              <div style="color:#f1f5f9;font-weight:600;font-size:0.92rem;margin-bottom:8px;">
+                Turn latency (ms)</div>
+              <table style="width:100%;">
+                <tr style="color:#6b7280;"><td>stage</td><td>p50</td><td>p95</td><td>p99</td><td>n</td></tr>
+                {rows}
+              </table>
+              {upload_line}
+              {routing_line}
+            </div>
+            """, unsafe_allow_html=True)
+
         return
 
     # ── User selected but no chat loaded ──
@@ -263,23 +390,20 @@ def render_admin_dashboard():
         unsafe_allow_html=True,
     )
 
-    for msg in st.session_state.admin_messages:
-        safe = (
-            msg["content"]
-            .replace("&", "&amp;")
-            .replace("<", "&lt;")
-            .replace(">", "&gt;")
-        )
-        if msg["role"] == "user":
-            st.markdown(
-                f'<div class="msg-user"><div class="bubble-user">{safe}</div></div>',
-                unsafe_allow_html=True,
-            )
-        else:
-            st.markdown(
-                f"""<div class="msg-bot">
-  <div class="bot-av"></div>
-  <div class="bubble-bot">{safe}</div>
-</div>""",
-                unsafe_allow_html=True,
-            )
+    # Newest admin_window messages only; each bubble's HTML is memoized
+    msgs = st.session_state.admin_messages
+    hidden = max(len(msgs) - st.session_state.admin_window, 0)
+    if hidden or st.session_state.admin_first_turn is not None:
+        if st.button("Load earlier messages", key="admin_load_earlier", use_container_width=True):
+            if not hidden:
+                page = load_history_page(sel["key"], st.session_state.admin_loaded_chat,
+                                         before_turn=st.session_state.admin_first_turn)
+                msgs[:0] = page["messages"]
+                st.session_state.admin_first_turn = (
+                    page["first_turn"] if page["has_more"] else None
+                )
+            st.session_state.admin_window += TRANSCRIPT_WINDOW
+            hidden = max(len(msgs) - st.session_state.admin_window, 0)
+
+    for msg in msgs[hidden:]:
+        st.markdown(message_html(msg["role"], msg["content"]), unsafe_allow_html=True)
@@ -0,0 +1,264 @@
+# ─── admission.py ─────────────────────────────────────────────────────────────
+# Process-wide admission control for outbound calls (LLM streams, STT, TTS).
+# Each backend gets a concurrency limit; callers over it wait in per-user
+# queues served round-robin, so one heavy user can't starve the rest, and a
+# caller that would wait too long is turned away instead of piling up.
+# One gate per backend in `gates`, shared by all Streamlit sessions.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from config import ADMISSION_LIMITS, ADMISSION_PER_USER, ADMISSION_TIMEOUT
+
+_POLL = 0.25  # seconds between checks while queued (position updates, on_wait)
+
+
+class AdmissionTimeout(Exception):
+    """Waited ADMISSION_TIMEOUT without getting a slot — the backend is saturated."""
+
+
+class _Ticket:
+    __slots__ = ("user_key", "granted", "wake")
+
+    def __init__(self, user_key: str):
+        self.user_key = user_key
+        self.granted = False
+        self.wake = None  # async waiters: called (under the lock) once granted
+
+
+def _resolve(fut: asyncio.Future):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class FairGate:
+    """
+    Concurrency limit for one backend with fair per-user queuing.
+
+    Up to `limit` callers run at once, at most `per_user` of them for the same
+    user. Waiting callers queue per user; freed slots go to users in
+    round-robin order.
+    """
+
+    def __init__(self, name: str, limit: int, per_user: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.per_user = per_user
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._active: dict[str, int] = {}
+        self._queues: OrderedDict[str, deque[_Ticket]] = OrderedDict()
+        self._waits = deque(maxlen=500)
+        self.stats = {"admitted": 0, "queued": 0, "timeouts": 0, "cancelled": 0}
+
+    # ── Public API ──
+
+    def acquire(self, user_key: str, on_wait=None) -> float:
+        """
+        Block until a slot is free for this user.
+
+        Args:
+            user_key: Whose queue to wait in
+            on_wait: Called with the 1-based queue position every _POLL while
+                     queued (from the waiting thread, outside the gate's
+                     lock); whatever it raises abandons the wait
+
+        Returns:
+            Seconds waited. Raises AdmissionTimeout.
+        """
+        started = time.monotonic()
+        with self._cond:
+            if self._try_admit(user_key):
+                return 0.0
+            ticket = self._enqueue(user_key)
+
+        try:
+            while True:
+                with self._cond:
+                    if ticket.granted:
+                        break
+                    remaining = started + self.timeout - time.monotonic()
+                    if remaining <= 0:
+                        raise AdmissionTimeout(f"{self.name} busy — waited {self.timeout:.0f}s")
+                    position = self._position(ticket)
+                if on_wait is not None:
+                    on_wait(position)
+                with self._cond:
+                    if not ticket.granted:
+                        self._cond.wait(min(remaining, _POLL))
+        except BaseException as e:
+            with self._cond:
+                self._abandon(ticket, e)
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._waits.append(waited)
+        return waited
+
+    def try_acquire(self, user_key: str) -> bool:
+        """Take a slot only if one is free right now and nobody is queued."""
+        with self._cond:
+            return self._try_admit(user_key)
+
+    def release(self, user_key: str):
+        with self._cond:
+            self._release(user_key)
+
+    @contextmanager
+    def slot(self, user_key: str, on_wait=None):
+        """Hold a slot for the duration of the block."""
+        self.acquire(user_key, on_wait)
+        try:
+            yield
+        finally:
+            self.release(user_key)
+
+    async def acquire_async(self, user_key: str) -> float:
+        """
+        acquire() for coroutines. Waits on the running event loop — the
+        ticket wakes it when granted — and a cancelled waiter leaves the queue.
+        """
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        with self._cond:
+            if self._try_admit(user_key):
+                return 0.0
+            ticket = self._enqueue(user_key)
+            ticket.wake = lambda: loop.call_soon_threadsafe(_resolve, granted)
+
+        try:
+            await asyncio.wait_for(granted, self.timeout)
+        except asyncio.TimeoutError:
+            with self._cond:
+                if not ticket.granted:  # not granted as the clock ran out
+                    error = AdmissionTimeout(f"{self.name} busy — waited {self.timeout:.0f}s")
+                    self._abandon(ticket, error)
+                    raise error from None
+        except BaseException as e:
+            with self._cond:
+                self._abandon(ticket, e)
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._waits.append(waited)
+        return waited
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            users = set(self._active) | set(self._queues)
+            per_user = {
+                u: {"active": self._active.get(u, 0), "waiting": len(self._queues.get(u, ()))}
+                for u in users
+            }
+        pct = lambda q: waits[min(len(waits) - 1, int(len(waits) * q))] if waits else 0.0
+        return {
+            **self.stats,
+            "name": self.name,
+            "limit": self.limit,
+            "active": sum(v["active"] for v in per_user.values()),
+            "waiting": sum(v["waiting"] for v in per_user.values()),
+            "wait_p50": pct(0.50),
+            "wait_p95": pct(0.95),
+            "users": per_user,
+        }
+
+    # ── Internals (caller holds the lock) ──
+
+    def _try_admit(self, user_key: str) -> bool:
+        """Admit at once if nobody is queued and there is room."""
+        if self._queues or not self._has_room(user_key):
+            return False
+        self._admit(user_key)
+        self._waits.append(0.0)
+        return True
+
+    def _enqueue(self, user_key: str) -> _Ticket:
+        ticket = _Ticket(user_key)
+        self._queues.setdefault(user_key, deque()).append(ticket)
+        self.stats["queued"] += 1
+        return ticket
+
+    def _abandon(self, ticket: _Ticket, error: BaseException):
+        """A waiter gave up (timeout, cancellation, on_wait raised)."""
+        if ticket.granted:
+            self._release(ticket.user_key)  # granted just before it gave up
+            return
+        self._remove(ticket)
+        self.stats["timeouts" if isinstance(error, AdmissionTimeout) else "cancelled"] += 1
+        self._dispatch()
+
+    def _has_room(self, user_key: str) -> bool:
+        return (sum(self._active.values()) < self.limit
+                and self._active.get(user_key, 0) < self.per_user)
+
+    def _admit(self, user_key: str):
+        self._active[user_key] = self._active.get(user_key, 0) + 1
+        self.stats["admitted"] += 1
+
+    def _release(self, user_key: str):
+        n = self._active.get(user_key, 0) - 1
+        if n > 0:
+            self._active[user_key] = n
+        else:
+            self._active.pop(user_key, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to queued users, round-robin."""
+        granted = False
+        while sum(self._active.values()) < self.limit:
+            user = next((u for u in self._queues if self._has_room(u)), None)
+            if user is None:
+                break
+            queue = self._queues[user]
+            ticket = queue.popleft()
+            ticket.granted = True
+            if ticket.wake is not None:
+                ticket.wake()
+            self._admit(user)
+            granted = True
+            if queue:
+                self._queues.move_to_end(user)  # back of the rotation
+            else:
+                del self._queues[user]
+        if granted:
+            self._cond.notify_all()
+
+    def _remove(self, ticket: _Ticket):
+        queue = self._queues.get(ticket.user_key)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.user_key]
+
+    def _position(self, ticket: _Ticket) -> int:
+        """Approximate place in line under round-robin service (1 = next)."""
+        mine = self._queues[ticket.user_key].index(ticket)
+        ahead = mine + 1
+        before_me = True
+        for user, queue in self._queues.items():
+            if user == ticket.user_key:
+                before_me = False
+                continue
+            ahead += min(len(queue), mine + 1 if before_me else mine)
+        return ahead
+
+
+# Process-wide gates shared by all Streamlit sessions
+gates = {
+    name: FairGate(name, limit, ADMISSION_PER_USER.get(name, limit), ADMISSION_TIMEOUT)
+    for name, limit in ADMISSION_LIMITS.items()
+}
+
+
+def admission_stats() -> list[dict]:
+    """Live state of every gate: limits, active and waiting per user, wait percentiles."""
+    return [gate.snapshot() for gate in gates.values()]
@@ -3,18 +3,650 @@
 # ──────────────────────────────────────────────────────────────────────────────
 
 import io
-from openai import OpenAI
-from config import GROQ_BASE_URL, MAX_TOKENS, TEMPERATURE, WHISPER_MODEL, CRM_SYSTEM_PROMPT
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
+from openai import OpenAI, RateLimitError
+from config import (
+    GROQ_BASE_URL, MAX_TOKENS, TEMPERATURE, WHISPER_MODEL, CRM_SYSTEM_PROMPT,
+    GROQ_MAX_CONNECTIONS, GROQ_MAX_KEEPALIVE, GROQ_KEEPALIVE_EXPIRY,
+    GROQ_CONNECT_TIMEOUT, GROQ_READ_TIMEOUT, GROQ_HTTP2, GROQ_CLIENT_REGISTRY_SIZE,
+    MODEL_CONTEXT_BUDGETS, DEFAULT_CONTEXT_BUDGET, CONTEXT_SUMMARY_TRIGGER,
+    CONTEXT_KEEP_RECENT, CONTEXT_SUMMARY_MODEL, CONTEXT_SUMMARY_MAX_TOKENS,
+    CONTEXT_FOLD_CHUNK, CONTEXT_FOLD_CHUNK_TOKENS,
+    STT_STREAM_WORKERS, STT_STREAM_TIMEOUT,
+    RATE_LIMIT_MAX_RETRIES, RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_CAP,
+    RATE_LIMIT_JITTER, RATE_LIMIT_MAX_WAIT,
+)
+from audio_prep import normalize_upload
+from admission import gates, AdmissionTimeout
+
+# HTTP/2 is optional — httpx needs the `h2` package for it
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+class ErrorReply(str):
+    """
+    User-facing message returned (or yielded) in place of a model reply when a
+    call fails. It is still a str, so it can be shown as is; callers tell it
+    apart from a reply by type, never by its text.
+    """
+
+
+SERVER_BUSY_REPLY = ErrorReply("Server busy — lots of people are chatting. Please try again in a moment.")
+
+
+# ─── Rate-Limit Scheduler ───────────────────────────────────────────────────
+# Groq limits requests and tokens per API key and model, and reports the
+# current budget on every response. Calls wait here for capacity (and out
+# any 429 retry-after) instead of surfacing "Rate limit hit" to the user.
+
+class RateLimitTimeout(Exception):
+    """A call would have waited longer than RATE_LIMIT_MAX_WAIT for capacity."""
+
+
+_WAIT_SLICE = 0.25  # seconds between capacity checks (and on_wait calls) while held back
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: str | None) -> float | None:
+    """Seconds from a Groq reset header ("2m59.56s", "7.66s", "120ms")."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts) if parts else None
+
+
+class _Bucket:
+    """Token bucket refilled at the rate implied by limit / remaining / reset."""
+
+    def __init__(self):
+        self.capacity: float | None = None  # unknown until the first response
+        self.level = 0.0
+        self.rate = 0.0                      # units per second
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.capacity is not None and self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (0 if it is now or limits are unknown)."""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # bigger than the bucket → wait for a full one
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate else RATE_LIMIT_BACKOFF_CAP
+
+    def take(self, amount: float, now: float):
+        if self.capacity is not None:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def sync(self, limit: float, remaining: float, reset_s: float | None, now: float):
+        """Adopt the server's view of this budget."""
+        self.capacity, self.level, self.updated = limit, remaining, now
+        if reset_s and limit > remaining:
+            self.rate = (limit - remaining) / reset_s
+        elif not self.rate:
+            self.rate = limit / 60
+
+
+class _ModelLimits:
+    def __init__(self):
+        self.requests = _Bucket()
+        self.tokens = _Bucket()
+        self.blocked_until = 0.0  # set by a 429 — everyone waits it out
+
+
+class RateLimitScheduler:
+    """
+    Admission and retry for Groq calls, per (API key, model).
+
+    run() waits until both buckets have room, makes the call, and on a 429
+    blocks the key/model for retry-after (or an exponential backoff), with
+    jitter, before trying again. One instance is shared by the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limits: dict[tuple[str, str], _ModelLimits] = {}
+        self._waits = deque(maxlen=500)  # queue wait per call, seconds
+        self._last = threading.local()
+        self.stats = {"calls": 0, "queued": 0, "retries": 0, "rate_limited": 0, "gave_up": 0}
+
+    def _get(self, api_key: str, model: str) -> _ModelLimits:
+        limits = self._limits.get((api_key, model))
+        if limits is None:
+            limits = self._limits[(api_key, model)] = _ModelLimits()
+        return limits
+
+    def observe(self, api_key: str, model: str, headers):
+        """Update the buckets from a response's x-ratelimit-* headers."""
+        now = time.monotonic()
+        with self._lock:
+            limits = self._get(api_key, model)
+            for kind, bucket in (("requests", limits.requests), ("tokens", limits.tokens)):
+                try:
+                    limit = float(headers[f"x-ratelimit-limit-{kind}"])
+                    remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+                except (KeyError, ValueError):
+                    continue
+                bucket.sync(limit, remaining, _parse_duration(headers.get(f"x-ratelimit-reset-{kind}")), now)
+
+    def run(self, api_key: str, model: str, tokens: int, call, on_wait=None):
+        """
+        Make `call()` once capacity allows, retrying 429s.
+
+        Args:
+            api_key: Groq API key the call is billed to
+            model: Model whose limits apply
+            tokens: Estimated tokens the call will consume (0 for STT)
+            call: Zero-argument function performing the request
+            on_wait: Called with the seconds still to wait, every _WAIT_SLICE
+                     while the call is held back (from the waiting thread, so
+                     whatever it raises abandons the wait)
+
+        Returns:
+            Whatever call() returns. Raises RateLimitTimeout or the last
+            RateLimitError once waiting or retrying is exhausted.
+        """
+        started = time.monotonic()
+        deadline = started + RATE_LIMIT_MAX_WAIT
+        waited, retries = 0.0, 0
+        try:
+            while True:
+                waited += self._acquire(api_key, model, tokens, deadline, on_wait)
+                try:
+                    return call()
+                except RateLimitError as e:
+                    with self._lock:
+                        self.stats["rate_limited"] += 1
+                    if retries >= RATE_LIMIT_MAX_RETRIES:
+                        raise
+                    self._backoff(api_key, model, retries, e)
+                    retries += 1
+        except (RateLimitError, RateLimitTimeout):
+            with self._lock:
+                self.stats["gave_up"] += 1
+            raise
+        finally:
+            with self._lock:
+                self.stats["calls"] += 1
+                self.stats["retries"] += retries
+                self.stats["queued"] += waited > 0
+                self._waits.append(waited)
+            self._last.info = {"wait_s": round(waited, 3), "retries": retries}
+
+    def _acquire(self, api_key: str, model: str, tokens: int, deadline: float,
+                 on_wait=None) -> float:
+        """Block until the call fits both buckets; returns seconds waited."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                limits = self._get(api_key, model)
+                wait = max(limits.blocked_until - now,
+                           limits.requests.wait(1, now),
+                           limits.tokens.wait(tokens, now))
+                if wait <= 0:
+                    limits.requests.take(1, now)
+                    limits.tokens.take(tokens, now)
+                    return now - started
+            if now + wait > deadline:
+                raise RateLimitTimeout(f"{model} needs {wait:.0f}s more capacity")
+            if on_wait is not None:
+                on_wait(wait)
+            # Re-check periodically — responses to other calls may resync the buckets
+            time.sleep(min(wait, _WAIT_SLICE))
+
+    def _backoff(self, api_key: str, model: str, attempt: int, error: RateLimitError):
+        """Block the key/model for retry-after (or exponential backoff) plus jitter."""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        retry_after = _parse_duration(headers.get("retry-after"))
+        delay = retry_after if retry_after is not None else min(
+            RATE_LIMIT_BACKOFF_CAP, RATE_LIMIT_BACKOFF_BASE * 2 ** attempt)
+        # Jitter only lengthens the wait — never retry before the server allows
+        delay *= 1 + random.uniform(0, RATE_LIMIT_JITTER)
+        with self._lock:
+            limits = self._get(api_key, model)
+            limits.blocked_until = max(limits.blocked_until, time.monotonic() + delay)
+
+    def last_call(self) -> dict:
+        """Queue wait and retries of the calling thread's latest call."""
+        return getattr(self._last, "info", {"wait_s": 0.0, "retries": 0})
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            now = time.monotonic()
+            blocked = sum(1 for lim in self._limits.values() if lim.blocked_until > now)
+        pct = lambda q: waits[min(len(waits) - 1, int(len(waits) * q))] if waits else 0.0
+        return {**self.stats, "wait_p50": pct(0.50), "wait_p95": pct(0.95), "blocked": blocked}
+
+
+_scheduler = RateLimitScheduler()
+
+
+def scheduler_stats() -> dict:
+    """Groq call counts, queue-wait percentiles (s), retries and 429s (this process)."""
+    return _scheduler.snapshot()
+
+
+def last_call_info() -> dict:
+    """{"wait_s", "retries"} of this thread's most recent Groq call."""
+    return _scheduler.last_call()
+
+
+def _request_model(request: httpx.Request) -> str | None:
+    if request.url.path.endswith("/audio/transcriptions"):
+        return WHISPER_MODEL
+    try:
+        return json.loads(request.content).get("model")
+    except (ValueError, AttributeError, httpx.RequestNotRead):
+        return None
+
+
+def _limits_hook(api_key: str):
+    """httpx response hook feeding every Groq response's limits to the scheduler."""
+    def hook(response: httpx.Response):
+        model = _request_model(response.request)
+        if model:
+            _scheduler.observe(api_key, model, response.headers)
+    return hook
+
+
+# ─── Client Registry ────────────────────────────────────────────────────────
+# One OpenAI client per API key, each backed by a bounded keep-alive pool, so
+# turns reuse warm TCP+TLS connections instead of handshaking every call.
+# Calls lease their client; one evicted from the registry mid-call is closed
+# when its last lease is returned, not under the call's feet.
+
+_clients: OrderedDict[str, OpenAI] = OrderedDict()
+_clients_lock = threading.Lock()
+_last_prewarm: dict[str, float] = {}
+_leases: dict[OpenAI, int] = {}  # client → calls using it
+_evicted: set[OpenAI] = set()     # out of the registry, waiting for its last lease
+
+
+def _new_client(api_key: str) -> OpenAI:
+    """Build a Groq client on a pooled, keep-alive httpx transport."""
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONNECTIONS,
+            max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+            keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(GROQ_READ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT),
+        http2=GROQ_HTTP2 and _HTTP2_AVAILABLE,
+        event_hooks={"response": [_limits_hook(api_key)]},
+    )
+    # Retries are the scheduler's job — it knows the limits and counts them
+    return OpenAI(api_key=api_key, base_url=GROQ_BASE_URL, http_client=http_client,
+                  max_retries=0)
+
+
+def _close_client(client: OpenAI):
+    try:
+        client.close()
+    except Exception:
+        pass
 
 
 def _get_client(api_key: str) -> OpenAI:
-    """Create a Groq-compatible OpenAI client."""
-    return OpenAI(api_key=api_key, base_url=GROQ_BASE_URL)
+    """Return the shared Groq-compatible OpenAI client for this API key, leased."""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is not None:
+            _clients.move_to_end(api_key)
+        else:
+            client = _new_client(api_key)
+            _clients[api_key] = client
+        _leases[client] = _leases.get(client, 0) + 1
+        # Bound the registry — drop the least recently used key's pool
+        idle = []
+        while len(_clients) > GROQ_CLIENT_REGISTRY_SIZE:
+            old_key, old_client = _clients.popitem(last=False)
+            _last_prewarm.pop(old_key, None)
+            if old_client in _leases:
+                _evicted.add(old_client)  # closed by _release_client
+            else:
+                idle.append(old_client)
+    for old_client in idle:
+        _close_client(old_client)
+    return client
+
+
+def _release_client(client: OpenAI):
+    """Return a lease from _get_client(); closes the client if it was evicted meanwhile."""
+    with _clients_lock:
+        n = _leases.pop(client) - 1
+        if n:
+            _leases[client] = n
+            return
+        if client not in _evicted:
+            return
+        _evicted.discard(client)
+    _close_client(client)
+
+
+@contextmanager
+def _leased_client(api_key: str):
+    """The shared client for api_key, held for the duration of the block."""
+    client = _get_client(api_key)
+    try:
+        yield client
+    finally:
+        _release_client(client)
+
+
+def prewarm_client(api_key: str):
+    """
+    Open a pooled connection to Groq in the background.
+
+    Call when voice mode is switched on so the first STT request reuses a
+    warm socket. Throttled to once per keep-alive window per API key.
+    """
+    if not api_key:
+        return
+    now = time.monotonic()
+    with _clients_lock:
+        if now - _last_prewarm.get(api_key, 0.0) < GROQ_KEEPALIVE_EXPIRY / 2:
+            return
+        _last_prewarm[api_key] = now
+
+    def _warm():
+        try:
+            with _leased_client(api_key) as client:
+                client.models.list()
+        except Exception as e:
+            print(f"[Groq Prewarm] {e}")
+
+    threading.Thread(target=_warm, name="groq-prewarm", daemon=True).start()
+
+
+def is_error_reply(text: str) -> bool:
+    """True if text is empty or an ErrorReply, not a model reply."""
+    return not text or isinstance(text, ErrorReply)
+
+
+# ─── Context Window ─────────────────────────────────────────────────────────
+# Keeps each request under a per-model token budget. Older turns are folded
+# into a running summary by a background call, one chunk at a time, so the
+# summary is ready before the history would overflow.
+
+_SUMMARY_PROMPT = """You maintain a running summary of a CRM consulting conversation.
+Merge the existing summary with the new messages into one compact summary.
+Keep every fact the user gave (business type, sales process, current tools,
+dashboard needs, each extra feature answered yes/no) and note which questions
+have already been asked. Plain text, no preamble."""
+
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English)."""
+    return len(text) // 4 + 1
+
+
+def _message_tokens(msg: dict) -> int:
+    return estimate_tokens(msg["content"]) + 4  # role/formatting overhead
+
+
+def _prefix_hash(messages: list) -> str:
+    h = hashlib.sha256()
+    for m in messages:
+        h.update(f"{m['role']}\0{m['content']}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+class ConversationContext:
+    """
+    Per-conversation context state: running summary plus token accounting.
+
+    Keep one per chat (e.g. in st.session_state) and pass it to stream_ai().
+    If the conversation no longer starts with the summarized messages (new
+    chat, loaded history), the summary is discarded automatically.
+    """
+
+    def __init__(self, summarize: bool = True):
+        self.summarize = summarize
+        self.summary = ""
+        self.summarized_upto = 0         # messages [0, n) are in the summary
+        self.last_usage: dict = {}       # token report for the latest request
+        self._summary_hash = ""
+        self._folding = False
+        self._lock = threading.Lock()
+
+    def fork(self) -> "ConversationContext":
+        """Copy of the current summary for a side request; never folds or writes back."""
+        other = ConversationContext(summarize=False)
+        with self._lock:
+            other.summary, other.summarized_upto = self.summary, self.summarized_upto
+            other._summary_hash = self._summary_hash
+        return other
+
+    def build_payload(self, api_key: str, model: str, conversation: list) -> list[dict]:
+        """System prompt + summary + recent messages, within the model's budget."""
+        clean = [{"role": m["role"], "content": m["content"]} for m in conversation]
+        system = {"role": "system", "content": CRM_SYSTEM_PROMPT}
+        budget = MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET) - MAX_TOKENS
+
+        with self._lock:
+            if self.summarized_upto and (
+                self.summarized_upto > len(clean)
+                or _prefix_hash(clean[:self.summarized_upto]) != self._summary_hash
+            ):
+                self.summary, self.summarized_upto, self._summary_hash = "", 0, ""
+            summary, upto = self.summary, self.summarized_upto
+
+        head = [system]
+        if summary:
+            head.append({"role": "system", "content": f"Summary of the conversation so far:\n{summary}"})
+        used = sum(_message_tokens(m) for m in head)
+
+        # Newest first; hard-truncate only if the summary hasn't caught up yet
+        recent = []
+        for msg in reversed(clean[upto:]):
+            cost = _message_tokens(msg)
+            if recent and used + cost > budget:
+                break
+            recent.insert(0, msg)
+            used += cost
+
+        full = _message_tokens(system) + sum(_message_tokens(m) for m in clean)
+        self.last_usage = {
+            "model": model,
+            "sent_tokens": used,
+            "full_tokens": full,
+            "saved_tokens": max(full - used, 0),
+            "summarized_messages": upto,
+            "dropped_messages": len(clean) - upto - len(recent),
+        }
+
+        if self.summarize and api_key:
+            self._maybe_fold(api_key, clean, upto, summary, budget)
+        return head + recent
+
+    def _maybe_fold(self, api_key: str, clean: list, upto: int, summary: str, budget: int):
+        """Start a background fold when unsummarized history gets large."""
+        if not _needs_fold(clean, upto, budget):
+            return
+        with self._lock:
+            if self._folding:
+                return
+            self._folding = True
+        _summary_pool.submit(self._fold, api_key, clean, upto, summary, budget)
+
+    def _fold(self, api_key: str, clean: list, upto: int, summary: str, budget: int):
+        """
+        Merge the oldest unsummarized messages into the summary a chunk at a
+        time (runs on the summary pool), until the rest fits under the trigger.
+        Each call stays small however far behind the summary is.
+        """
+        try:
+            fold_to = len(clean) - CONTEXT_KEEP_RECENT
+            while upto < fold_to and _needs_fold(clean, upto, budget):
+                end, size = upto, 0
+                while end < min(upto + CONTEXT_FOLD_CHUNK, fold_to):
+                    size += _message_tokens(clean[end])
+                    if end > upto and size > CONTEXT_FOLD_CHUNK_TOKENS:
+                        break
+                    end += 1
+                summary = _summarize(api_key, summary, clean[upto:end])
+                if not summary:
+                    return
+                with self._lock:
+                    # Only apply if nobody reset or advanced the summary meanwhile
+                    if self.summarized_upto != upto:
+                        return
+                    self.summary = summary
+                    self.summarized_upto = upto = end
+                    self._summary_hash = _prefix_hash(clean[:end])
+        except Exception as e:
+            print(f"[Context Summary Error] {e}")
+        finally:
+            with self._lock:
+                self._folding = False
+
+
+def _needs_fold(clean: list, upto: int, budget: int) -> bool:
+    """True when the unsummarized history is long enough to fold."""
+    unsummarized = clean[upto:]
+    if len(unsummarized) <= CONTEXT_KEEP_RECENT:
+        return False
+    return sum(_message_tokens(m) for m in unsummarized) >= budget * CONTEXT_SUMMARY_TRIGGER
+
+
+def _summarize(api_key: str, summary: str, messages: list) -> str:
+    """One non-streaming call on the fast model to extend the running summary."""
+    # A single oversized message is clipped so no call outgrows the chunk cap
+    limit = CONTEXT_FOLD_CHUNK_TOKENS * 4
+    transcript = "\n".join(f"{m['role'].upper()}: {m['content'][:limit]}" for m in messages)
+    prompt = f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"
+    with _leased_client(api_key) as client:
+        resp = _scheduler.run(
+            api_key, CONTEXT_SUMMARY_MODEL, estimate_tokens(prompt) + CONTEXT_SUMMARY_MAX_TOKENS,
+            lambda: client.chat.completions.create(
+                model=CONTEXT_SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": _SUMMARY_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+                max_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+                temperature=0.2,
+            ),
+        )
+    return (resp.choices[0].message.content or "").strip()
+
+
+def _chunk_prompt_tokens(chunk) -> int | None:
+    """Actual prompt token count, if the final stream chunk carries usage."""
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        x_groq = getattr(chunk, "x_groq", None) or {}
+        usage = x_groq.get("usage") if isinstance(x_groq, dict) else getattr(x_groq, "usage", None)
+    if usage is None:
+        return None
+    return usage.get("prompt_tokens") if isinstance(usage, dict) else getattr(usage, "prompt_tokens", None)
+
+
+# ─── Cancellation Stats ─────────────────────────────────────────────────────
+# Replies closed early (Stop, barge-in, disconnect) stop generating upstream.
+# Tokens saved are estimated against the recent average reply length.
+
+class _GenerationStats:
+    def __init__(self, window: int = 50):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)  # completion tokens of finished replies
+        self.completed = 0
+        self.cancelled = 0
+        self.tokens_saved = 0
+        self.hedge_lost = 0      # requests closed because the other hedge racer won
+
+    def finished(self, tokens: int):
+        with self._lock:
+            self.completed += 1
+            self._recent.append(tokens)
+
+    def expected(self) -> int:
+        """Typical completion length — recent average, MAX_TOKENS until known."""
+        with self._lock:
+            if not self._recent:
+                return MAX_TOKENS
+            return int(min(sum(self._recent) / len(self._recent), MAX_TOKENS))
+
+    def stopped(self, tokens: int) -> int:
+        """Record an early close; returns the estimated tokens it saved."""
+        expected = self.expected()
+        with self._lock:
+            saved = max(expected - tokens, 0)
+            self.cancelled += 1
+            self.tokens_saved += saved
+            return saved
+
+    def lost(self):
+        """Record a hedge racer closed because the other one answered first."""
+        with self._lock:
+            self.hedge_lost += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"completed": self.completed, "cancelled": self.cancelled,
+                    "tokens_saved": self.tokens_saved, "hedge_lost": self.hedge_lost}
+
+
+_generation = _GenerationStats()
+
+
+def generation_stats() -> dict:
+    """Finished vs cancelled replies and estimated tokens saved (this process)."""
+    return _generation.snapshot()
+
+
+def record_early_close(generated: str, lost_race: bool = False) -> int:
+    """
+    Account a reply closed before it finished, for callers that close with
+    track_close=False (hedged streams).
+
+    Returns:
+        Estimated completion tokens saved — 0 for a lost hedge race, which is
+        a duplicate request and not a stop
+    """
+    if lost_race:
+        _generation.lost()
+        return 0
+    return _generation.stopped(estimate_tokens(generated))
 
 
 # ─── Streaming LLM ──────────────────────────────────────────────────────────
 
-def stream_ai(api_key: str, model: str, conversation: list):
+def stream_ai(api_key: str, model: str, conversation: list,
+              context: ConversationContext | None = None,
+              user_key: str = "", on_queue=None, on_rate_limit=None,
+              admitted: bool = False, track_close: bool = True):
     """
     Stream LLM response token-by-token.
 
@@ -25,101 +657,265 @@ def stream_ai(api_key: str, model: str, conversation: list):
         api_key: Groq API key
         model: Model identifier (e.g. "llama-3.3-70b-versatile")
         conversation: List of {"role": ..., "content": ...} dicts
+        context: Conversation's ConversationContext (running summary and
+                 token report). Without one, old turns are only truncated.
+        user_key: Whose admission queue to wait in when the LLM gate is full
+        on_queue: Called with the queue position while waiting (e.g. to show
+                  "you're in queue")
+        on_rate_limit: Called with the seconds left while Groq's rate limit
+                       holds the request back (see RateLimitScheduler.run)
+        admitted: The caller already holds an LLM admission slot for
+                  user_key; it is released when the stream ends
+        track_close: Count an early close as a stop (tokens saved). Off when
+                     the caller does that accounting itself
 
     Yields:
-        str: Text chunks (tokens) as they arrive
+        str: Text chunks (tokens) as they arrive; on failure a single
+             ErrorReply instead
+
+    Closing the generator early closes the upstream stream; the estimated
+    tokens that saved land in context.last_usage["tokens_saved"].
     """
     if not api_key:
-        yield "Please add your Groq API key in the sidebar to continue."
+        yield ErrorReply("Please add your Groq API key in the sidebar to continue.")
         return
 
+    stream = client = None
+    generated = ""
+    holding = admitted
     try:
+        # Slot is held until the stream ends or the generator is closed
+        if not holding:
+            gates["llm"].acquire(user_key, on_queue)
+            holding = True
         client = _get_client(api_key)
-        clean = [{"role": m["role"], "content": m["content"]} for m in conversation]
-        payload = [{"role": "system", "content": CRM_SYSTEM_PROMPT}] + clean
-
-        stream = client.chat.completions.create(
-            model=model,
-            messages=payload,
-            max_tokens=MAX_TOKENS,
-            temperature=TEMPERATURE,
-            stream=True,
+        ctx = context or ConversationContext(summarize=False)
+        payload = ctx.build_payload(api_key, model, conversation)
+
+        stream = _scheduler.run(
+            api_key, model, ctx.last_usage["sent_tokens"] + _generation.expected(),
+            lambda: client.chat.completions.create(
+                model=model,
+                messages=payload,
+                max_tokens=MAX_TOKENS,
+                temperature=TEMPERATURE,
+                stream=True,
+            ),
+            on_rate_limit,
         )
 
         for chunk in stream:
             if chunk.choices and chunk.choices[0].delta.content:
+                generated += chunk.choices[0].delta.content
                 yield chunk.choices[0].delta.content
+            prompt_tokens = _chunk_prompt_tokens(chunk)
+            if prompt_tokens:
+                ctx.last_usage["prompt_tokens"] = prompt_tokens
+        _generation.finished(estimate_tokens(generated))
 
+    except GeneratorExit:
+        if stream is not None and track_close:
+            saved = _generation.stopped(estimate_tokens(generated))
+            ctx.last_usage["tokens_saved"] = saved
+        raise
     except Exception as e:
-        err = str(e)
-        if "401" in err or "invalid_api_key" in err.lower():
-            yield "Invalid API key — check the sidebar."
-        elif "rate_limit" in err.lower():
-            yield "Rate limit hit. Please wait a moment."
-        elif "connection" in err.lower():
-            yield "Connection error. Check your internet."
-        else:
-            yield f"Error: {err}"
+        yield SERVER_BUSY_REPLY if isinstance(e, AdmissionTimeout) else _error_reply(e)
+    finally:
+        # Closing the generator early (barge-in, rerun) drops the HTTP stream,
+        # so Groq stops generating instead of running to max_tokens
+        if stream is not None:
+            stream.close()
+        if client is not None:
+            _release_client(client)
+        if holding:
+            gates["llm"].release(user_key)
+
+
+def _error_reply(e: Exception) -> ErrorReply:
+    """The user-facing message for a failed LLM call."""
+    err = str(e)
+    if "401" in err or "invalid_api_key" in err.lower():
+        return ErrorReply("Invalid API key — check the sidebar.")
+    if isinstance(e, (RateLimitError, RateLimitTimeout)) or "rate_limit" in err.lower():
+        return ErrorReply("Rate limit hit. Please wait a moment.")
+    if "connection" in err.lower():
+        return ErrorReply("Connection error. Check your internet.")
+    return ErrorReply(f"Error: {err}")
 
 
-def call_ai(api_key: str, model: str, conversation: list) -> str:
+def call_ai(api_key: str, model: str, conversation: list, on_rate_limit=None) -> str:
     """
-    Non-streaming LLM call. Returns the full response as a string.
-    Used for the initial greeting where streaming isn't needed.
+    Non-streaming LLM call. Returns the full response as a string, or an
+    ErrorReply on failure. Used for the initial greeting where streaming
+    isn't needed; on_rate_limit is as for stream_ai.
     """
     if not api_key:
-        return "Please add your Groq API key in the sidebar to continue."
+        return ErrorReply("Please add your Groq API key in the sidebar to continue.")
 
+    client = None
     try:
         client = _get_client(api_key)
-        clean = [{"role": m["role"], "content": m["content"]} for m in conversation]
-        payload = [{"role": "system", "content": CRM_SYSTEM_PROMPT}] + clean
+        payload = ConversationContext(summarize=False).build_payload(api_key, model, conversation)
 
-        resp = client.chat.completions.create(
-            model=model,
-            messages=payload,
-            max_tokens=MAX_TOKENS,
-            temperature=TEMPERATURE,
+        tokens = sum(_message_tokens(m) for m in payload) + _generation.expected()
+        resp = _scheduler.run(
+            api_key, model, tokens,
+            lambda: client.chat.completions.create(
+                model=model,
+                messages=payload,
+                max_tokens=MAX_TOKENS,
+                temperature=TEMPERATURE,
+            ),
+            on_rate_limit,
         )
         return resp.choices[0].message.content
 
     except Exception as e:
-        err = str(e)
-        if "401" in err or "invalid_api_key" in err.lower():
-            return "Invalid API key — check the sidebar."
-        elif "rate_limit" in err.lower():
-            return "Rate limit hit. Please wait a moment."
-        elif "connection" in err.lower():
-            return "Connection error. Check your internet."
-        return f"Error: {err}"
+        return _error_reply(e)
+    finally:
+        if client is not None:
+            _release_client(client)
 
 
 # ─── Speech-to-Text ─────────────────────────────────────────────────────────
 
-def call_stt(api_key: str, audio_bytes: bytes) -> str:
+def call_stt(api_key: str, audio_bytes: bytes, filename: str = "recording.wav",
+             prompt: str = "", user_key: str = "", on_queue=None, on_rate_limit=None) -> str:
     """
     Transcribe audio using Groq's Whisper API.
 
     Args:
         api_key: Groq API key
         audio_bytes: Raw audio bytes (WAV format)
+        filename: Upload name; its extension tells the API the container
+        prompt: Preceding transcript, so a continuation segment keeps context
+        user_key: Whose admission queue to wait in when the STT gate is full
+        on_queue: Called with the queue position while waiting
+        on_rate_limit: As for stream_ai
 
     Returns:
-        Transcribed text, or empty string on failure
+        Transcribed text; empty without an API key, an ErrorReply on failure
     """
     if not api_key:
         return ""
 
+    client = None
     try:
         client = _get_client(api_key)
-        buf = io.BytesIO(audio_bytes)
-        buf.name = "recording.wav"
-        result = client.audio.transcriptions.create(
-            model=WHISPER_MODEL,
-            file=buf,
-            response_format="text",
-        )
+        kwargs = {"prompt": prompt[-_PROMPT_CHARS:]} if prompt else {}
+
+        def transcribe():
+            buf = io.BytesIO(audio_bytes)  # fresh per attempt — a retry re-reads it
+            buf.name = filename
+            return client.audio.transcriptions.create(
+                model=WHISPER_MODEL,
+                file=buf,
+                response_format="text",
+                **kwargs,
+            )
+
+        with gates["stt"].slot(user_key, on_queue):
+            result = _scheduler.run(api_key, WHISPER_MODEL, 0, transcribe, on_rate_limit)
         return (result if isinstance(result, str) else result.text).strip()
 
     except Exception as e:
-        return f"[Transcription error: {e}]"
+        return ErrorReply(f"[Transcription error: {e}]")
+    finally:
+        if client is not None:
+            _release_client(client)
+
+
+# Whisper reads at most ~224 prompt tokens; keep the tail of the transcript
+_PROMPT_CHARS = 800
+
+_stt_pool = ThreadPoolExecutor(max_workers=STT_STREAM_WORKERS, thread_name_prefix="stt-stream")
+
+
+class StreamingTranscript:
+    """
+    Incremental transcription of one utterance uploaded in segments.
+
+    Each segment is an independently decodable recording. add() starts its
+    transcription in the background; finish() waits for the rest and joins
+    the partial transcripts in segment order. Keep one per utterance (e.g. in
+    st.session_state) while the user is talking.
+    """
+
+    def __init__(self, api_key: str, utterance_id: str, user_key: str = ""):
+        self.api_key = api_key
+        self.utterance_id = utterance_id
+        self.user_key = user_key
+        self.started_at = time.perf_counter()
+        self.upload_bytes = 0
+        self.stt_bytes = 0
+        self._lock = threading.Lock()
+        self._segments: dict[int, Future] = {}
+        self._silent: set[int] = set()   # seqs delivered without audio (nothing to transcribe)
+        self._texts: dict[int, str] = {}
+
+    def add(self, seq: int, audio: bytes, filename: str, normalize: bool = False):
+        """Queue segment `seq` for transcription; normalize unprepared audio first."""
+        with self._lock:
+            if not audio:
+                self._silent.add(seq)
+                return
+            if seq in self._segments:
+                return  # duplicate delivery after a rerun
+            self.upload_bytes += len(audio)
+            self._segments[seq] = _stt_pool.submit(self._transcribe, seq, audio, filename, normalize)
+
+    def _transcribe(self, seq: int, audio: bytes, filename: str, normalize: bool) -> str:
+        if normalize:
+            prepared = normalize_upload(audio)
+            if prepared is not audio:
+                audio, filename = prepared, "recording.webm"
+        with self._lock:
+            self.stt_bytes += len(audio)
+            # Context from the previous segment if it is already done — never wait for it
+            prompt = self._texts.get(seq - 1, "")
+        text = call_stt(self.api_key, audio, filename=filename, prompt=prompt,
+                        user_key=self.user_key)
+        if is_error_reply(text):
+            print(f"[STT Stream] Segment {seq}: {text}")
+            text = ""
+        with self._lock:
+            self._texts[seq] = text
+        return text
+
+    @property
+    def segments(self) -> int:
+        return len(self._segments)
+
+    def received(self) -> list[int]:
+        """Seqs of the segments added so far (acknowledged to the browser)."""
+        with self._lock:
+            return sorted(self._segments.keys() | self._silent)
+
+    def missing(self, last_seq: int) -> int:
+        """Segments up to last_seq that never arrived — silent ones don't count."""
+        with self._lock:
+            return last_seq + 1 - len(self._segments.keys() | self._silent)
+
+    def finish(self, timeout: float = STT_STREAM_TIMEOUT) -> str:
+        """
+        Wait for outstanding segments and merge them.
+
+        Returns:
+            The utterance transcript, empty if no segment produced text
+        """
+        deadline = time.monotonic() + timeout
+        parts = []
+        for seq in sorted(self._segments):
+            try:
+                text = self._segments[seq].result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception as e:
+                print(f"[STT Stream] Segment {seq} dropped: {e}")
+                continue
+            if text:
+                parts.append(text)
+        return " ".join(parts)
+
+    def cancel(self):
+        """Abandon the utterance; segments not yet started are skipped."""
+        for future in self._segments.values():
+            future.cancel()
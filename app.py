@@ -1,24 +1,41 @@
 import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import os
 import time
-import base64
 from datetime import datetime
 from dotenv import load_dotenv
 
 # ─── Local modules ────────────────────────────────────────────────────────────
-from config import DEFAULT_MODEL, MODEL_OPTIONS, EDGE_TTS_VOICE
+from config import (
+    DEFAULT_MODEL, MODEL_OPTIONS, EDGE_TTS_VOICE, SESSIONS_PAGE_SIZE, CHAT_FRAGMENTS,
+    TRANSCRIPT_WINDOW, TRANSCRIPT_PAGE_TURNS, DISCONNECT_CHECK_INTERVAL,
+    ROUTING_ENABLED, HEDGE_ENABLED, HEDGE_MODEL, ROUTE_FAST_MODEL, ROUTE_SUMMARY_MODEL,
+)
 from auth import (
     register_user, login_user, is_admin,
-    list_histories, save_history, load_history_file, delete_history_file,
+    list_histories, save_history, load_history_page, delete_history_file,
     make_title,
 )
 from admin import render_admin_dashboard
-from ai_services import stream_ai, call_ai, call_stt
-from tts_service import synthesize
+from ai_services import (
+    call_ai, call_stt, prewarm_client, ConversationContext, StreamingTranscript,
+    is_error_reply, last_call_info, ErrorReply,
+)
+from model_router import route_turn, stream_hedged, report_tags
+from tts_service import SentencePipeline, prewarm_tts, audio_seconds
+from greeting_store import greeting_store
+from latency_trace import tracer, RunMeter
+from stream_render import StreamRenderer, message_html
 from voice_component import voice_loop_component
+from audio_store import audio_store
+from audio_prep import normalize_upload, upload_filename
 
 load_dotenv()
 
+# Script-seconds and DB calls of this full run (see chat_area for fragment runs)
+run_meter = RunMeter("app")
+
 # ─── Page Config ──────────────────────────────────────────────────────────────
 st.set_page_config(
     page_title="CRM Assistant",
@@ -247,12 +264,30 @@ defaults = {
     "session_id": None,
     "loaded_file": None,
     "auth_tab": "login",
-    "voice_tts_b64": "",
+    "voice_tts_handles": [],        # audio_store handles of the reply to speak
+    "voice_tts_id": "",
+    "voice_tts_lead": None,         # {"started", "seconds"}: first handle already playing on the page
+    "history_limit": SESSIONS_PAGE_SIZE,
+    "show_latency": False,
+    "pending_trace": None,
+    "last_turn_trace": None,
+    "history_first_turn": None,     # oldest turn_idx loaded; None = whole chat in memory
+    "transcript_window": TRANSCRIPT_WINDOW,
+    "voice_stt_stream": None,       # StreamingTranscript of the utterance in progress
+    "voice_barge_in": None,         # how the user interrupted the last reply, for the next trace
+    "stop_requested": False,        # "Stop generating" clicked during the last run
+    "tokens_saved": 0,              # estimated completion tokens not generated this session
+    "route_turns": ROUTING_ENABLED,  # per-turn model routing instead of the sidebar model
+    "hedge_replies": HEDGE_ENABLED,  # race the fast model when the first token is slow
 }
 for k, v in defaults.items():
     if k not in st.session_state:
         st.session_state[k] = v
 
+# Running summary + token report; resets itself when the chat changes
+if "chat_context" not in st.session_state:
+    st.session_state.chat_context = ConversationContext()
+
 if "api_key" not in st.session_state:
     try:
         st.session_state.api_key = st.secrets.get("GROQ_API_KEY", os.getenv("GROQ_API_KEY", ""))
@@ -297,6 +332,7 @@ if st.session_state.current_user is None:
                     st.session_state.last_audio_id = None
                     st.session_state.session_id = None
                     st.session_state.loaded_file = None
+                    st.session_state.history_first_turn = None
                     st.rerun()
                 else:
                     st.error(key_or_err)
@@ -353,7 +389,8 @@ with st.sidebar:
 
     if st.button(" Logout", use_container_width=True):
         for k in ["current_user", "messages", "greeted", "last_spoken_idx",
-                   "last_audio_id", "session_id", "loaded_file", "voice_mode"]:
+                   "last_audio_id", "session_id", "loaded_file", "voice_mode",
+                   "history_first_turn", "transcript_window"]:
             st.session_state[k] = defaults.get(k, None)
         st.rerun()
 
@@ -375,6 +412,16 @@ with st.sidebar:
     st.markdown("### Model")
     chosen = st.selectbox("m", list(MODEL_OPTIONS.keys()), index=0, label_visibility="collapsed")
     st.session_state.model = MODEL_OPTIONS[chosen]
+    st.session_state.route_turns = st.toggle(
+        "Route per turn", value=st.session_state.route_turns,
+        help=f"Questions on {ROUTE_FAST_MODEL}, the summary on {ROUTE_SUMMARY_MODEL}.",
+    )
+    st.session_state.hedge_replies = st.toggle(
+        "Hedge slow replies", value=st.session_state.hedge_replies,
+        help=f"If the first word is slow, also ask {HEDGE_MODEL} and use whichever answers first.",
+    )
+    # Keep greetings ready for the selected model (no-op once its pool is full)
+    greeting_store.warm([st.session_state.model])
 
     st.markdown("---")
     st.markdown("### Voice Mode")
@@ -385,6 +432,8 @@ with st.sidebar:
     if st.session_state.voice_mode:
         st.markdown("<small style='color:#a855f7'></small>",
                     unsafe_allow_html=True)
+        # Warm a Groq connection so the first STT upload skips the handshake
+        prewarm_client(st.session_state.api_key)
 
     st.markdown("---")
 
@@ -398,9 +447,11 @@ with st.sidebar:
         st.session_state.last_spoken_idx = -1
         st.session_state.session_id = None
         st.session_state.loaded_file = None
+        st.session_state.history_first_turn = None
+        st.session_state.transcript_window = TRANSCRIPT_WINDOW
         st.rerun()
 
-    histories = list_histories(user_key)
+    histories = list_histories(user_key, limit=st.session_state.history_limit)
 
     if not histories:
         st.markdown("<small style='color:#4b5563'>No saved chats yet.</small>",
@@ -410,7 +461,7 @@ with st.sidebar:
             title = meta.get("title", "Untitled")
             ts = meta.get("saved_at", 0)
             date = datetime.fromtimestamp(ts).strftime("%b %d, %I:%M %p") if ts else ""
-            n_msg = len(meta.get("messages", []))
+            n_msg = meta.get("message_count", 0)
             is_cur = (st.session_state.loaded_file == fname)
 
             col_open, col_del = st.columns([5, 1])
@@ -418,10 +469,15 @@ with st.sidebar:
                 label = f"{' ' if is_cur else ''}{title}"
                 if st.button(label, key=f"load_{fname}", use_container_width=True,
                              help=f"{n_msg} messages · {date}"):
-                    data = load_history_file(user_key, fname)
-                    st.session_state.messages = data["messages"]
+                    # Newest page only; older turns load on demand
+                    page = load_history_page(user_key, fname)
+                    st.session_state.messages = page["messages"]
+                    st.session_state.history_first_turn = (
+                        page["first_turn"] if page["has_more"] else None
+                    )
+                    st.session_state.transcript_window = TRANSCRIPT_WINDOW
                     st.session_state.greeted = True
-                    st.session_state.last_spoken_idx = len(data["messages"]) - 1
+                    st.session_state.last_spoken_idx = len(page["messages"]) - 1
                     st.session_state.last_audio_id = None
                     st.session_state.session_id = fname.replace(".json", "")
                     st.session_state.loaded_file = fname
@@ -434,10 +490,22 @@ with st.sidebar:
                         st.session_state.greeted = False
                         st.session_state.session_id = None
                         st.session_state.loaded_file = None
+                        st.session_state.history_first_turn = None
                     st.rerun()
 
+        # A full page suggests there are older chats
+        if len(histories) >= st.session_state.history_limit:
+            if st.button("Show older chats", use_container_width=True):
+                st.session_state.history_limit += SESSIONS_PAGE_SIZE
+                st.rerun()
+
     st.markdown("---")
-    st.markdown(f"**Messages:** {len(st.session_state.messages)}")
+    # Message count, context usage and latency sit under the chat input, which
+    # reruns on its own after each turn
+    st.session_state.show_latency = st.toggle(
+        "Show latency", value=st.session_state.show_latency,
+        help="Per-stage timing of the last turn.",
+    )
     st.markdown("<small>CRM Consultant · Groq + Llama 3 · Edge-TTS</small>", unsafe_allow_html=True)
 
 # ─── Header ──────────────────────────────────────────────────────────────────
@@ -473,145 +541,524 @@ def auto_save():
     st.session_state.loaded_file = f"{sid}.json"
 
 
+def load_earlier_messages(limit: int | None = TRANSCRIPT_PAGE_TURNS):
+    """Prepend the previous page of a partially loaded chat (keyset on turn_idx)."""
+    page = load_history_page(user_key, st.session_state.loaded_file,
+                             before_turn=st.session_state.history_first_turn, limit=limit)
+    st.session_state.messages[:0] = page["messages"]
+    st.session_state.history_first_turn = page["first_turn"] if page["has_more"] else None
+    return len(page["messages"])
+
+
+def complete_history():
+    """The model and saves need the whole chat — fetch any turns not loaded yet."""
+    if st.session_state.history_first_turn is not None:
+        load_earlier_messages(limit=None)
+        st.session_state.last_spoken_idx = len(st.session_state.messages) - 1
+
+
+def stream_voice_segment(result: dict) -> StreamingTranscript:
+    """Start transcribing a segment of the utterance in progress."""
+    stream = st.session_state.voice_stt_stream
+    if stream is None or stream.utterance_id != result["utterance"]:
+        if stream is not None:
+            stream.cancel()  # an utterance whose final segment never arrived
+        stream = StreamingTranscript(st.session_state.api_key, result["utterance"], user_key)
+        st.session_state.voice_stt_stream = stream
+    stream.add(result["seq"], result["audio"], upload_filename(result["mime"]),
+               normalize=not result["prepared"])
+    return stream
+
+
+def transcribe_voice(result: dict, trace) -> str:
+    """Transcript of a finished utterance — merged stream segments or one upload."""
+    trace.tags.update(client_prepared=result["prepared"], trimmed_ms=result["trimmed_ms"])
+    if result["utterance"]:
+        # Segments whose own value was overwritten before a rerun read it
+        for segment in result["resend"]:
+            stream_voice_segment({**result, **segment})
+        stream = stream_voice_segment(result)
+        st.session_state.voice_stt_stream = None
+        # Only the tail (and any segment still in flight) is left to wait for
+        with st.spinner("Transcribing..."), trace.span("stt"):
+            transcript = stream.finish()
+        trace.tags.update(stt_mode="streaming", stt_segments=stream.segments,
+                          stt_resent=len(result["resend"]),
+                          stt_missing=stream.missing(result["seq"]),
+                          upload_bytes=stream.upload_bytes, stt_bytes=stream.stt_bytes)
+        return transcript
+
+    audio_bytes, mime = result["audio"], result["mime"]
+    trace.tags.update(stt_mode="batch", upload_bytes=len(audio_bytes))
+    if not result["prepared"]:
+        # Browser couldn't downmix/trim — do it here before STT
+        with trace.span("normalize"):
+            prepared = normalize_upload(audio_bytes)
+        if prepared is not audio_bytes:
+            audio_bytes, mime = prepared, "audio/webm"
+    trace.tags["stt_bytes"] = len(audio_bytes)
+    notice = st.empty()
+    with st.spinner("Transcribing..."), trace.span("stt"):
+        transcript = call_stt(st.session_state.api_key, audio_bytes, filename=upload_filename(mime),
+                              user_key=user_key, on_queue=queue_notice(notice, trace, "stt"),
+                              on_rate_limit=rate_limit_notice(notice, trace, "stt"))
+    notice.empty()
+    groq = last_call_info()
+    trace.tags.update(stt_wait_ms=round(groq["wait_s"] * 1000), stt_retries=groq["retries"])
+    return transcript
+
+
+def rate_limit_text(seconds: float) -> str:
+    """Notice shown while a Groq call waits for rate-limit capacity."""
+    return f"Waiting for the rate limit — about {max(round(seconds), 1)}s…"
+
+
+def rate_limit_notice(placeholder, trace, backend: str):
+    """
+    on_rate_limit callback: show how long Groq's rate limit holds the call.
+
+    Called every few hundred ms while waiting. In a turn, wrap it with
+    interruptible() so a pending Stop or barge-in ends the wait.
+    """
+    def show(seconds: float):
+        peak = f"{backend}_rate_wait_peak_ms"
+        trace.tags[peak] = max(round(seconds * 1000), trace.tags.get(peak, 0))
+        placeholder.info(rate_limit_text(seconds))
+    return show
+
+
 # ─── Auto Greeting ────────────────────────────────────────────────────────────
 if not st.session_state.messages and not st.session_state.greeted and st.session_state.api_key:
-    with st.spinner("typing…"):
-        greeting = call_ai(st.session_state.api_key, st.session_state.model, [])
-    st.session_state.messages.append({"role": "assistant", "content": greeting})
+    pooled = greeting_store.take(st.session_state.model)
+    if pooled:
+        greeting, greeting_audio = pooled["text"], pooled["audio"]
+    else:
+        # Cold pool (first run for this model) — fall back to a live call
+        notice = st.empty()
+        with st.spinner("typing…"):
+            greeting = call_ai(st.session_state.api_key, st.session_state.model, [],
+                               on_rate_limit=lambda s: notice.info(rate_limit_text(s)))
+        notice.empty()
+        greeting_store.add(st.session_state.model, greeting)
+        greeting_audio = b""
     st.session_state.greeted = True
-    auto_save()
-    st.rerun()
+    if is_error_reply(greeting):
+        # Don't open the chat with an error message — it would be saved and spoken
+        st.warning(greeting)
+    else:
+        st.session_state.messages.append({"role": "assistant", "content": greeting})
+        if st.session_state.voice_mode and greeting_audio:
+            st.session_state.voice_tts_handles = [audio_store.put(greeting_audio)]
+            st.session_state.voice_tts_id = str(time.time_ns())
+        auto_save()
+        st.rerun()
 
 # ─── No API key ──────────────────────────────────────────────────────────────
 if not st.session_state.api_key and not st.session_state.messages:
     st.info("Add your Groq API key in the sidebar to start chatting.")
 
-# ─── Chat Messages (history) ─────────────────────────────────────────────────
-summary_present = False
+# ─── Chat Area (fragment) ────────────────────────────────────────────────────
+# The transcript, voice loop and input form share one st.fragment: a turn from
+# either input ends with a fragment-scoped rerun, so the CSS, header and
+# sidebar (with its history query) are not re-executed. A turn that starts a
+# new chat still reruns the whole app so the chat appears in the sidebar.
 
-for i, msg in enumerate(st.session_state.messages):
-    safe = (msg["content"]
-            .replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
-    if msg["role"] == "user":
-        st.markdown(
-            f'<div class="msg-user"><div class="bubble-user">{safe}</div></div>',
-            unsafe_allow_html=True)
-    else:
-        st.markdown(f"""
-<div class="msg-bot">
-  <div class="bot-av"></div>
-  <div class="bubble-bot">{safe}</div>
-</div>""", unsafe_allow_html=True)
-        if "**Here's everything I've gathered so far:**" in msg["content"]:
-            summary_present = True
-
-# ─── Download ────────────────────────────────────────────────────────────────
-if summary_present:
-    summary_text = next(
-        (m["content"] for m in reversed(st.session_state.messages)
-         if "**Here's everything I've gathered so far:**" in m["content"]), ""
-    )
-    st.markdown("<div class='dl-box'>All details collected — download your summary below.</div>",
-                unsafe_allow_html=True)
-    st.download_button("Download Requirements Summary",
-                       data=summary_text.encode("utf-8"),
-                       file_name="bigin_crm_requirements.txt",
-                       mime="text/plain", use_container_width=True)
+def rerun_chat(meter: RunMeter, full: bool = False):
+    """Close the run's meter and rerun the chat area (or the whole app)."""
+    meter.close()
+    # Fragment-scoped reruns are only allowed from inside a fragment run
+    scoped = CHAT_FRAGMENTS and not full and meter.scope == "fragment"
+    st.rerun(scope="fragment" if scoped else "app")
 
-# ─── Streaming container (above the input form) ─────────────────────────────
-streaming_container = st.container()
 
-st.markdown("<div style='height:10px'></div>", unsafe_allow_html=True)
+def chat_fragment(fn):
+    return st.fragment(fn) if CHAT_FRAGMENTS else fn
+
+
+def client_connected() -> bool:
+    """False once the browser behind this session has disconnected."""
+    try:
+        ctx = get_script_run_ctx()
+        return ctx is None or runtime.get_instance().is_active_session(ctx.session_id)
+    except Exception:
+        return True  # runtime API unavailable — assume connected
+
 
+def rerun_requested() -> bool:
+    """
+    True once the browser has asked for a rerun this run hasn't handled yet.
 
-def handle_user_message(user_msg: str, voice_reply: bool = False):
+    A barge-in, a click or a new message inside the chat fragment only queues
+    a fragment rerun, and Streamlit never lets one preempt the running script
+    — so the stream loop polls this instead of waiting to be interrupted.
+    """
+    try:
+        requests = get_script_run_ctx().script_requests
+        return requests is not None and requests._state.name == "RERUN"
+    except Exception:
+        return False  # runtime API unavailable — rely on preemption
+
+
+class TurnInterrupted(BaseException):
+    """
+    A rerun is pending while the turn waits. Not an Exception, like
+    Streamlit's own rerun signal, so the LLM call doesn't report it as a
+    failed request on its way out.
+    """
+
+
+def interruptible(callback):
+    """Wrap a wait callback so the wait ends once rerun_requested()."""
+    def check(value):
+        if rerun_requested():
+            raise TurnInterrupted()
+        callback(value)
+    return check
+
+
+def queue_notice(placeholder, trace, backend: str):
+    """on_queue callback: show the user's place in the admission queue."""
+    shown = None
+
+    def show(position: int):
+        nonlocal shown
+        if position == shown:
+            return  # called every poll — only redraw when the place changes
+        shown = position
+        peak = f"{backend}_queue_peak"
+        trace.tags[peak] = max(position, trace.tags.get(peak, 0))
+        placeholder.info(f"You're in queue — position {position}. "
+                         "We'll start as soon as a slot frees up.")
+    return show
+
+
+def request_stop():
+    """
+    on_click for "Stop generating". Runs only in the rerun after the click;
+    the stream loop stops as soon as it sees that rerun pending.
+    """
+    st.session_state.stop_requested = True
+
+
+def abandon_turn(tokens, pipeline, partial: str, trace, report: dict,
+                 reason: str = "interrupted"):
+    """
+    Clean up a turn that ended mid-stream.
+
+    A full rerun (New Chat, sidebar) stops the script at its next Streamlit
+    call; a barge-in, Stop or a new message (see rerun_requested) and a
+    closed tab are noticed by the stream loop. Close the LLM stream and
+    cancel pending syntheses so nobody pays for a reply that won't be read
+    or heard, then save what was generated — or, if nothing was, drop the
+    unanswered user message so the next turn doesn't send two in a row.
+    """
+    tokens.close()  # stream_hedged fills report["tokens_saved"] before returning
+    cancelled = pipeline.cancel() if pipeline else 0
+    saved = report.get("tokens_saved", 0)
+    st.session_state.tokens_saved += saved
+    if partial:
+        st.session_state.messages.append({"role": "assistant", "content": partial})
+        st.session_state.last_spoken_idx = len(st.session_state.messages) - 1
+        auto_save()
+    elif st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
+        st.session_state.messages.pop()
+    trace.tags.update(outcome=reason, tts_cancelled=cancelled, tokens_saved=saved)
+    tracer.finish(trace)
+
+
+def handle_user_message(user_msg: str, streaming_container, meter: RunMeter,
+                        voice_reply: bool = False, trace=None):
     """Process a user message: stream LLM response, save, and rerun."""
+    if trace is None:
+        trace = tracer.start(user_key, st.session_state.session_id,
+                             st.session_state.model, voice_reply)
+    complete_history()
     st.session_state.messages.append({"role": "user", "content": user_msg})
 
     # Stream into the container that sits ABOVE the input
     with streaming_container:
-        safe_user = user_msg.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-        st.markdown(
-            f'<div class="msg-user"><div class="bubble-user">{safe_user}</div></div>',
-            unsafe_allow_html=True,
-        )
+        st.markdown(message_html("user", user_msg), unsafe_allow_html=True)
 
         full_response = ""
-        message_placeholder = st.empty()
-
-        for token in stream_ai(st.session_state.api_key, st.session_state.model,
-                               st.session_state.messages):
-            full_response += token
-            safe = (full_response
-                    .replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
-            message_placeholder.markdown(f"""
-<div class="msg-bot">
-  <div class="bot-av"></div>
-  <div class="bubble-bot">{safe}<span class="streaming-dot"></span></div>
-</div>""", unsafe_allow_html=True)
+        bubble = st.empty()
+        renderer = StreamRenderer(bubble)
+        stop_slot = st.empty()
+        stop_slot.button("Stop generating", key=f"stop_{trace.turn_id}", on_click=request_stop)
+
+        # Voice replies are synthesized sentence-by-sentence while streaming;
+        # the first sentence plays from lead_slot as soon as it is ready
+        pipeline = SentencePipeline(user_key=user_key) if voice_reply else None
+        lead, lead_started = None, 0.0
+        if pipeline:
+            prewarm_tts()
+            lead_slot = st.empty()
+
+        stream_started = time.perf_counter()
+        model, route = st.session_state.model, "selected"
+        if st.session_state.route_turns:
+            model, route = route_turn(st.session_state.messages)
+        trace.tags.update(model=model, route=route)
+
+        # Under load the bubble shows the queue position until the first token
+        report = {}
+        tokens = stream_hedged(st.session_state.api_key, model,
+                               st.session_state.messages, context=st.session_state.chat_context,
+                               hedge_model=HEDGE_MODEL if st.session_state.hedge_replies else None,
+                               user_key=user_key,
+                               on_queue=interruptible(queue_notice(bubble, trace, "llm")),
+                               on_rate_limit=interruptible(rate_limit_notice(bubble, trace, "llm")),
+                               report=report)
+        next_check = stream_started + DISCONNECT_CHECK_INTERVAL
+        ended = None
+        failure = None
+        try:
+            for token in tokens:
+                if isinstance(token, ErrorReply):
+                    failure = token  # the stream's last item — never shown as reply text
+                    continue
+                if not full_response:
+                    first_token_at = time.perf_counter()
+                    trace.record("llm_ttft", first_token_at - stream_started)
+                full_response += token
+                if pipeline:
+                    pipeline.feed(token)
+                    if lead is None:
+                        lead = pipeline.take_lead()
+                        if lead:
+                            lead_slot.audio(lead, format="audio/mpeg", autoplay=True)
+                            lead_started = time.time()
+                            trace.record("tts_lead", time.perf_counter() - first_token_at)
+                renderer.feed(token)
+                if time.perf_counter() >= next_check:
+                    next_check = time.perf_counter() + DISCONNECT_CHECK_INTERVAL
+                    if rerun_requested():
+                        break  # Stop, barge-in or a new message is waiting
+                    if not client_connected():
+                        ended = "disconnected"
+                        break
+            else:
+                ended = "completed"
+        except TurnInterrupted:
+            pass  # Stop, barge-in or a new message while queued or rate limited
+        finally:
+            trace.tags.update(report_tags(report))
+            if ended != "completed":
+                abandon_turn(tokens, pipeline, full_response, trace, report,
+                             ended or "interrupted")
+        if ended != "completed":
+            return  # the pending rerun (if any) takes over
+        stop_slot.empty()
+        groq = report.get("groq") or last_call_info()
+        trace.tags.update(groq_wait_ms=round(groq["wait_s"] * 1000), groq_retries=groq["retries"])
+        if not full_response:
+            # Rate limit outlasted the scheduler, bad key, network… Show it, but
+            # never save it into the chat or speak it
+            bubble.warning(failure or "No reply — please try again.")
+            if pipeline:
+                pipeline.cancel()
+            st.session_state.messages.pop()
+            trace.tags["outcome"] = "error"
+            tracer.finish(trace)
+            return
+        if failure:
+            trace.tags["llm_error"] = str(failure)  # dropped mid-reply — keep what arrived
+        trace.record("llm_total", time.perf_counter() - stream_started)
+        renderer.finish()
+        trace.tags.update(render_flushes=renderer.stats["flushes"],
+                          render_bytes=renderer.stats["bytes"])
 
     # Save to state
     st.session_state.messages.append({"role": "assistant", "content": full_response})
     st.session_state.last_spoken_idx = len(st.session_state.messages) - 1
 
-    # Generate TTS for voice loop (will be sent to component on rerun)
-    if voice_reply and full_response:
-        mp3_bytes = synthesize(full_response)
-        if mp3_bytes:
-            st.session_state.voice_tts_b64 = base64.b64encode(mp3_bytes).decode("utf-8")
-        else:
-            st.session_state.voice_tts_b64 = ""
+    # Collect TTS segments for voice loop (will be sent to component on rerun)
+    if pipeline and full_response:
+        with trace.span("tts_wait"):
+            segments = pipeline.finish(interrupted=rerun_requested)
+        if pipeline.first_audio_s is not None:
+            trace.record("tts_first_audio", pipeline.first_audio_s)
+        st.session_state.voice_tts_lead = None
+        if segments is None:
+            segments = []  # the user barged in while the audio was still being made
+        elif lead:
+            # The rerun removes lead_slot mid-sentence; the voice loop resumes
+            # the first sentence from wherever it has got to by then
+            segments.insert(0, lead)
+            st.session_state.voice_tts_lead = {"started": lead_started,
+                                               "seconds": audio_seconds(lead)}
+        with trace.span("encode"):
+            st.session_state.voice_tts_handles = [audio_store.put(mp3) for mp3 in segments]
+        st.session_state.voice_tts_id = str(time.time_ns())
     else:
-        st.session_state.voice_tts_b64 = ""
-
-    auto_save()
-    st.rerun()
-
-
-# ─── Voice Mode: Auto Voice Loop Component ───────────────────────────────────
-if st.session_state.voice_mode:
-    st.markdown("---")
-
-    # Render the voice component — it auto-plays TTS and returns recorded audio
-    tts_to_play = st.session_state.get("voice_tts_b64", "")
-
-    # Clear TTS after sending (so it doesn't replay on rerun)
-    if tts_to_play:
-        st.session_state.voice_tts_b64 = ""
-
-    voice_result = voice_loop_component(
-        tts_audio_b64=tts_to_play,
-        key="voice_loop",
+        st.session_state.voice_tts_handles = []
+
+    new_chat = not st.session_state.session_id
+    with trace.span("save"):
+        auto_save()
+    trace.tags["session_id"] = st.session_state.session_id
+    # Closed at the end of the next run, once the reply is back in the browser
+    meter.close()
+    trace.add_run(meter, "turn")
+    trace.begin_rerun()
+    st.session_state.pending_trace = trace
+    rerun_chat(meter, full=new_chat)
+
+
+@chat_fragment
+def chat_area():
+    # Full runs are metered from the top of the script; fragment runs start here
+    meter = run_meter if not run_meter.closed else RunMeter("fragment")
+
+    # ─── Chat Messages (history) ─────────────────────────────────────────────
+    # Only the newest transcript_window messages are drawn; bubbles are memoized
+    msgs = st.session_state.messages
+    hidden = max(len(msgs) - st.session_state.transcript_window, 0)
+    if hidden or st.session_state.history_first_turn is not None:
+        if st.button("Load earlier messages", key="load_earlier", use_container_width=True):
+            if not hidden:
+                load_earlier_messages()
+            st.session_state.transcript_window += TRANSCRIPT_WINDOW
+            hidden = max(len(msgs) - st.session_state.transcript_window, 0)
+
+    for msg in msgs[hidden:]:
+        st.markdown(message_html(msg["role"], msg["content"]), unsafe_allow_html=True)
+
+    summary_present = any(
+        m["role"] == "assistant" and "**Here's everything I've gathered so far:**" in m["content"]
+        for m in msgs
     )
 
-    # Process captured audio from the component (deduplicate by timestamp)
-    if voice_result and isinstance(voice_result, dict) and voice_result.get("audio_b64"):
-        ts = voice_result.get("timestamp", 0)
-        last_ts = st.session_state.get("voice_last_ts", 0)
+    # ─── Download ────────────────────────────────────────────────────────────
+    if summary_present:
+        summary_text = next(
+            (m["content"] for m in reversed(st.session_state.messages)
+             if "**Here's everything I've gathered so far:**" in m["content"]), ""
+        )
+        st.markdown("<div class='dl-box'>All details collected — download your summary below.</div>",
+                    unsafe_allow_html=True)
+        st.download_button("Download Requirements Summary",
+                           data=summary_text.encode("utf-8"),
+                           file_name="bigin_crm_requirements.txt",
+                           mime="text/plain", use_container_width=True)
 
-        if ts != last_ts:
-            # New audio — process it
-            st.session_state.voice_last_ts = ts
-            audio_b64 = voice_result["audio_b64"]
-            audio_bytes = base64.b64decode(audio_b64)
+    # ─── Streaming container (above the input form) ─────────────────────────
+    streaming_container = st.container()
 
-            with st.spinner("Transcribing..."):
-                transcript = call_stt(st.session_state.api_key, audio_bytes)
+    st.markdown("<div style='height:10px'></div>", unsafe_allow_html=True)
 
-            if transcript and not transcript.startswith("[Transcription error"):
-                handle_user_message(transcript, voice_reply=True)
+    # ─── Voice Mode: Auto Voice Loop Component ───────────────────────────────
+    if st.session_state.voice_mode:
+        st.markdown("---")
+
+        # Render the voice component — it auto-plays TTS and returns recorded audio
+        tts_to_play = st.session_state.get("voice_tts_handles", [])
+
+        # Clear TTS after sending (so it doesn't replay on rerun)
+        if tts_to_play:
+            st.session_state.voice_tts_handles = []
+
+        # A first sentence that played from the page while the reply streamed
+        # continues where it is now, or is skipped if it has finished
+        tts_offset_ms = 0
+        lead = st.session_state.voice_tts_lead
+        st.session_state.voice_tts_lead = None
+        if tts_to_play and lead:
+            played = time.time() - lead["started"]
+            if played >= lead["seconds"]:
+                tts_to_play = tts_to_play[1:]
             else:
-                st.warning("Couldn't understand — listening again...")
-                st.rerun()
+                tts_offset_ms = round(played * 1000)
+
+        stt_stream = st.session_state.voice_stt_stream
+        voice_result = voice_loop_component(
+            tts_handles=tts_to_play,
+            tts_id=st.session_state.voice_tts_id,
+            tts_offset_ms=tts_offset_ms,
+            stt_utterance=stt_stream.utterance_id if stt_stream else "",
+            stt_acked=stt_stream.received() if stt_stream else [],
+            key="voice_loop",
+        )
+
+        # Process captured audio from the component (deduplicate by timestamp)
+        if voice_result and voice_result.get("timestamp", 0) != st.session_state.get("voice_last_ts", 0):
+            st.session_state.voice_last_ts = voice_result["timestamp"]
+
+            if voice_result["barge_in"]:
+                # The user talked over the reply. A run still generating it saw
+                # this value pending and stopped (see rerun_requested); just
+                # don't replay it.
+                st.session_state.voice_tts_handles = []
+                st.session_state.voice_barge_in = {
+                    "barge_in": voice_result["barge_in"],
+                    "barge_in_unplayed": voice_result["unplayed_segments"],
+                }
+            elif not voice_result["final"]:
+                # Mid-utterance segment — transcribe it while the user keeps talking
+                stream_voice_segment(voice_result)
+            elif voice_result["audio"] or voice_result["utterance"]:
+                # New audio — process it
+                trace = tracer.start(user_key, st.session_state.session_id,
+                                     st.session_state.model, voice=True)
+                trace.record("decode", voice_result["decode_ms"] / 1000)
+                endpoint = voice_result["endpoint"]
+                if endpoint:
+                    trace.record("endpoint", endpoint["eos_ms"] / 1000)
+                    trace.tags.update(vad_mode=endpoint["mode"],
+                                      vad_hangover_ms=endpoint["hangover_ms"],
+                                      noise_floor=round(endpoint["noise_floor"], 5),
+                                      vad_threshold=round(endpoint["threshold"], 5))
+                trace.tags.update(st.session_state.voice_barge_in or {})
+                st.session_state.voice_barge_in = None
+                # Open TTS connections while STT runs — the reply will be spoken
+                prewarm_tts()
+                transcript = transcribe_voice(voice_result, trace)
+
+                if not is_error_reply(transcript):
+                    handle_user_message(transcript, streaming_container, meter,
+                                        voice_reply=True, trace=trace)
+                else:
+                    trace.tags["outcome"] = "no_transcript"
+                    tracer.finish(trace)
+                    st.warning("Couldn't understand — listening again...")
+                    rerun_chat(meter)
+
+    # ─── Text Input (always available as fallback) ────────────────────────────
+    with st.form("chat_form", clear_on_submit=True):
+        c1, c2 = st.columns([8, 2])
+        with c1:
+            user_input = st.text_input("msg", placeholder="Type your message…",
+                                       label_visibility="collapsed")
+        with c2:
+            submitted = st.form_submit_button("Send ➤", use_container_width=True)
+
+    if submitted and user_input.strip():
+        handle_user_message(user_input.strip(), streaming_container, meter,
+                            voice_reply=st.session_state.voice_mode)
+
+    # ─── Turn stats + latency (closes the turn traced before this rerun) ──────
+    meter.close()
+    if st.session_state.pending_trace is not None:
+        finished = st.session_state.pending_trace
+        st.session_state.pending_trace = None
+        finished.end_rerun()
+        finished.add_run(meter, "rerun")
+        st.session_state.last_turn_trace = tracer.finish(finished)
+
+    if st.session_state.stop_requested:
+        st.session_state.stop_requested = False
+        st.toast("Stopped — the partial answer was saved.")
+
+    stats = [f"{len(st.session_state.messages)} messages"]
+    usage = st.session_state.chat_context.last_usage
+    if usage:
+        stats.append(f"context ~{usage['sent_tokens']} tokens sent · ~{usage['saved_tokens']} saved")
+    if st.session_state.tokens_saved:
+        stats.append(f"~{st.session_state.tokens_saved} tokens not generated thanks to Stop / interruptions")
+    if st.session_state.show_latency and st.session_state.last_turn_trace:
+        spans = st.session_state.last_turn_trace["spans"]
+        stats.append("last turn · " + " · ".join(f"{stage} {ms:.0f}ms" for stage, ms in spans.items()))
+    st.markdown(f"<small style='color:#6b7280'>{'<br>'.join(stats)}</small>",
+                unsafe_allow_html=True)
+
 
-# ─── Text Input (always available as fallback) ────────────────────────────────
-with st.form("chat_form", clear_on_submit=True):
-    c1, c2 = st.columns([8, 2])
-    with c1:
-        user_input = st.text_input("msg", placeholder="Type your message…",
-                                   label_visibility="collapsed")
-    with c2:
-        submitted = st.form_submit_button("Send ➤", use_container_width=True)
-
-if submitted and user_input.strip():
-    handle_user_message(user_input.strip(), voice_reply=st.session_state.voice_mode)
+chat_area()
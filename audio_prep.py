@@ -0,0 +1,67 @@
+# ─── audio_prep.py ────────────────────────────────────────────────────────────
+# Server-side normalization of recorded speech before STT.
+# Mirrors what the voice component does in the browser — 16 kHz mono, speech
+# bitrate, leading/trailing silence trimmed — for uploads from clients that
+# couldn't. Uses ffmpeg when it is on PATH; otherwise audio passes through.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import math
+import shutil
+import subprocess
+
+from config import (
+    AUDIO_NORMALIZE_SERVER, AUDIO_NORMALIZE_TIMEOUT, AUDIO_SAMPLE_RATE,
+    AUDIO_UPLOAD_BITRATE, AUDIO_TRIM_PAD_MS, SILENCE_THRESHOLD,
+)
+
+FFMPEG = shutil.which("ffmpeg")
+
+# Same RMS threshold the browser VAD uses, in dBFS
+_SILENCE_DB = 20 * math.log10(SILENCE_THRESHOLD)
+
+
+def _trim_filter() -> str:
+    """Strip leading silence, then trailing silence via a reversed pass."""
+    pad = AUDIO_TRIM_PAD_MS / 1000
+    trim = (f"silenceremove=start_periods=1:start_threshold={_SILENCE_DB:.1f}dB"
+            f":start_silence={pad}")
+    return f"{trim},areverse,{trim},areverse"
+
+
+def normalize_upload(audio: bytes) -> bytes:
+    """
+    Downmix to mono, resample to AUDIO_SAMPLE_RATE, trim silence, re-encode as Opus.
+
+    Args:
+        audio: Recorded audio in any container ffmpeg can read
+
+    Returns:
+        WebM/Opus bytes, or the input unchanged when normalization is off,
+        ffmpeg is unavailable or it fails
+    """
+    if not AUDIO_NORMALIZE_SERVER or not FFMPEG or not audio:
+        return audio
+    cmd = [
+        FFMPEG, "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE),
+        "-af", _trim_filter(),
+        "-c:a", "libopus", "-b:a", str(AUDIO_UPLOAD_BITRATE),
+        "-f", "webm", "pipe:1",
+    ]
+    try:
+        proc = subprocess.run(cmd, input=audio, capture_output=True,
+                              timeout=AUDIO_NORMALIZE_TIMEOUT, check=True)
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"[Audio Prep] Normalization skipped: {e}")
+        return audio
+    # All-silence input trims to nothing — let STT see the original
+    return proc.stdout or audio
+
+
+_EXTENSIONS = {"audio/webm": "webm", "audio/ogg": "ogg", "audio/mp4": "m4a", "audio/wav": "wav"}
+
+
+def upload_filename(mime: str) -> str:
+    """STT upload name whose extension matches the recorded container."""
+    return f"recording.{_EXTENSIONS.get(mime.split(';')[0].strip(), 'webm')}"
@@ -0,0 +1,70 @@
+# ─── audio_store.py ───────────────────────────────────────────────────────────
+# Short-lived in-process store for audio moving between Python and the voice
+# component. Session state holds small handles instead of encoded payloads;
+# the bytes are resolved only when the component is rendered.
+# One instance (`audio_store`) is shared by all sessions in the process.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+from config import AUDIO_STORE_TTL, AUDIO_STORE_MAX_MB
+
+
+class AudioStore:
+    """
+    Handle → bytes map with a TTL and a byte budget.
+
+    Entries expire ttl seconds after they were stored; when the budget is
+    exceeded the oldest entries go first.
+    """
+
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._size = 0
+        self.stats = {"stored": 0, "bytes_stored": 0, "expired": 0, "missing": 0}
+
+    def put(self, audio: bytes) -> str:
+        """Store audio and return its handle."""
+        handle = uuid.uuid4().hex
+        with self._lock:
+            self._items[handle] = (time.monotonic(), audio)
+            self._size += len(audio)
+            self.stats["stored"] += 1
+            self.stats["bytes_stored"] += len(audio)
+            self._evict()
+        return handle
+
+    def get(self, handle: str) -> bytes | None:
+        """Audio for a handle, or None once it has expired."""
+        with self._lock:
+            self._evict()
+            item = self._items.get(handle)
+            if item is None:
+                self.stats["missing"] += 1
+                return None
+            return item[1]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._items), "bytes": self._size}
+
+    def _evict(self):
+        """Drop expired entries, then oldest-first until within budget. Caller holds the lock."""
+        now = time.monotonic()
+        while self._items:
+            handle, (stored_at, audio) = next(iter(self._items.items()))
+            if now - stored_at <= self.ttl and self._size <= self.max_bytes:
+                break
+            del self._items[handle]
+            self._size -= len(audio)
+            self.stats["expired"] += 1
+
+
+# Process-wide instance shared by all Streamlit sessions
+audio_store = AudioStore(AUDIO_STORE_TTL, AUDIO_STORE_MAX_MB * 1024 * 1024)
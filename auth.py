@@ -5,9 +5,32 @@
 import re
 import hashlib
 import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, timezone
 
 from db import supabase
+from config import (
+    SESSION_SUMMARY_TABLE, SESSIONS_PAGE_SIZE, ADMIN_STATS_TTL,
+    HISTORY_CACHE_USERS, HISTORY_CACHE_SESSIONS, TRANSCRIPT_PAGE_TURNS,
+    INCREMENTAL_SAVES, WRITE_BEHIND_ENABLED, WRITE_BEHIND_INTERVAL,
+    WRITE_BEHIND_BATCH, WRITE_BEHIND_RETRY, WRITE_BEHIND_SPOOL,
+)
+from write_behind import WriteBehindQueue
+
+# Rows already stored per (user_key, session_id), so incremental saves only
+# write the newest turn. Shared by all sessions in the process.
+_persisted_rows: dict[tuple[str, str], int] = {}
+
+# Short-lived admin query results: name -> (loaded_at, value)
+_admin_cache: dict[str, tuple[float, object]] = {}
+
+# Per-user chat lists: user_key -> {"sessions": {sid: meta}, "fetched": n or None}
+# ("fetched" is how many newest sessions were read; None means all of them).
+# Loaded transcripts: (user_key, session_id) -> {"messages", "title"}.
+_listing_cache: OrderedDict[str, dict] = OrderedDict()
+_transcript_cache: OrderedDict[tuple[str, str], dict] = OrderedDict()
+_history_lock = threading.Lock()
 
 
 # ─── Password & Key Helpers ─────────────────────────────────────────────────
@@ -47,6 +70,7 @@ def register_user(name: str, company: str, phone: str, password: str) -> tuple[b
             "pw_hash": hash_pw(password),
             "role": "user",
         }).execute()
+        _invalidate_admin_cache()
         return True, key
     except Exception as e:
         return False, f"Registration failed: {e}"
@@ -88,6 +112,7 @@ def seed_admin(name: str, company: str, phone: str, password: str) -> str:
     if existing.data:
         # Update existing user to admin
         supabase.table("users").update({"role": "admin"}).eq("key", key).execute()
+        _invalidate_admin_cache()
         return f"User '{key}' promoted to admin."
 
     supabase.table("users").insert({
@@ -98,72 +123,212 @@ def seed_admin(name: str, company: str, phone: str, password: str) -> str:
         "pw_hash": hash_pw(password),
         "role": "admin",
     }).execute()
+    _invalidate_admin_cache()
     return f"Admin '{key}' created."
 
 
 # ─── Chat History (per-user) ────────────────────────────────────────────────
 
-def save_history(user_key: str, session_id: str, messages: list, title: str):
+def save_history(user_key: str, session_id: str, messages: list, title: str) -> bool:
     """
     Save/update a chat session to Supabase.
-    Upserts message pairs (user + assistant) from the conversation.
+    Stores message pairs (user + assistant) from the conversation, one row per
+    turn. With write-behind enabled the save is queued and this returns at
+    once; otherwise returns True if the write succeeded.
     """
+    _cache_write_through(user_key, session_id, messages, title)
+    if WRITE_BEHIND_ENABLED:
+        _writer.submit(user_key, session_id, messages, title)
+        return True
     try:
-        # Delete existing messages for this session (full replace strategy)
-        supabase.table("chats").delete().eq("user_key", user_key).eq("session_id", session_id).execute()
-
-        # Build rows — pair up user messages with the following assistant response
-        rows = []
-        i = 0
-        while i < len(messages):
-            msg = messages[i]
-            if msg["role"] == "user":
-                user_msg = msg["content"]
-                assistant_msg = ""
-                if i + 1 < len(messages) and messages[i + 1]["role"] == "assistant":
-                    assistant_msg = messages[i + 1]["content"]
-                    i += 1
-                rows.append({
-                    "user_key": user_key,
-                    "session_id": session_id,
-                    "title": title,
-                    "user_message": user_msg,
-                    "assistant_response": assistant_msg,
-                })
-            elif msg["role"] == "assistant" and not rows:
-                # Greeting or standalone assistant msg (no preceding user msg)
-                rows.append({
-                    "user_key": user_key,
-                    "session_id": session_id,
-                    "title": title,
-                    "user_message": "",
-                    "assistant_response": msg["content"],
-                })
-            i += 1
-
+        _flush_saves([{
+            "user_key": user_key, "session_id": session_id,
+            "messages": messages, "title": title,
+        }])
+        return True
+    except Exception as e:
+        # Chat still lives in session state — log and carry on
+        print(f"[DB Error] save_history({session_id}): {e}")
+        return False
+
+
+def _flush_saves(ops: list[dict]):
+    """Write a batch of save ops. Raises on database errors."""
+    if not INCREMENTAL_SAVES:
+        for op in ops:
+            _save_full(op["user_key"], op["session_id"], op["messages"], op["title"])
+    else:
+        # One upsert for the whole batch — every row carries its own conflict key
+        rows, counts = [], {}
+        for op in ops:
+            sess_rows, total = _unsaved_rows(op["user_key"], op["session_id"], op["messages"], op["title"])
+            rows.extend(sess_rows)
+            counts[(op["user_key"], op["session_id"])] = total
         if rows:
-            supabase.table("chats").insert(rows).execute()
-    except Exception:
-        pass  # Silently fail — chat still lives in session state
-
-
-def list_histories(user_key: str) -> list:
+            supabase.table("chats").upsert(
+                rows, on_conflict="user_key,session_id,turn_idx"
+            ).execute()
+        _persisted_rows.update(counts)
+
+    if SESSION_SUMMARY_TABLE:
+        now = datetime.now(timezone.utc).isoformat()
+        summaries = [{
+            "user_key": op["user_key"],
+            "session_id": op["session_id"],
+            "title": op["title"] or "Untitled",
+            "message_count": len(_build_rows(op["user_key"], op["session_id"], op["messages"], op["title"])),
+            "updated_at": now,
+        } for op in ops]
+        supabase.table("sessions").upsert(
+            summaries, on_conflict="user_key,session_id"
+        ).execute()
+
+    _invalidate_admin_cache()
+
+
+def _build_rows(user_key: str, session_id: str, messages: list, title: str) -> list[dict]:
+    """Pair up user messages with the following assistant response, one row per turn."""
+    rows = []
+    i = 0
+    while i < len(messages):
+        msg = messages[i]
+        if msg["role"] == "user":
+            user_msg = msg["content"]
+            assistant_msg = ""
+            if i + 1 < len(messages) and messages[i + 1]["role"] == "assistant":
+                assistant_msg = messages[i + 1]["content"]
+                i += 1
+            rows.append({
+                "user_key": user_key,
+                "session_id": session_id,
+                "turn_idx": len(rows),
+                "title": title,
+                "user_message": user_msg,
+                "assistant_response": assistant_msg,
+            })
+        elif msg["role"] == "assistant" and not rows:
+            # Greeting or standalone assistant msg (no preceding user msg)
+            rows.append({
+                "user_key": user_key,
+                "session_id": session_id,
+                "turn_idx": 0,
+                "title": title,
+                "user_message": "",
+                "assistant_response": msg["content"],
+            })
+        i += 1
+    return rows
+
+
+def _unsaved_rows(user_key: str, session_id: str, messages: list, title: str) -> tuple[list[dict], int]:
     """
-    List all saved chat sessions for a user, newest first.
-    Returns list of (session_id_as_filename, meta_dict) for backward compat.
+    Rows not yet stored for a session, plus the session's total row count.
+
+    The last stored row is always included too, since its assistant response
+    or title may have changed since it was first saved.
     """
-    try:
+    rows = _build_rows(user_key, session_id, messages, title)
+    if not rows:
+        return [], 0
+
+    stored = _persisted_rows.get((user_key, session_id))
+    if stored is None:
+        # Unknown in this process (restart or loaded chat) — one indexed lookup
         result = (
             supabase.table("chats")
-            .select("session_id, title, created_at")
+            .select("turn_idx")
             .eq("user_key", user_key)
-            .order("created_at", desc=True)
+            .eq("session_id", session_id)
+            .order("turn_idx", desc=True)
+            .limit(1)
             .execute()
         )
-    except Exception:
-        return []  # Return empty on connection error
+        stored = result.data[0]["turn_idx"] + 1 if result.data else 0
+
+    return rows[max(stored - 1, 0):], len(rows)
+
+
+def _save_full(user_key: str, session_id: str, messages: list, title: str):
+    """Legacy strategy: delete the session's rows and re-insert them all."""
+    # Works on an unmigrated table, which has no turn_idx column
+    rows = [
+        {k: v for k, v in row.items() if k != "turn_idx"}
+        for row in _build_rows(user_key, session_id, messages, title)
+    ]
+    supabase.table("chats").delete().eq("user_key", user_key).eq("session_id", session_id).execute()
+    if rows:
+        supabase.table("chats").insert(rows).execute()
+
+
+def list_histories(user_key: str, limit: int | None = SESSIONS_PAGE_SIZE, offset: int = 0) -> list:
+    """
+    List saved chat sessions for a user, most recently active first.
+    Returns list of (session_id_as_filename, meta_dict) for backward compat.
+    Pass limit=None for every session. Served from the per-user cache when it
+    already covers the requested page.
+    """
+    want = None if limit is None else offset + limit
+    with _history_lock:
+        cached = _listing_cache.get(user_key)
+        covered = cached is not None and (
+            cached["fetched"] is None or (want is not None and want <= cached["fetched"])
+        )
+        if covered:
+            _listing_cache.move_to_end(user_key)
+            sessions = dict(cached["sessions"])
+
+    if not covered:
+        try:
+            if SESSION_SUMMARY_TABLE:
+                sessions = _list_sessions_summary(user_key, want, 0)
+                fetched = None if want is None or len(sessions) < want else want
+            else:
+                sessions = _list_sessions_scan(user_key)
+                fetched = None
+        except Exception:
+            return []  # Return empty on connection error
+        _remember_listing(user_key, sessions, fetched)
+
+    # Saves still in the write-behind queue win over what's in the database
+    for sid, op in _writer.pending_for(user_key).items():
+        sessions[sid] = _session_meta(user_key, sid, op["messages"], op["title"], op["queued_at"])
+
+    # Sort newest first and return in (filename, meta) format
+    items = sorted(sessions.items(), key=lambda x: x[1]["saved_at"], reverse=True)
+    items = items[offset:] if limit is None else items[offset:offset + limit]
+    return [(f"{sid}.json", dict(meta)) for sid, meta in items]
 
-    # Group by session_id
+
+def _list_sessions_summary(user_key: str, limit: int | None, offset: int) -> dict:
+    """One indexed query on `sessions` (user_key, updated_at desc)."""
+    query = (
+        supabase.table("sessions")
+        .select("session_id, title, message_count, updated_at")
+        .eq("user_key", user_key)
+        .order("updated_at", desc=True)
+    )
+    if limit is not None:
+        query = query.range(offset, offset + limit - 1)
+    result = query.execute()
+    return {
+        row["session_id"]: {
+            "title": row["title"] or "Untitled",
+            "saved_at": _iso_to_ts(row["updated_at"]),
+            "message_count": row["message_count"],
+        }
+        for row in result.data
+    }
+
+
+def _list_sessions_scan(user_key: str) -> dict:
+    """Legacy listing: group every `chats` row of the user in Python."""
+    result = (
+        supabase.table("chats")
+        .select("session_id, title, created_at")
+        .eq("user_key", user_key)
+        .order("created_at", desc=True)
+        .execute()
+    )
     sessions = {}
     for row in result.data:
         sid = row["session_id"]
@@ -171,43 +336,91 @@ def list_histories(user_key: str) -> list:
             sessions[sid] = {
                 "title": row["title"] or "Untitled",
                 "saved_at": _iso_to_ts(row["created_at"]),
-                "messages": [],  # count placeholder
+                "message_count": 0,
             }
-        sessions[sid]["messages"].append(1)  # just for counting
-
-    # Sort newest first and return in (filename, meta) format
-    items = sorted(sessions.items(), key=lambda x: x[1]["saved_at"], reverse=True)
-    return [(f"{sid}.json", meta) for sid, meta in items]
+        sessions[sid]["message_count"] += 1
+    return sessions
 
 
 def load_history_file(user_key: str, filename: str) -> dict:
     """Load a specific chat session. Returns dict with 'messages' list."""
     session_id = filename.replace(".json", "")
+    held = _transcript_in_memory(user_key, session_id)
+    if held is not None:
+        return held
+
     result = (
         supabase.table("chats")
         .select("user_message, assistant_response, title, created_at")
         .eq("user_key", user_key)
         .eq("session_id", session_id)
-        .order("created_at", desc=False)
+        .order("turn_idx" if INCREMENTAL_SAVES else "created_at", desc=False)
         .execute()
     )
 
-    messages = []
-    title = "Untitled"
-    for row in result.data:
-        title = row.get("title", title)
-        if row["user_message"]:
-            messages.append({"role": "user", "content": row["user_message"]})
-        if row["assistant_response"]:
-            messages.append({"role": "assistant", "content": row["assistant_response"]})
+    title = result.data[-1].get("title", "Untitled") if result.data else "Untitled"
+    data = {"messages": _rows_to_messages(result.data), "title": title}
+    _remember_transcript(user_key, session_id, data)
+    return _copy_transcript(data)
+
+
+def load_history_page(user_key: str, filename: str, before_turn: int | None = None,
+                      limit: int | None = TRANSCRIPT_PAGE_TURNS) -> dict:
+    """
+    Load the newest turns of a chat session, or the turns just before before_turn.
 
-    return {"messages": messages, "title": title}
+    Keyset-paginated on turn_idx, so a page costs the same however long the
+    session is. limit=None loads every turn before before_turn.
+
+    Returns:
+        dict with 'messages', 'title', 'first_turn' (turn_idx of the oldest
+        turn returned) and 'has_more' (older turns exist)
+    """
+    session_id = filename.replace(".json", "")
+    held = _transcript_in_memory(user_key, session_id)
+    if held is None and not INCREMENTAL_SAVES:
+        held = load_history_file(user_key, filename)  # no turn_idx to page on
+    if held is not None:
+        return _slice_page(user_key, session_id, held, before_turn, limit)
+
+    query = (
+        supabase.table("chats")
+        .select("turn_idx, user_message, assistant_response, title")
+        .eq("user_key", user_key)
+        .eq("session_id", session_id)
+    )
+    if before_turn is not None:
+        query = query.lt("turn_idx", before_turn)
+    query = query.order("turn_idx", desc=True)
+    if limit is not None:
+        query = query.limit(limit + 1)  # one extra row tells whether more exist
+    rows = query.execute().data
+
+    has_more = limit is not None and len(rows) > limit
+    rows = list(reversed(rows[:limit] if limit is not None else rows))
+    title = rows[-1].get("title", "Untitled") if rows else "Untitled"
+    messages = _rows_to_messages(rows)
+    if before_turn is None and not has_more:
+        # Short session — the page is the whole transcript
+        _remember_transcript(user_key, session_id, {"messages": messages, "title": title})
+    return {
+        "messages": [dict(m) for m in messages],
+        "title": title,
+        "first_turn": rows[0]["turn_idx"] if rows else 0,
+        "has_more": has_more,
+    }
 
 
 def delete_history_file(user_key: str, filename: str):
     """Delete a saved chat session."""
     session_id = filename.replace(".json", "")
+    _writer.discard(user_key, session_id)
     supabase.table("chats").delete().eq("user_key", user_key).eq("session_id", session_id).execute()
+    if SESSION_SUMMARY_TABLE:
+        supabase.table("sessions").delete().eq("user_key", user_key).eq("session_id", session_id).execute()
+    _persisted_rows.pop((user_key, session_id), None)
+    _cache_forget(user_key, session_id)
+    _invalidate_admin_cache()
 
 
 def make_title(messages: list) -> str:
@@ -222,9 +435,47 @@ def make_title(messages: list) -> str:
 # ─── Admin Helpers ──────────────────────────────────────────────────────────
 
 def list_all_users() -> list[dict]:
-    """Return all registered users (for admin dashboard)."""
-    result = supabase.table("users").select("key, name, company, phone, role, created_at").order("created_at", desc=True).execute()
-    return result.data
+    """Return all registered users (for admin dashboard). Cached briefly."""
+    def load():
+        result = supabase.table("users").select("key, name, company, phone, role, created_at").order("created_at", desc=True).execute()
+        return result.data
+    return _cached("users", load)
+
+
+def user_chat_stats() -> dict[str, dict]:
+    """
+    Per-user chat statistics in a single query (for admin dashboard).
+
+    Returns {user_key: {"chat_count", "message_pairs", "last_activity"}},
+    where last_activity is a Unix timestamp. Users without chats are absent.
+    Cached briefly and invalidated whenever chats are written or deleted.
+    """
+    def load():
+        if SESSION_SUMMARY_TABLE:
+            result = supabase.table("user_chat_stats").select(
+                "user_key, chat_count, message_pairs, last_activity"
+            ).execute()
+            return {
+                row["user_key"]: {
+                    "chat_count": row["chat_count"],
+                    "message_pairs": row["message_pairs"],
+                    "last_activity": _iso_to_ts(row["last_activity"]) if row["last_activity"] else 0.0,
+                }
+                for row in result.data
+            }
+
+        # No summary table — one scan over chats, grouped in Python
+        result = supabase.table("chats").select("user_key, session_id, created_at").execute()
+        stats, seen = {}, set()
+        for row in result.data:
+            s = stats.setdefault(row["user_key"], {"chat_count": 0, "message_pairs": 0, "last_activity": 0.0})
+            s["message_pairs"] += 1
+            s["last_activity"] = max(s["last_activity"], _iso_to_ts(row["created_at"]))
+            if (row["user_key"], row["session_id"]) not in seen:
+                seen.add((row["user_key"], row["session_id"]))
+                s["chat_count"] += 1
+        return stats
+    return _cached("user_chat_stats", load)
 
 
 def list_all_chats(user_filter: str = None, search_query: str = None, limit: int = 100) -> list[dict]:
@@ -253,11 +504,160 @@ def list_all_chats(user_filter: str = None, search_query: str = None, limit: int
 
 def admin_delete_chat(chat_id: int):
     """Delete a specific chat row by ID (admin only)."""
+    found = supabase.table("chats").select("user_key, session_id").eq("id", chat_id).execute()
     supabase.table("chats").delete().eq("id", chat_id).execute()
+    _invalidate_admin_cache()
+    if not found.data:
+        return
+    user_key, session_id = found.data[0]["user_key"], found.data[0]["session_id"]
+    # Stored turn count changed — re-read it on the next save
+    _persisted_rows.pop((user_key, session_id), None)
+    # Row count and transcript changed — drop both, re-read on next view
+    with _history_lock:
+        _listing_cache.pop(user_key, None)
+        _transcript_cache.pop((user_key, session_id), None)
+
+    if SESSION_SUMMARY_TABLE:
+        remaining = (
+            supabase.table("chats").select("id", count="exact")
+            .eq("user_key", user_key).eq("session_id", session_id)
+            .limit(1).execute()
+        )
+        if remaining.count:
+            supabase.table("sessions").update({"message_count": remaining.count}) \
+                .eq("user_key", user_key).eq("session_id", session_id).execute()
+        else:
+            supabase.table("sessions").delete() \
+                .eq("user_key", user_key).eq("session_id", session_id).execute()
+
+
+# ─── Write-Behind Queue ─────────────────────────────────────────────────────
+
+_writer = WriteBehindQueue(
+    _flush_saves,
+    spool_path=WRITE_BEHIND_SPOOL,
+    interval=WRITE_BEHIND_INTERVAL,
+    batch_size=WRITE_BEHIND_BATCH,
+    retry_interval=WRITE_BEHIND_RETRY,
+)
+_writer.recover()
+_writer.install_exit_hook()
+
+
+def persistence_stats() -> dict:
+    """Write-behind queue depth, flush latency and spool counters."""
+    return _writer.snapshot()
 
 
 # ─── Internal Helpers ───────────────────────────────────────────────────────
 
+def _cached(name: str, loader):
+    """Return loader()'s result, reusing it for ADMIN_STATS_TTL seconds."""
+    hit = _admin_cache.get(name)
+    if hit and time.monotonic() - hit[0] < ADMIN_STATS_TTL:
+        return hit[1]
+    value = loader()
+    _admin_cache[name] = (time.monotonic(), value)
+    return value
+
+
+def _invalidate_admin_cache():
+    """Drop cached admin results after any write that changes them."""
+    _admin_cache.clear()
+
+
+def _session_meta(user_key: str, session_id: str, messages: list, title: str, saved_at: float) -> dict:
+    """Listing meta for a session whose full conversation is at hand."""
+    return {
+        "title": title or "Untitled",
+        "saved_at": saved_at,
+        "message_count": len(_build_rows(user_key, session_id, messages, title)),
+    }
+
+
+def _remember_listing(user_key: str, sessions: dict, fetched: int | None):
+    with _history_lock:
+        _listing_cache[user_key] = {"sessions": dict(sessions), "fetched": fetched}
+        _listing_cache.move_to_end(user_key)
+        while len(_listing_cache) > HISTORY_CACHE_USERS:
+            _listing_cache.popitem(last=False)
+
+
+def _remember_transcript(user_key: str, session_id: str, data: dict):
+    with _history_lock:
+        _transcript_cache[(user_key, session_id)] = _copy_transcript(data)
+        _transcript_cache.move_to_end((user_key, session_id))
+        while len(_transcript_cache) > HISTORY_CACHE_SESSIONS:
+            _transcript_cache.popitem(last=False)
+
+
+def _copy_transcript(data: dict) -> dict:
+    """Callers append to the returned messages — never hand out cached lists."""
+    return {"messages": [dict(m) for m in data["messages"]], "title": data["title"]}
+
+
+def _cache_write_through(user_key: str, session_id: str, messages: list, title: str):
+    """Apply a save to the cached chat list and transcript without a DB read."""
+    with _history_lock:
+        listing = _listing_cache.get(user_key)
+        if listing is not None:
+            listing["sessions"][session_id] = _session_meta(
+                user_key, session_id, messages, title, time.time()
+            )
+    _remember_transcript(user_key, session_id, {"messages": messages, "title": title})
+
+
+def _cache_forget(user_key: str, session_id: str):
+    """Remove a deleted session from both history caches."""
+    with _history_lock:
+        listing = _listing_cache.get(user_key)
+        if listing is not None:
+            listing["sessions"].pop(session_id, None)
+        _transcript_cache.pop((user_key, session_id), None)
+
+
+def _transcript_in_memory(user_key: str, session_id: str) -> dict | None:
+    """A copy of the full transcript from the cache or an unflushed save, if any."""
+    with _history_lock:
+        cached = _transcript_cache.get((user_key, session_id))
+        if cached is not None:
+            _transcript_cache.move_to_end((user_key, session_id))
+            return _copy_transcript(cached)
+
+    queued = _writer.pending_for(user_key).get(session_id)
+    if queued:
+        return {"messages": [dict(m) for m in queued["messages"]], "title": queued["title"]}
+    return None
+
+
+def _rows_to_messages(rows: list[dict]) -> list[dict]:
+    """Unpack stored turns into a flat user/assistant message list."""
+    messages = []
+    for row in rows:
+        if row["user_message"]:
+            messages.append({"role": "user", "content": row["user_message"]})
+        if row["assistant_response"]:
+            messages.append({"role": "assistant", "content": row["assistant_response"]})
+    return messages
+
+
+def _slice_page(user_key: str, session_id: str, data: dict,
+                before_turn: int | None, limit: int | None) -> dict:
+    """load_history_page() over a transcript already held in memory."""
+    rows = _build_rows(user_key, session_id, data["messages"], data["title"])
+    if before_turn is not None:
+        rows = [r for r in rows if r["turn_idx"] < before_turn]
+    has_more = limit is not None and len(rows) > limit
+    if limit is not None:
+        rows = rows[-limit:] if limit else []
+    return {
+        "messages": _rows_to_messages(rows),
+        "title": data["title"],
+        "first_turn": rows[0]["turn_idx"] if rows else 0,
+        "has_more": has_more,
+    }
+
+
 def _iso_to_ts(iso_str: str) -> float:
     """Convert ISO datetime string to Unix timestamp."""
     try:
@@ -0,0 +1,78 @@
+# ─── bench_rerun.py ───────────────────────────────────────────────────────────
+# Rerun cost per chat turn, read from the latency log.
+# Every traced turn carries the script-seconds and database calls of the run
+# that handled it ("turn", dominated by the LLM stream) and of the rerun that
+# followed ("rerun", what fragments shrink), tagged with the rerun scope
+# ("app" or "fragment"). To compare before / after:
+#
+#   1. Set CHAT_FRAGMENTS = False in config.py, run the app, send ~10 turns
+#   2. Set CHAT_FRAGMENTS = True, restart, send ~10 turns
+#   3. python bench_rerun.py
+#
+# Usage: python bench_rerun.py [--log PATH] [--since UNIX_TS]
+# ──────────────────────────────────────────────────────────────────────────────
+
+import os
+import json
+import argparse
+import statistics
+
+from config import LATENCY_LOG_PATH
+
+
+def load_turns(path: str, since: float) -> list[dict]:
+    """Turns with run-cost tags from the log and its rotated predecessor."""
+    turns = []
+    for p in (f"{path}.1", path):
+        if not os.path.exists(p):
+            continue
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if "rerun_script_s" in rec and rec.get("ts", 0) >= since:
+                    turns.append(rec)
+    return turns
+
+
+def summarize(turns: list[dict]) -> dict[str, dict]:
+    groups: dict[str, list[dict]] = {}
+    for t in turns:
+        groups.setdefault(t.get("rerun_scope", "app"), []).append(t)
+    result = {}
+    for scope, ts in groups.items():
+        result[scope] = {
+            "turns": len(ts),
+            "turn_script_s": statistics.mean(t.get("turn_script_s", 0.0) for t in ts),
+            "turn_db_calls": statistics.mean(t.get("turn_db_calls", 0) for t in ts),
+            "rerun_script_s": statistics.mean(t["rerun_script_s"] for t in ts),
+            "rerun_db_calls": statistics.mean(t["rerun_db_calls"] for t in ts),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Script-seconds and DB calls per chat turn.")
+    parser.add_argument("--log", default=LATENCY_LOG_PATH, help="Latency log (JSON lines)")
+    parser.add_argument("--since", type=float, default=0.0, help="Only turns after this Unix time")
+    args = parser.parse_args()
+
+    summary = summarize(load_turns(args.log, args.since))
+    if not summary:
+        print("No traced turns with run costs yet — chat a little first.")
+        return
+
+    print("Mean cost per turn (handling run + the rerun after it)")
+    print(f"{'rerun':<10}{'turns':>6}{'turn s':>9}{'turn db':>9}{'rerun s':>9}{'rerun db':>10}{'total s':>9}{'total db':>10}")
+    for scope, s in sorted(summary.items()):
+        print(f"{scope:<10}{s['turns']:>6}"
+              f"{s['turn_script_s']:>9.3f}{s['turn_db_calls']:>9.1f}"
+              f"{s['rerun_script_s']:>9.3f}{s['rerun_db_calls']:>10.1f}"
+              f"{s['turn_script_s'] + s['rerun_script_s']:>9.3f}"
+              f"{s['turn_db_calls'] + s['rerun_db_calls']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# ─── bench_upload.py ──────────────────────────────────────────────────────────
+# Voice upload size and STT latency per turn, read from the latency log.
+# Every traced voice turn carries the bytes the browser uploaded, the bytes
+# sent to STT, whether the browser prepared the audio (16 kHz mono, silence
+# trimmed), whether segments were transcribed while the user was still
+# talking (stt_mode "streaming") and the "stt" span — the wait after
+# end-of-speech. To compare before / after:
+#
+#   1. Set AUDIO_PREPARE_CLIENT = False and AUDIO_NORMALIZE_SERVER = False in
+#      config.py, run the app, speak ~10 turns
+#   2. Set both back to True, restart, speak ~10 turns
+#   3. python bench_upload.py
+#
+# Toggle STT_STREAMING the same way to compare streaming and batch STT.
+#
+# Usage: python bench_upload.py [--log PATH] [--since UNIX_TS]
+# ──────────────────────────────────────────────────────────────────────────────
+
+import os
+import json
+import argparse
+import statistics
+
+from config import LATENCY_LOG_PATH
+
+
+def load_turns(path: str, since: float) -> list[dict]:
+    """Voice turns with upload tags from the log and its rotated predecessor."""
+    turns = []
+    for p in (f"{path}.1", path):
+        if not os.path.exists(p):
+            continue
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if "upload_bytes" in rec and rec.get("ts", 0) >= since:
+                    turns.append(rec)
+    return turns
+
+
+def _mode(turn: dict) -> str:
+    if turn.get("client_prepared"):
+        prepared = "browser"
+    elif "normalize" in turn.get("spans", {}):
+        prepared = "server"
+    else:
+        prepared = "raw"
+    return f"{prepared}/{turn.get('stt_mode', 'batch')}"
+
+
+def summarize(turns: list[dict]) -> dict[str, dict]:
+    groups: dict[str, list[dict]] = {}
+    for t in turns:
+        groups.setdefault(_mode(t), []).append(t)
+    result = {}
+    for mode, ts in groups.items():
+        stt = [t["spans"]["stt"] for t in ts if "stt" in t.get("spans", {})]
+        result[mode] = {
+            "turns": len(ts),
+            "upload_kb": statistics.median(t["upload_bytes"] for t in ts) / 1024,
+            "stt_kb": statistics.median(t.get("stt_bytes", t["upload_bytes"]) for t in ts) / 1024,
+            "normalize_ms": statistics.median(t["spans"].get("normalize", 0.0) for t in ts),
+            "stt_ms": statistics.median(stt) if stt else 0.0,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload size and STT latency per voice turn.")
+    parser.add_argument("--log", default=LATENCY_LOG_PATH, help="Latency log (JSON lines)")
+    parser.add_argument("--since", type=float, default=0.0, help="Only turns after this Unix time")
+    args = parser.parse_args()
+
+    summary = summarize(load_turns(args.log, args.since))
+    if not summary:
+        print("No traced voice turns with upload sizes yet — speak a little first.")
+        return
+
+    print("Median per voice turn, by where the audio was prepared / how STT ran")
+    print(f"{'mode':<18}{'turns':>6}{'upload KB':>11}{'STT KB':>9}{'norm ms':>9}{'STT ms':>9}")
+    for mode, s in sorted(summary.items()):
+        print(f"{mode:<18}{s['turns']:>6}{s['upload_kb']:>11.1f}{s['stt_kb']:>9.1f}"
+              f"{s['normalize_ms']:>9.0f}{s['stt_ms']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
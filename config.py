@@ -13,12 +13,112 @@
 EDGE_TTS_VOICE = "en-US-AriaNeural"
 EDGE_TTS_RATE = "+30%"      # 1.3x speed — change to "+0%" for normal
 
+# ─── TTS Service ─────────────────────────────────────────────────────────────
+# All syntheses run on one long-lived background asyncio loop. Sentences are
+# synthesized while the LLM is still streaming. How many reach Edge-TTS at
+# once is ADMISSION_LIMITS["tts"].
+TTS_SEGMENT_TIMEOUT = 30        # Seconds allowed for one synthesis
+
+# ─── TTS Connection Pool ─────────────────────────────────────────────────────
+# Syntheses reuse warm websockets to the speech service instead of opening one
+# per sentence; connections are pre-warmed when a turn starts. Point
+# TTS_TRANSPORT_URL at `python tts_standin.py` to run offline.
+TTS_POOLED_TRANSPORT = True
+TTS_POOL_SIZE = 2               # Idle connections kept open
+TTS_POOL_IDLE_TIMEOUT = 20      # Seconds before an idle connection is dropped
+TTS_TRANSPORT_URL = ""          # e.g. "ws://127.0.0.1:8765/tts" — empty = Edge
+
+# ─── TTS Audio Cache ─────────────────────────────────────────────────────────
+# Synthesized audio is keyed on hash(clean text, voice, rate) and shared by
+# every session in the process. The disk tier survives restarts.
+TTS_CACHE_DIR = ".tts_cache"
+TTS_CACHE_MEMORY_MB = 32        # In-memory LRU budget
+TTS_CACHE_DISK_MB = 256         # On-disk store budget (oldest evicted first)
+
 # ─── Groq LLM Settings ──────────────────────────────────────────────────────
 DEFAULT_MODEL = "llama-3.3-70b-versatile"
 GROQ_BASE_URL = "https://api.groq.com/openai/v1"
 MAX_TOKENS = 256
 TEMPERATURE = 0.65
 
+# ─── Context Window ──────────────────────────────────────────────────────────
+# Prompt budget (tokens, incl. system prompt and reply) per model. Older turns
+# are folded into a running summary in the background once the unsummarized
+# history passes CONTEXT_SUMMARY_TRIGGER of the budget.
+MODEL_CONTEXT_BUDGETS = {
+    "llama-3.3-70b-versatile": 6000,
+    "llama-3.1-8b-instant": 6000,
+    "mixtral-8x7b-32768": 6000,
+    "gemma2-9b-it": 4000,       # 8k context window
+}
+DEFAULT_CONTEXT_BUDGET = 4000
+CONTEXT_SUMMARY_TRIGGER = 0.6   # Fraction of budget that starts a fold
+CONTEXT_KEEP_RECENT = 6         # Latest messages always sent verbatim
+CONTEXT_SUMMARY_MODEL = "llama-3.1-8b-instant"
+CONTEXT_SUMMARY_MAX_TOKENS = 400
+CONTEXT_FOLD_CHUNK = 8          # Oldest messages merged into the summary per call
+CONTEXT_FOLD_CHUNK_TOKENS = 2000  # ...and at most this many tokens of them
+
+# ─── Groq HTTP Connection Pool ───────────────────────────────────────────────
+# One keep-alive client per API key, shared by every session in the process.
+GROQ_MAX_CONNECTIONS = 20       # Hard cap on open sockets per API key
+GROQ_MAX_KEEPALIVE = 10         # Idle sockets kept warm per API key
+GROQ_KEEPALIVE_EXPIRY = 60      # Seconds an idle socket stays open
+GROQ_CONNECT_TIMEOUT = 5        # Seconds for TCP + TLS handshake
+GROQ_READ_TIMEOUT = 60          # Seconds between bytes on a response
+GROQ_HTTP2 = True               # Used only if the optional `h2` package is installed
+GROQ_CLIENT_REGISTRY_SIZE = 32  # Distinct API keys with a live client
+
+# ─── Groq Rate Limits ────────────────────────────────────────────────────────
+# Every Groq response carries x-ratelimit-* headers; they keep a request and
+# a token bucket per (API key, model) in sync. Calls wait for capacity instead
+# of failing, and 429s are retried with jittered backoff honouring retry-after.
+RATE_LIMIT_MAX_RETRIES = 4      # 429 retries per call
+RATE_LIMIT_BACKOFF_BASE = 0.5   # Seconds; doubles per retry when no retry-after
+RATE_LIMIT_BACKOFF_CAP = 20     # Longest single backoff (seconds)
+RATE_LIMIT_JITTER = 0.25        # Up to +25% on every backoff, so waiters spread out
+RATE_LIMIT_MAX_WAIT = 45        # Give up once a call would wait longer than this in total
+
+# ─── Admission Control ───────────────────────────────────────────────────────
+# Process-wide concurrency limits per backend, shared by every session. Over
+# the limit, calls queue per user and are served round-robin; the UI shows the
+# queue position. A call that can't get a slot in time gets "Server busy".
+ADMISSION_LIMITS = {            # Simultaneous calls per backend
+    "llm": 8,                   # Open Groq chat streams
+    "stt": 4,                   # Whisper uploads
+    "tts": 4,                   # Edge-TTS syntheses (cache hits skip the gate)
+}
+ADMISSION_PER_USER = {          # Of those, at most this many for one user
+    "llm": 2,
+    "stt": 2,
+    "tts": 2,
+}
+ADMISSION_TIMEOUT = 60          # Seconds a call may queue before it is turned away
+
+# ─── Model Routing ───────────────────────────────────────────────────────────
+# With routing on, short questionnaire turns go to the fast model and the
+# summary turn to the large one; the sidebar model is then only used for the
+# greeting. Hedging races a second request on HEDGE_MODEL when the primary
+# has no first token by HEDGE_DEADLINE and streams whichever answers first.
+ROUTING_ENABLED = False         # Default of the sidebar "Route per turn" toggle
+ROUTE_FAST_MODEL = "llama-3.1-8b-instant"
+ROUTE_SUMMARY_MODEL = "llama-3.3-70b-versatile"
+ROUTE_SUMMARY_AFTER = (         # Assistant text whose answer starts the summary turn
+    "quotations and invoices",          # Q4h, the last question
+    "here's everything i've gathered",  # the summary itself — a correction re-summarizes
+)
+ROUTE_SUMMARY_REQUESTS = (      # Regexes (any match, case-insensitive) for a recap asked of the assistant
+    r"\b(?:give|show|send|write|make)(?:\s+(?:me|us))?\s+(?:(?:a|the|my|our)\s+)?"
+    r"(?:(?:quick|short|brief|full|final)\s+)?(?:summary|recap)\b",
+    r"\b(?:i'?d like|i want|can (?:i|we) (?:get|have|see))\s+(?:(?:a|the|my|our)\s+)?"
+    r"(?:summary|recap)(?=\s*(?:[.!?,]|$|please\b|now\b|of\b))",
+    r"(?:^|\b(?:you|please)\s+)(?:summari[sz]e|recap)\b",
+    r"^\W*(?:summary|recap)(?:\s+please)?\W*$",
+)
+HEDGE_ENABLED = False           # Default of the sidebar "Hedge slow replies" toggle
+HEDGE_MODEL = ROUTE_FAST_MODEL
+HEDGE_DEADLINE = 1.0            # Seconds without a first token before hedging
+
 MODEL_OPTIONS = {
     "Llama 3.3 70B (Best)": "llama-3.3-70b-versatile",
     "Llama 3.1 8B (Fastest)": "llama-3.1-8b-instant",
@@ -26,15 +126,123 @@ MODEL_OPTIONS = {
     "Gemma 2 9B": "gemma2-9b-it",
 }
 
+# ─── Streaming Render ────────────────────────────────────────────────────────
+# Streamed replies are escaped token-by-token and pushed to the browser at most
+# once per interval, or sooner once enough new text has piled up.
+STREAM_FLUSH_INTERVAL = 0.08    # Seconds between bubble updates while streaming
+STREAM_FLUSH_CHARS = 400        # New characters that force an early update
+CHAT_FRAGMENTS = True           # Rerun only the chat area after a turn (st.fragment)
+DISCONNECT_CHECK_INTERVAL = 0.5 # Seconds between checks for a closed tab or a pending Stop / barge-in while streaming
+
+# ─── Transcript Window ───────────────────────────────────────────────────────
+# Only the newest messages are rendered; "Load earlier" reveals more, fetching
+# older turns from the database a page at a time (keyset on turn_idx).
+TRANSCRIPT_WINDOW = 30          # Messages rendered before "Load earlier"
+TRANSCRIPT_PAGE_TURNS = 15      # Turns (user + reply) fetched per page
+TRANSCRIPT_HTML_CACHE = 4096    # Memoized message bubbles per process
+
+# ─── Greeting Store ──────────────────────────────────────────────────────────
+# Opening greetings are pre-generated per model (with TTS audio) in the
+# background, so a new chat paints without an LLM round trip.
+GREETING_POOL_SIZE = 3          # Greetings kept per model
+GREETING_TTL = 6 * 60 * 60      # Seconds before a greeting is regenerated
+
+# ─── Chat Persistence ────────────────────────────────────────────────────────
+# Incremental saves upsert only the newest turn, keyed on
+# (user_key, session_id, turn_idx). Requires migrations/001_chats_turn_idx.sql;
+# set False to fall back to the delete-and-reinsert strategy.
+INCREMENTAL_SAVES = True
+
+# Saves are queued and flushed by a background worker instead of blocking
+# the rerun. Failed flushes go to a local spool that is replayed on recovery.
+WRITE_BEHIND_ENABLED = True
+WRITE_BEHIND_INTERVAL = 0.5     # Seconds to let saves coalesce before flushing
+WRITE_BEHIND_BATCH = 50         # Sessions per flush
+WRITE_BEHIND_RETRY = 10         # Seconds between retries while the DB is down
+WRITE_BEHIND_SPOOL = ".chat_spool.jsonl"
+
+# Sidebar chat lists read the `sessions` summary table (one row per chat).
+# Requires migrations/002_sessions.sql and a `python migrate_sessions.py` backfill.
+SESSION_SUMMARY_TABLE = True
+SESSIONS_PAGE_SIZE = 20         # Chats per sidebar page
+SESSIONS_BACKFILL_BATCH = 1000  # `chats` rows read per backfill query
+
+# In-process history caches, updated write-through by save/delete so the
+# sidebar and chat switching only hit Supabase when data actually changed.
+HISTORY_CACHE_USERS = 256       # Users whose chat list is cached
+HISTORY_CACHE_SESSIONS = 256    # Loaded chat transcripts kept in memory
+
+# ─── Admin Dashboard ─────────────────────────────────────────────────────────
+ADMIN_STATS_TTL = 30            # Seconds user list / per-user stats are cached
+
+# ─── Latency Tracing ─────────────────────────────────────────────────────────
+# Every turn records per-stage spans (decode, STT, LLM, TTS, encode, save,
+# rerun). Spans go to a JSON-lines log; percentiles cover the last N turns.
+LATENCY_LOG_PATH = ".latency_log.jsonl"
+LATENCY_LOG_MAX_MB = 20         # Log rotates to <path>.1 past this size
+LATENCY_WINDOW = 500            # Recent turns kept for p50/p95/p99
+
 # ─── STT Settings ────────────────────────────────────────────────────────────
 WHISPER_MODEL = "whisper-large-v3"
 
+# ─── Streaming STT ───────────────────────────────────────────────────────────
+# While the user talks, the voice component cuts the recording at short pauses
+# and uploads each segment; segments are transcribed in the background and
+# merged, so end-of-speech only waits for the last tail.
+STT_STREAMING = True
+STT_SEGMENT_PAUSE_MS = 350      # Pause that ends a segment (well under SILENCE_DURATION)
+STT_SEGMENT_MIN_MS = 1500       # Don't cut segments shorter than this
+STT_SEGMENT_MAX_MS = 8000       # Force a cut in long unbroken speech
+STT_STREAM_WORKERS = 4          # Background transcription threads (process-wide)
+STT_STREAM_TIMEOUT = 30         # Seconds to wait for outstanding segments
+
 # ─── Voice Loop Settings ─────────────────────────────────────────────────────
 SILENCE_THRESHOLD = 0.015       # RMS threshold — below this = silence
 SILENCE_DURATION = 1.5          # Seconds of silence before auto-stop
 MIC_DELAY_MS = 300              # Delay (ms) after TTS before mic activates
 MIN_SPEECH_DURATION = 0.5       # Minimum seconds of speech to process
 
+# ─── Adaptive VAD ────────────────────────────────────────────────────────────
+# An AudioWorklet tracks the room's noise floor and treats speech as anything
+# VAD_SNR_RATIO above it, so noisy offices still end turns. The end-of-turn
+# wait adapts to the speaker's own mid-sentence pauses, between the min and
+# SILENCE_DURATION. Browsers without AudioWorklet use the fixed values above.
+VAD_WORKLET = True
+VAD_FRAME_MS = 20               # Analysis frame
+VAD_SNR_RATIO = 3.0             # Speech threshold = noise floor × ratio
+VAD_MIN_THRESHOLD = 0.005       # RMS below this is never speech
+VAD_START_FRAMES = 3            # Consecutive loud frames that start speech
+VAD_HANGOVER_MIN_MS = 500       # Shortest end-of-turn wait
+VAD_HANGOVER_FACTOR = 2.0       # End-of-turn wait = factor × typical pause
+
+# ─── Upload Preparation ──────────────────────────────────────────────────────
+# The browser records a 16 kHz mono stream at a speech bitrate and trims
+# leading/trailing silence with its VAD before upload. Recordings from clients
+# that couldn't are normalized server-side with ffmpeg (skipped if missing).
+AUDIO_PREPARE_CLIENT = True
+AUDIO_SAMPLE_RATE = 16000       # Hz — what Whisper resamples to anyway
+AUDIO_UPLOAD_BITRATE = 24000    # bits/s Opus — plenty for speech
+AUDIO_TRIM_PAD_MS = 250         # Silence kept around speech when trimming
+AUDIO_LEAD_TRIM_MS = 800        # Recorder restarts after this much leading silence
+AUDIO_NORMALIZE_SERVER = True   # ffmpeg fallback for unprepared uploads
+AUDIO_NORMALIZE_TIMEOUT = 10    # Seconds allowed for one ffmpeg run
+
+# ─── Barge-in ────────────────────────────────────────────────────────────────
+# The mic stays monitored while a reply is generated or spoken. Sustained
+# speech above a (higher, echo-tolerant) threshold stops playback and cancels
+# the in-flight LLM stream and TTS syntheses.
+BARGE_IN = True
+BARGE_IN_THRESHOLD = 0.05       # RMS — above speaker bleed through echo cancellation
+BARGE_IN_MS = 300               # Speech must last this long to interrupt
+
+# ─── Voice Audio Transport ───────────────────────────────────────────────────
+# "bytes": audio crosses the component boundary as raw binary (TTS segments as
+# one bytes arg, recordings as a bytes component value) and session state only
+# keeps handles into an in-process store. "base64": the original string path.
+AUDIO_TRANSPORT = "bytes"
+AUDIO_STORE_TTL = 300           # Seconds a stored clip stays resolvable
+AUDIO_STORE_MAX_MB = 64         # Store budget (oldest clips dropped first)
+
 # ─── System Prompt ───────────────────────────────────────────────────────────
 CRM_SYSTEM_PROMPT = """You are a warm and intelligent CRM consultant who helps businesses with CRM implementation proposals.
 
@@ -4,6 +4,7 @@
 # ──────────────────────────────────────────────────────────────────────────────
 
 import os
+import threading
 import streamlit as st
 from supabase import create_client, Client
 
@@ -24,3 +25,23 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     )
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# ─── Query Counter ───────────────────────────────────────────────────────────
+# Counts PostgREST requests per thread, so a script run can report its own
+# database cost (background writers run on other threads and don't count).
+_query_counts = threading.local()
+
+
+def _count_request(_request):
+    _query_counts.n = getattr(_query_counts, "n", 0) + 1
+
+
+def db_call_count() -> int:
+    """Database requests issued so far by the calling thread."""
+    return getattr(_query_counts, "n", 0)
+
+
+try:
+    supabase.postgrest.session.event_hooks["request"].append(_count_request)
+except AttributeError:
+    print("[DB] Query counting unavailable for this supabase client version")
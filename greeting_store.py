@@ -0,0 +1,114 @@
+# ─── greeting_store.py ────────────────────────────────────────────────────────
+# Pre-generated opening greetings, one small pool per model.
+# The greeting prompt is always the same (CRM_SYSTEM_PROMPT + empty chat), so
+# greetings and their TTS audio are generated ahead of time in the background
+# and served instantly on new chats, logins and refreshes.
+# Refills only ever use the deployment's own GROQ_API_KEY (secrets or env):
+# the pools are shared by every session, so a key typed into the sidebar must
+# never pay for greetings other users receive.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+
+from config import GREETING_POOL_SIZE, GREETING_TTL
+from ai_services import call_ai, is_error_reply
+from tts_service import synthesize
+
+
+def _server_api_key() -> str:
+    """GROQ_API_KEY from st.secrets (Streamlit Cloud) or .env — never a session's key."""
+    try:
+        return st.secrets["GROQ_API_KEY"]
+    except Exception:
+        from dotenv import load_dotenv
+        load_dotenv()
+        return os.getenv("GROQ_API_KEY", "")
+
+
+class GreetingStore:
+    """
+    Per-model pools of {"text", "audio", "created"} greetings.
+
+    take() never blocks on the network: it returns a pooled greeting (or
+    None when the pool is still cold) and schedules background refills for
+    pools that are short or hold stale entries. Without a server-owned API
+    key there are no background refills; pools then only hold greetings
+    handed over with add().
+    """
+
+    def __init__(self, pool_size: int, ttl: float):
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self._api_key: str | None = None  # resolved on first refill
+        self._lock = threading.Lock()
+        self._pools: dict[str, list[dict]] = {}
+        self._inflight: set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="greeting")
+
+    def take(self, model: str) -> dict | None:
+        """Return a ready greeting for model, refreshing the pool in the background."""
+        with self._lock:
+            fresh = [g for g in self._pools.get(model, [])
+                     if time.time() - g["created"] < self.ttl]
+            self._pools[model] = fresh
+            greeting = random.choice(fresh) if fresh else None
+        self.warm([model])
+        return greeting
+
+    def add(self, model: str, text: str, audio: bytes = b""):
+        """Add a greeting generated elsewhere (e.g. a cold-start fallback)."""
+        if is_error_reply(text):
+            return
+        with self._lock:
+            pool = self._pools.setdefault(model, [])
+            pool.append({"text": text, "audio": audio, "created": time.time()})
+            del pool[:-self.pool_size]
+
+    def warm(self, models: list[str]):
+        """Schedule background generation (on the server key) for any pool that needs it."""
+        if self._api_key is None:
+            self._api_key = _server_api_key()
+        api_key = self._api_key
+        if not api_key:
+            return
+        for model in models:
+            with self._lock:
+                if model in self._inflight or not self._needs_refill(model):
+                    continue
+                self._inflight.add(model)
+            self._executor.submit(self._refill, api_key, model)
+
+    def _needs_refill(self, model: str) -> bool:
+        """Pool is short, or its oldest greeting is past half its TTL. Caller holds the lock."""
+        pool = self._pools.get(model, [])
+        return (
+            len(pool) < self.pool_size
+            or any(time.time() - g["created"] > self.ttl / 2 for g in pool)
+        )
+
+    def _refill(self, api_key: str, model: str):
+        """Generate one greeting (text + audio); add() rotates out the oldest."""
+        ok = False
+        try:
+            text = call_ai(api_key, model, [])
+            if not is_error_reply(text):
+                # Background work queues as one shared "user" behind live sessions' turns
+                self.add(model, text, synthesize(text, user_key="greeting-pool"))
+                ok = True
+        except Exception as e:
+            print(f"[Greeting Store] Refill failed for {model}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.discard(model)
+        # Keep going until the pool is full and fresh; stop on errors
+        if ok:
+            self.warm([model])
+
+
+# Process-wide instance shared by all Streamlit sessions
+greeting_store = GreetingStore(GREETING_POOL_SIZE, GREETING_TTL)
@@ -0,0 +1,194 @@
+# ─── latency_trace.py ─────────────────────────────────────────────────────────
+# Per-stage latency tracing for chat and voice turns.
+# Each turn gets a TurnTrace; stages are timed as spans and the finished turn
+# is appended to a JSON-lines log and to an in-memory window that feeds the
+# admin percentiles. One instance (`tracer`) is shared by all sessions.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import os
+import json
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from config import LATENCY_LOG_PATH, LATENCY_LOG_MAX_MB, LATENCY_WINDOW
+from db import db_call_count
+
+# Display order; a turn only carries the stages it went through
+STAGES = (
+    "endpoint",         # last voiced frame → VAD ends the turn
+    "decode",           # component value → audio bytes
+    "normalize",        # server-side downmix/trim (unprepared uploads only)
+    "stt",              # call_stt
+    "llm_ttft",         # stream_ai start → first token
+    "llm_total",        # stream_ai start → last token
+    "tts_first_audio",  # first token → first sentence audio ready
+    "tts_lead",         # first token → first sentence playing (mid-stream)
+    "tts_wait",         # synthesis still pending after the stream ended
+    "encode",           # audio segments → transport (store handles)
+    "save",             # auto_save
+    "rerun",            # st.rerun() → reply handed to the browser
+    "total",
+)
+
+
+class TurnTrace:
+    """Spans for one user turn, tagged with session, user and model."""
+
+    def __init__(self, user_key: str, session_id: str | None, model: str, voice: bool):
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.tags = {"user_key": user_key, "session_id": session_id,
+                     "model": model, "voice": voice}
+        self.spans: dict[str, float] = {}  # stage → milliseconds
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._rerun_started = None
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time the enclosed block as `stage`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage: str, seconds: float):
+        """Record a duration measured elsewhere (e.g. time to first token)."""
+        self.spans[stage] = round(seconds * 1000, 1)
+
+    def add_run(self, meter: "RunMeter", part: str):
+        """Tag the turn with a script run's cost; part is "turn" or "rerun"."""
+        seconds, calls = meter.usage()
+        self.tags[f"{part}_script_s"] = round(seconds, 4)
+        self.tags[f"{part}_db_calls"] = calls
+        if part == "rerun":
+            self.tags["rerun_scope"] = meter.scope
+
+    def begin_rerun(self):
+        self._rerun_started = time.perf_counter()
+
+    def end_rerun(self):
+        if self._rerun_started is not None:
+            self.record("rerun", time.perf_counter() - self._rerun_started)
+
+    def to_dict(self) -> dict:
+        return {
+            "ts": self.started_at,
+            "turn_id": self.turn_id,
+            **self.tags,
+            "spans": {s: self.spans[s] for s in STAGES if s in self.spans},
+        }
+
+
+class RunMeter:
+    """Script-seconds and database calls of one Streamlit run (app or fragment)."""
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self.closed = False
+        self._t0 = time.perf_counter()
+        self._db0 = db_call_count()
+        self._usage = None
+
+    def usage(self) -> tuple[float, int]:
+        """(seconds, db_calls) so far, or the final figures once closed."""
+        if self._usage is not None:
+            return self._usage
+        return time.perf_counter() - self._t0, db_call_count() - self._db0
+
+    def close(self):
+        self._usage = self.usage()
+        self.closed = True
+
+
+class LatencyTracer:
+    """Collects finished turns: JSON-lines log + rolling percentile window."""
+
+    def __init__(self, log_path: str, max_log_bytes: int, window: int):
+        self.log_path = log_path
+        self.max_log_bytes = max_log_bytes
+        self._lock = threading.Lock()
+        self._turns = deque(maxlen=window)
+
+    def start(self, user_key: str, session_id: str | None, model: str, voice: bool) -> TurnTrace:
+        return TurnTrace(user_key, session_id, model, voice)
+
+    def finish(self, trace: TurnTrace) -> dict:
+        """Close a turn, log it and return its record."""
+        trace.record("total", time.perf_counter() - trace._t0)
+        record = trace.to_dict()
+        with self._lock:
+            self._turns.append(record)
+            self._write(record)
+        return record
+
+    def percentiles(self) -> dict[str, dict]:
+        """p50/p95/p99 (ms) and sample count per stage over the window."""
+        with self._lock:
+            turns = list(self._turns)
+        result = {}
+        for stage in STAGES:
+            values = sorted(t["spans"][stage] for t in turns if stage in t["spans"])
+            if not values:
+                continue
+            result[stage] = {
+                "count": len(values),
+                "p50": _pct(values, 0.50),
+                "p95": _pct(values, 0.95),
+                "p99": _pct(values, 0.99),
+            }
+        return result
+
+    def tag_percentiles(self, tag: str) -> dict | None:
+        """p50/p95 and count of a numeric tag (e.g. upload_bytes) over the window."""
+        with self._lock:
+            values = sorted(t[tag] for t in self._turns if isinstance(t.get(tag), (int, float)))
+        if not values:
+            return None
+        return {"count": len(values), "p50": _pct(values, 0.50), "p95": _pct(values, 0.95)}
+
+    def routing_summary(self) -> dict[str, dict]:
+        """Per route and model: turns, first-token p50/p95 (ms), hedges fired and won."""
+        with self._lock:
+            turns = [t for t in self._turns if "route" in t]
+        groups: dict[str, list[dict]] = {}
+        for t in turns:
+            groups.setdefault(f"{t['route']} · {t['model']}", []).append(t)
+        result = {}
+        for key, ts in groups.items():
+            ttft = sorted(t["spans"]["llm_ttft"] for t in ts if "llm_ttft" in t["spans"])
+            result[key] = {
+                "count": len(ts),
+                "ttft_p50": _pct(ttft, 0.50) if ttft else 0.0,
+                "ttft_p95": _pct(ttft, 0.95) if ttft else 0.0,
+                "hedged": sum(1 for t in ts if t.get("hedged")),
+                "hedge_wins": sum(1 for t in ts if t.get("hedged") and t.get("llm_winner") != t["model"]),
+            }
+        return result
+
+    def prepared_share(self) -> float | None:
+        """Fraction of voice uploads the browser had already downmixed and trimmed."""
+        with self._lock:
+            flags = [t["client_prepared"] for t in self._turns if "client_prepared" in t]
+        return sum(flags) / len(flags) if flags else None
+
+    def _write(self, record: dict):
+        """Append one line, rotating the log once it passes its size cap. Caller holds the lock."""
+        try:
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.max_log_bytes:
+                os.replace(self.log_path, f"{self.log_path}.1")
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"[Latency Trace] Log write failed: {e}")
+
+
+def _pct(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+# Process-wide instance shared by all Streamlit sessions
+tracer = LatencyTracer(LATENCY_LOG_PATH, LATENCY_LOG_MAX_MB * 1024 * 1024, LATENCY_WINDOW)
@@ -0,0 +1,91 @@
+# ─── migrate_sessions.py ──────────────────────────────────────────────────────
+# One-off backfill of the `sessions` summary table from existing `chats` rows.
+# Run after applying migrations/002_sessions.sql:
+#
+#   python migrate_sessions.py              # backfill everything
+#   python migrate_sessions.py --dry-run    # count only, write nothing
+#
+# Reads `chats` in keyset-paginated batches (id > last_id), so it is safe to
+# run against a live database and cheap to re-run — only sessions missing
+# from `sessions` are inserted; rows the app already maintains are left as is.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import argparse
+
+from db import supabase
+from config import SESSIONS_BACKFILL_BATCH
+
+
+def scan_chats(batch_size: int) -> dict:
+    """Aggregate every `chats` row into per-session summaries."""
+    sessions = {}
+    last_id = 0
+    while True:
+        result = (
+            supabase.table("chats")
+            .select("id, user_key, session_id, title, created_at")
+            .gt("id", last_id)
+            .order("id")
+            .limit(batch_size)
+            .execute()
+        )
+        rows = result.data
+        if not rows:
+            break
+
+        for row in rows:
+            key = (row["user_key"], row["session_id"])
+            s = sessions.get(key)
+            if s is None:
+                s = sessions[key] = {
+                    "user_key": row["user_key"],
+                    "session_id": row["session_id"],
+                    "title": row["title"] or "Untitled",
+                    "message_count": 0,
+                    "created_at": row["created_at"],
+                    "updated_at": row["created_at"],
+                }
+            s["message_count"] += 1
+            if row["created_at"] < s["created_at"]:
+                s["created_at"] = row["created_at"]
+            if row["created_at"] >= s["updated_at"]:
+                # Newest row carries the current title
+                s["updated_at"] = row["created_at"]
+                s["title"] = row["title"] or s["title"]
+
+        last_id = rows[-1]["id"]
+        print(f"  scanned up to chats.id={last_id} — {len(sessions)} session(s)")
+    return sessions
+
+
+def write_sessions(sessions: dict, batch_size: int):
+    """Insert summaries missing from `sessions` in batches; existing rows win."""
+    items = list(sessions.values())
+    for i in range(0, len(items), batch_size):
+        chunk = items[i:i + batch_size]
+        supabase.table("sessions").upsert(
+            chunk, on_conflict="user_key,session_id", ignore_duplicates=True
+        ).execute()
+        print(f"  wrote {i + len(chunk)}/{len(items)} session(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the sessions summary table from chats.")
+    parser.add_argument("--batch-size", type=int, default=SESSIONS_BACKFILL_BATCH,
+                        help="Rows read (and sessions written) per query")
+    parser.add_argument("--dry-run", action="store_true", help="Scan only, write nothing")
+    args = parser.parse_args()
+
+    print("Scanning chats…")
+    sessions = scan_chats(args.batch_size)
+    print(f"Found {len(sessions)} session(s).")
+    if args.dry_run or not sessions:
+        return
+
+    print("Writing sessions…")
+    write_sessions(sessions, args.batch_size)
+    print("Done.")
+
+
+if __name__ == "__main__":
+    main()
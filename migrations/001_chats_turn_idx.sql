@@ -0,0 +1,24 @@
+-- ─── 001_chats_turn_idx.sql ─────────────────────────────────────────────────
+-- Adds a per-session turn index to `chats` so saves can upsert only the new
+-- user/assistant pair instead of deleting and re-inserting the whole session.
+-- Run once in the Supabase SQL editor before enabling INCREMENTAL_SAVES.
+-- ─────────────────────────────────────────────────────────────────────────────
+
+alter table chats add column if not exists turn_idx integer;
+
+-- Backfill existing rows in their original order
+update chats c
+set turn_idx = ordered.idx
+from (
+    select id,
+           row_number() over (partition by user_key, session_id
+                              order by created_at, id) - 1 as idx
+    from chats
+) ordered
+where c.id = ordered.id
+  and c.turn_idx is null;
+
+alter table chats alter column turn_idx set not null;
+
+create unique index if not exists chats_session_turn_uidx
+    on chats (user_key, session_id, turn_idx);
@@ -0,0 +1,19 @@
+-- ─── 002_sessions.sql ───────────────────────────────────────────────────────
+-- One summary row per chat session, so the sidebar list is a single indexed,
+-- paginated query instead of a scan over every message row in `chats`.
+-- Kept up to date by auth.save_history(); backfill existing data with
+--   python migrate_sessions.py
+-- ─────────────────────────────────────────────────────────────────────────────
+
+create table if not exists sessions (
+    user_key      text        not null,
+    session_id    text        not null,
+    title         text        not null default 'Untitled',
+    message_count integer     not null default 0,
+    created_at    timestamptz not null default now(),
+    updated_at    timestamptz not null default now(),
+    primary key (user_key, session_id)
+);
+
+create index if not exists sessions_user_updated_idx
+    on sessions (user_key, updated_at desc);
@@ -0,0 +1,13 @@
+-- ─── 003_user_chat_stats.sql ────────────────────────────────────────────────
+-- Per-user chat statistics for the admin dashboard, in one query.
+-- Aggregates the small `sessions` summary table (see 002_sessions.sql), so it
+-- stays cheap without a materialized refresh job.
+-- ─────────────────────────────────────────────────────────────────────────────
+
+create or replace view user_chat_stats as
+select user_key,
+       count(*)                          as chat_count,
+       coalesce(sum(message_count), 0)   as message_pairs,
+       max(updated_at)                   as last_activity
+from sessions
+group by user_key;
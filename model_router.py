@@ -0,0 +1,246 @@
+# ─── model_router.py ──────────────────────────────────────────────────────────
+# Per-turn model routing and first-token hedging.
+# Routing: short questionnaire turns go to the fast model, the final summary
+# (and revisions of it) to the large one. Hedging: if the primary request has
+# no first token by HEDGE_DEADLINE, a second request on HEDGE_MODEL races it
+# and whichever produces a first token first is streamed; the other is closed.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import re
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    ROUTE_FAST_MODEL, ROUTE_SUMMARY_MODEL, ROUTE_SUMMARY_AFTER, ROUTE_SUMMARY_REQUESTS,
+    HEDGE_MODEL, HEDGE_DEADLINE, ADMISSION_LIMITS,
+)
+from ai_services import (
+    stream_ai, ConversationContext, last_call_info, is_error_reply, record_early_close,
+    ErrorReply, SERVER_BUSY_REPLY,
+)
+from admission import gates, AdmissionTimeout
+
+
+# ─── Routing ────────────────────────────────────────────────────────────────
+
+_SUMMARY_REQUEST = re.compile("|".join(ROUTE_SUMMARY_REQUESTS), re.IGNORECASE)
+
+
+def route_turn(conversation: list) -> tuple[str, str]:
+    """
+    Pick the model for the reply to the latest user message.
+
+    The summary turn is the reply to the last questionnaire question, to a
+    correction of the summary, or to an explicit request for a recap.
+
+    Returns:
+        (model, reason) — reason is "summary" or "questionnaire"
+    """
+    user = next((m["content"] for m in reversed(conversation) if m["role"] == "user"), "")
+    previous = ""
+    if len(conversation) >= 2 and conversation[-2]["role"] == "assistant":
+        previous = conversation[-2]["content"]
+
+    if any(cue in previous.lower() for cue in ROUTE_SUMMARY_AFTER):
+        return ROUTE_SUMMARY_MODEL, "summary"
+    if _SUMMARY_REQUEST.search(user.strip()):
+        return ROUTE_SUMMARY_MODEL, "summary"
+    return ROUTE_FAST_MODEL, "questionnaire"
+
+
+# ─── Hedging ────────────────────────────────────────────────────────────────
+# Each racer is a stream_ai generator pumped on its own thread into a shared
+# queue; the caller's generator reads the queue, so it still sees one stream
+# and close() (Stop, barge-in, rerun) stops both racers. Admission slots are
+# taken on the caller's thread before a racer is handed to the pool, so the
+# fair per-user queue (and its "you're in queue" notice) stays in front, and
+# every pool thread holds an LLM slot — the pool can never be the bottleneck.
+
+_racers = ThreadPoolExecutor(max_workers=ADMISSION_LIMITS["llm"], thread_name_prefix="llm-hedge")
+
+
+class _Abandoned(Exception):
+    """Ends a racer's rate-limit wait once it has lost or the turn was closed."""
+
+
+def _rate_relay(role: str, events: queue.Queue, stop: threading.Event):
+    """on_rate_limit for a racer: report the wait to the caller's thread, stop if told to."""
+    def relay(seconds: float):
+        if stop.is_set():
+            raise _Abandoned(role)
+        events.put((role, "wait", seconds))
+    return relay
+
+
+def _pump(role: str, tokens, events: queue.Queue, stop: threading.Event):
+    """Forward a racer's tokens until it ends or loses; runs on a racer thread."""
+    try:
+        for token in tokens:
+            if stop.is_set():
+                break
+            events.put((role, "token", token))
+    except Exception as e:
+        events.put((role, "token", ErrorReply(f"Error: {e}")))
+    finally:
+        tokens.close()  # a loser's HTTP stream is dropped here
+        events.put((role, "done", last_call_info()))
+
+
+def stream_hedged(api_key: str, model: str, conversation: list,
+                  context: ConversationContext | None = None,
+                  hedge_model: str | None = HEDGE_MODEL,
+                  deadline: float = HEDGE_DEADLINE,
+                  user_key: str = "", on_queue=None, on_rate_limit=None,
+                  report: dict | None = None):
+    """
+    stream_ai() with a hedge against a slow first token.
+
+    Args:
+        api_key: Groq API key
+        model: Primary model
+        conversation: List of {"role": ..., "content": ...} dicts
+        context: Conversation's ConversationContext (the primary uses it; the
+                 hedge works on a read-only fork)
+        hedge_model: Model for the second request; None or the primary's
+                     model disables hedging
+        deadline: Seconds without a first token before the hedge starts
+        user_key, on_queue: As for stream_ai. Only the primary queues for a
+                            slot; the hedge is skipped when none is free
+        on_rate_limit: As for stream_ai. Racers wait out rate limits on their
+                       own threads, so it is called from this generator (the
+                       caller's thread) with the latest wait until a winner
+        report: Filled with the decision — primary, hedged, hedge_after_s,
+                winner, ttft_s, the winner's Groq wait/retries ("groq") and,
+                once the generator is closed early, tokens_saved
+
+    Yields:
+        str: Text chunks of the winning reply
+    """
+    report = report if report is not None else {}
+    report.update(primary=model, hedged=False, winner=model)
+    started = time.perf_counter()
+
+    if not hedge_model or hedge_model == model:
+        tokens = stream_ai(api_key, model, conversation, context, user_key, on_queue,
+                           on_rate_limit)
+        try:
+            for token in tokens:
+                report.setdefault("ttft_s", time.perf_counter() - started)
+                yield token
+        finally:
+            tokens.close()  # same thread — stream_ai has recorded tokens_saved on return
+            if context is not None:
+                report["tokens_saved"] = context.last_usage.get("tokens_saved", 0)
+        report["groq"] = last_call_info()
+        return
+
+    try:
+        gates["llm"].acquire(user_key, on_queue)
+    except AdmissionTimeout:
+        yield SERVER_BUSY_REPLY
+        return
+    admitted_at = time.perf_counter()  # the hedge deadline runs from here, not from queueing
+
+    events: queue.Queue = queue.Queue()
+    stops: dict[str, threading.Event] = {}
+    models = {"primary": model, "hedge": hedge_model}
+    failed: dict[str, str] = {}  # racer → error reply it produced instead of an answer
+    hedge_ctx = context.fork() if context else None
+    generated = ""
+
+    def launch(role: str, ctx):
+        # Slot already held; early closes are accounted here, not by stream_ai
+        stops[role] = threading.Event()
+        tokens = stream_ai(api_key, models[role], conversation, ctx, user_key,
+                           on_rate_limit=_rate_relay(role, events, stops[role]),
+                           admitted=True, track_close=False)
+        _racers.submit(_pump, role, tokens, events, stops[role])
+
+    def start_hedge(reason: str):
+        report["hedge_reason"] = reason
+        if not gates["llm"].try_acquire(user_key):
+            report["hedge_skipped"] = True  # no free slot — don't add load to a busy server
+            return
+        report.update(hedged=True, hedge_after_s=time.perf_counter() - started)
+        launch("hedge", hedge_ctx)
+
+    launch("primary", context)
+    winner = None
+    try:
+        while True:
+            wait = None
+            if winner is None and "hedge_reason" not in report:
+                wait = max(admitted_at + deadline - time.perf_counter(), 0)
+            try:
+                role, kind, value = events.get(timeout=wait)
+            except queue.Empty:
+                start_hedge("deadline")
+                continue
+
+            if kind == "wait":
+                if winner is None and on_rate_limit is not None:
+                    on_rate_limit(value)
+                continue
+            if winner is None:
+                if kind == "token" and is_error_reply(value):
+                    # An error isn't an answer — give the other racer a chance
+                    failed[role] = value
+                    stops[role].set()
+                if kind == "token" and role not in failed:
+                    winner = role
+                    report.update(winner=models[role], ttft_s=time.perf_counter() - started)
+                    for other in stops:
+                        if other != role and other not in failed:
+                            stops[other].set()
+                            record_early_close("", lost_race=True)
+                    if role == "hedge" and context is not None:
+                        # Token report of the request that actually answered
+                        context.last_usage = hedge_ctx.last_usage
+                    generated += value
+                    yield value
+                    continue
+                # Error reply, or "done" before any token — this racer is out
+                failed.setdefault(role, "")
+                if "hedge_reason" not in report:
+                    start_hedge("primary_error" if failed["primary"] else "primary_empty")
+                if len(failed) < len(stops):
+                    continue
+                # Both failed — surface the first error so the turn shows it
+                source = "primary" if failed["primary"] else "hedge"
+                report.update(winner=models[source], ttft_s=time.perf_counter() - started)
+                if failed[source]:
+                    yield failed[source]
+                return
+
+            if role != winner:
+                continue
+            if kind == "token":
+                generated += value
+                yield value
+            elif kind == "done":
+                report["groq"] = value
+                return
+    except GeneratorExit:
+        # Closed by the caller (Stop, barge-in, rerun) — account it now, on
+        # this thread, so the caller can read it right after close()
+        saved = record_early_close(generated)
+        report["tokens_saved"] = saved
+        if context is not None:
+            context.last_usage["tokens_saved"] = saved
+        raise
+    finally:
+        for stop in stops.values():
+            stop.set()
+
+
+def report_tags(report: dict) -> dict:
+    """Trace tags for a stream_hedged() report (logged with the turn's latencies)."""
+    tags = {"hedged": report.get("hedged", False), "llm_winner": report.get("winner")}
+    if report.get("hedged"):
+        tags.update(hedge_reason=report.get("hedge_reason"),
+                    hedge_after_ms=round(report["hedge_after_s"] * 1000))
+    if "ttft_s" in report:
+        tags["winner_ttft_ms"] = round(report["ttft_s"] * 1000)
+    return tags
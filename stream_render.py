@@ -0,0 +1,88 @@
+# ─── stream_render.py ─────────────────────────────────────────────────────────
+# Chat bubble rendering.
+# Finished messages are escaped once and memoized (message_html). A streamed
+# reply is escaped token-by-token and pushed to its Streamlit placeholder only
+# every STREAM_FLUSH_INTERVAL seconds (or STREAM_FLUSH_CHARS new characters)
+# instead of once per token.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import html
+import time
+import threading
+from functools import lru_cache
+
+from config import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_CHARS, TRANSCRIPT_HTML_CACHE
+
+_BUBBLE = """
+<div class="msg-bot">
+  <div class="bot-av"></div>
+  <div class="bubble-bot">{body}{cursor}</div>
+</div>"""
+_USER_BUBBLE = '<div class="msg-user"><div class="bubble-user">{body}</div></div>'
+_CURSOR = '<span class="streaming-dot"></span>'
+
+# Process-wide totals, for the admin dashboard
+_totals_lock = threading.Lock()
+_totals = {"replies": 0, "tokens": 0, "flushes": 0, "bytes": 0}
+
+
+@lru_cache(maxsize=TRANSCRIPT_HTML_CACHE)
+def message_html(role: str, content: str) -> str:
+    """Escaped bubble markup for a finished message, built once per content."""
+    body = html.escape(content, quote=False)
+    if role == "user":
+        return _USER_BUBBLE.format(body=body)
+    return _BUBBLE.format(body=body, cursor="")
+
+
+class StreamRenderer:
+    """
+    Render a streamed reply into a placeholder (st.empty()) with few updates.
+
+    feed() every token, then finish() once the stream ends. `stats` counts
+    tokens, flushes and the HTML bytes sent for this reply.
+    """
+
+    def __init__(self, placeholder, interval: float = STREAM_FLUSH_INTERVAL,
+                 max_chars: int = STREAM_FLUSH_CHARS):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.max_chars = max_chars
+        self._body = ""           # escaped so far
+        self._unflushed = 0       # escaped chars since the last flush
+        self._last_flush = 0.0
+        self.stats = {"tokens": 0, "flushes": 0, "bytes": 0}
+
+    def feed(self, token: str):
+        """Escape and buffer a token; flush if the interval or budget is due."""
+        if not token:
+            return
+        escaped = html.escape(token, quote=False)
+        self._body += escaped
+        self._unflushed += len(escaped)
+        self.stats["tokens"] += 1
+        if (self._unflushed >= self.max_chars
+                or time.perf_counter() - self._last_flush >= self.interval):
+            self._flush(cursor=True)
+
+    def finish(self):
+        """Paint the complete reply without the streaming cursor."""
+        self._flush(cursor=False)
+        with _totals_lock:
+            _totals["replies"] += 1
+            for k, v in self.stats.items():
+                _totals[k] += v
+
+    def _flush(self, cursor: bool):
+        markup = _BUBBLE.format(body=self._body, cursor=_CURSOR if cursor else "")
+        self.placeholder.markdown(markup, unsafe_allow_html=True)
+        self._unflushed = 0
+        self._last_flush = time.perf_counter()
+        self.stats["flushes"] += 1
+        self.stats["bytes"] += len(markup.encode("utf-8"))
+
+
+def render_stats() -> dict:
+    """Cumulative token / flush / byte counters across all replies."""
+    with _totals_lock:
+        return dict(_totals)
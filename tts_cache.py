@@ -0,0 +1,189 @@
+# ─── tts_cache.py ─────────────────────────────────────────────────────────────
+# Content-addressed cache for synthesized TTS audio.
+# A bounded in-memory LRU sits in front of a size-capped on-disk store.
+# One instance (`audio_cache`) is shared by all sessions in the process.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from config import TTS_CACHE_DIR, TTS_CACHE_MEMORY_MB, TTS_CACHE_DISK_MB
+
+
+def cache_key(clean_text: str, voice: str, rate: str) -> str:
+    """SHA-256 over everything that changes the synthesized audio."""
+    raw = f"{voice}\0{rate}\0{clean_text}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class AudioCache:
+    """
+    Two-tier MP3 cache: memory LRU → disk store.
+
+    Memory hits are promoted to the front of the LRU; disk hits are copied
+    back into memory. Both tiers evict least-recently-used entries once
+    their byte budget is exceeded.
+    """
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        self._synth_seconds_total = 0.0  # across misses, for savings estimate
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "seconds_saved": 0.0,
+        }
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_size = sum(
+                e.stat().st_size for e in os.scandir(directory) if e.name.endswith(".mp3")
+            )
+        except OSError as e:
+            print(f"[TTS Cache] Disk tier disabled: {e}")
+            self.disk_bytes = 0
+
+    # ── Lookup / store ──────────────────────────────────────────────────────
+
+    def get(self, key: str) -> bytes | None:
+        """Return cached audio for key, or None on a miss."""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                self.stats["seconds_saved"] += self._avg_synth_seconds()
+                return audio
+
+        audio = self._read_disk(key)
+        with self._lock:
+            if audio is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self.stats["seconds_saved"] += self._avg_synth_seconds()
+            self._put_memory(key, audio)
+            return audio
+
+    def put(self, key: str, audio: bytes, synth_seconds: float = 0.0):
+        """Store freshly synthesized audio in both tiers."""
+        if not audio:
+            return
+        with self._lock:
+            self._synth_seconds_total += synth_seconds
+            self._put_memory(key, audio)
+        self._write_disk(key, audio)
+
+    def snapshot(self) -> dict:
+        """Counters plus current tier sizes, for dashboards and logs."""
+        with self._lock:
+            lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hits = lookups - self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size,
+            }
+
+    # ── Memory tier ─────────────────────────────────────────────────────────
+
+    def _put_memory(self, key: str, audio: bytes):
+        """Insert into the LRU. Caller holds the lock."""
+        if len(audio) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self.stats["memory_evictions"] += 1
+
+    def _avg_synth_seconds(self) -> float:
+        misses = self.stats["misses"]
+        return self._synth_seconds_total / misses if misses else 0.0
+
+    # ── Disk tier ───────────────────────────────────────────────────────────
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _read_disk(self, key: str) -> bytes | None:
+        if not self.disk_bytes:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path)  # mtime doubles as last-access time for eviction
+            return audio
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, audio: bytes):
+        if not self.disk_bytes or len(audio) > self.disk_bytes:
+            return
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        # Write-then-rename so concurrent readers never see a partial file
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(audio)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[TTS Cache] Disk write failed: {e}")
+            return
+        with self._lock:
+            self._disk_size += len(audio)
+            over = self._disk_size > self.disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Remove least-recently-used files until the store fits its budget."""
+        try:
+            entries = sorted(
+                (e for e in os.scandir(self.directory) if e.name.endswith(".mp3")),
+                key=lambda e: e.stat().st_mtime,
+            )
+        except OSError:
+            return
+        for entry in entries:
+            with self._lock:
+                if self._disk_size <= self.disk_bytes:
+                    return
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            with self._lock:
+                self._disk_size -= size
+                self.stats["disk_evictions"] += 1
+
+
+# Process-wide instance shared by all Streamlit sessions
+audio_cache = AudioCache(
+    TTS_CACHE_DIR,
+    memory_bytes=TTS_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_bytes=TTS_CACHE_DISK_MB * 1024 * 1024,
+)
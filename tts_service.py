@@ -4,9 +4,20 @@
 # ──────────────────────────────────────────────────────────────────────────────
 
 import io
+import re
+import time
 import asyncio
+import threading
+from concurrent.futures import Future, wait
 import edge_tts
-from config import EDGE_TTS_VOICE, EDGE_TTS_RATE
+from config import (
+    EDGE_TTS_VOICE, EDGE_TTS_RATE, TTS_SEGMENT_TIMEOUT,
+    TTS_POOLED_TRANSPORT, TTS_POOL_SIZE, TTS_POOL_IDLE_TIMEOUT, TTS_TRANSPORT_URL,
+    ADMISSION_TIMEOUT,
+)
+from tts_cache import audio_cache, cache_key
+from tts_transport import PooledTTSTransport, EDGE_PROTOCOL_AVAILABLE, edge_url, edge_headers
+from admission import gates
 
 
 def _clean_text(text: str) -> str:
@@ -35,6 +46,13 @@ async def _synthesize_async(text: str, voice: str = EDGE_TTS_VOICE) -> bytes:
     # Limit to ~3000 chars to avoid timeouts
     clean = clean[:3000]
 
+    if _transport is not None:
+        try:
+            return await _transport.synthesize(clean, voice, EDGE_TTS_RATE)
+        except Exception as e:
+            # Pool is a fast path only — fall back to a one-off connection
+            print(f"[TTS Pool Error] {e!r}")
+
     communicate = edge_tts.Communicate(clean, voice, rate=EDGE_TTS_RATE)
     buffer = io.BytesIO()
 
@@ -46,16 +64,144 @@ async def _synthesize_async(text: str, voice: str = EDGE_TTS_VOICE) -> bytes:
     return buffer.read()
 
 
-def synthesize(text: str, voice: str = EDGE_TTS_VOICE) -> bytes:
+# ─── Background Loop ────────────────────────────────────────────────────────
+# One event loop thread owned by the service. Syntheses from every session are
+# scheduled onto it and handed back as futures; how many reach Edge-TTS at
+# once is decided by the "tts" admission gate.
+
+class _TTSLoop:
+    """Lazily started asyncio loop running in a daemon thread."""
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=run, name="tts-loop", daemon=True).start()
+            ready.wait()
+            self._loop = loop
+            return loop
+
+    def submit(self, coro) -> Future:
+        """Schedule a coroutine on the loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+
+_tts_loop = _TTSLoop()
+
+
+# ─── Connection Pool ────────────────────────────────────────────────────────
+# Warm websockets reused across syntheses. Lives on the background loop; only
+# built when edge_tts exposes the protocol constants (or a stand-in URL is set).
+
+if TTS_TRANSPORT_URL:
+    _transport = PooledTTSTransport(lambda: TTS_TRANSPORT_URL, dict,
+                                    TTS_POOL_SIZE, TTS_POOL_IDLE_TIMEOUT)
+elif TTS_POOLED_TRANSPORT and EDGE_PROTOCOL_AVAILABLE:
+    _transport = PooledTTSTransport(edge_url, edge_headers,
+                                    TTS_POOL_SIZE, TTS_POOL_IDLE_TIMEOUT)
+else:
+    _transport = None
+
+
+def prewarm_tts():
+    """
+    Open pooled connections in the background ahead of a spoken reply.
+    Call when a turn starts so the first sentence skips the handshake.
+    """
+    if _transport is not None:
+        _tts_loop.submit(_warm())
+
+
+async def _warm():
+    try:
+        await _transport.warm()
+    except Exception as e:
+        print(f"[TTS Pool] Pre-warm failed: {e!r}")
+
+
+def transport_stats() -> dict | None:
+    """Connection pool counters, or None when pooling is off."""
+    if _transport is None:
+        return None
+    return {**_transport.stats, "idle": _transport.idle_count}
+
+
+def submit_synthesis(text: str, voice: str = EDGE_TTS_VOICE,
+                     timeout: float = TTS_SEGMENT_TIMEOUT, user_key: str = "") -> Future:
+    """
+    Start synthesizing text on the background loop.
+
+    Returns a concurrent.futures.Future resolving to MP3 bytes (empty bytes
+    for blank text). Cache hits come back already resolved; misses wait for
+    a slot in the TTS admission gate. Call .cancel() on the future to abort
+    an in-flight or queued synthesis.
+
+    Args:
+        text: The text to speak (markdown will be cleaned)
+        voice: Edge-TTS voice name (default from config)
+        timeout: Seconds before the synthesis is abandoned (queueing excluded)
+        user_key: Whose admission queue to wait in when the TTS gate is full
+
+    Raises (via the future):
+        asyncio.TimeoutError on timeout, or the Edge-TTS error
+    """
+    # Cache on exactly what Edge-TTS would receive
+    clean = _clean_text(text or "").strip()[:3000]
+    if not clean:
+        return _resolved(b"")
+    key = cache_key(clean, voice, EDGE_TTS_RATE)
+    cached = audio_cache.get(key)
+    if cached is not None:
+        return _resolved(cached)
+    return _tts_loop.submit(_synthesize_cached(clean, voice, key, timeout, user_key))
+
+
+async def _synthesize_cached(clean: str, voice: str, key: str, timeout: float,
+                             user_key: str = "") -> bytes:
+    await gates["tts"].acquire_async(user_key)
+    try:
+        started = time.perf_counter()
+        audio = await asyncio.wait_for(_synthesize_async(clean, voice), timeout)
+    finally:
+        gates["tts"].release(user_key)
+    # Disk write happens off the loop so other syntheses keep streaming
+    await asyncio.get_running_loop().run_in_executor(
+        None, audio_cache.put, key, audio, time.perf_counter() - started
+    )
+    return audio
+
+
+def _resolved(value) -> Future:
+    fut = Future()
+    fut.set_result(value)
+    return fut
+
+
+def synthesize(text: str, voice: str = EDGE_TTS_VOICE, user_key: str = "") -> bytes:
     """
     Synchronous wrapper for Edge-TTS synthesis.
 
     Converts text to natural-sounding speech using Microsoft's neural voices.
-    Returns MP3 bytes — pass directly to st.audio().
+    Returns MP3 bytes — pass directly to st.audio(). Results are served from
+    the shared audio cache when the same text/voice/rate was spoken before.
+    Safe to call from any thread, including ones with a running event loop.
 
     Args:
         text: The text to speak (markdown will be cleaned)
         voice: Edge-TTS voice name (default from config)
+        user_key: Whose admission queue to wait in when the TTS gate is full
 
     Returns:
         MP3 audio bytes, or empty bytes on failure
@@ -64,29 +210,154 @@ def synthesize(text: str, voice: str = EDGE_TTS_VOICE) -> bytes:
         return b""
 
     try:
-        # Handle event loop — Streamlit may or may not have one running
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = None
-
-        if loop and loop.is_running():
-            # We're inside an existing event loop (e.g. Streamlit)
-            # Create a new loop in a thread
-            import concurrent.futures
-            with concurrent.futures.ThreadPoolExecutor() as pool:
-                result = pool.submit(
-                    asyncio.run, _synthesize_async(text, voice)
-                ).result(timeout=30)
-            return result
-        else:
-            return asyncio.run(_synthesize_async(text, voice))
-
+        return submit_synthesis(text, voice, user_key=user_key).result(
+            timeout=ADMISSION_TIMEOUT + TTS_SEGMENT_TIMEOUT + 5)
     except Exception as e:
-        print(f"[TTS Error] {e}")
+        print(f"[TTS Error] {e!r}")
         return b""
 
 
+# ─── Sentence Pipeline ──────────────────────────────────────────────────────
+# Splits a token stream into sentences and synthesizes each one while the
+# LLM keeps generating, so only the last sentence is left after the stream.
+
+_SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*(?=\s)|\n+")
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "vs", "etc", "e.g", "i.e", "approx"}
+
+def split_sentences(text: str) -> tuple[list[str], str]:
+    """
+    Split text into complete sentences and an unfinished remainder.
+
+    A sentence ends at . ! ? or … followed by whitespace, or at a newline.
+    Common abbreviations ("e.g.", "Dr.") do not end a sentence.
+
+    Returns:
+        (complete_sentences, remainder)
+    """
+    sentences = []
+    start = 0
+    for m in _SENTENCE_END.finditer(text):
+        chunk = text[start:m.end()]
+        last_word = chunk.rstrip(".!?…\"')]\n").rsplit(None, 1)[-1:] or [""]
+        if m.group().startswith(".") and last_word[0].lower() in _ABBREVIATIONS:
+            continue
+        if any(c.isalnum() for c in chunk):
+            sentences.append(chunk.strip())
+            start = m.end()
+    return sentences, text[start:]
+
+
+# Edge-TTS (and the transport) ask for audio-24khz-48kbitrate-mono-mp3
+_MP3_BYTES_PER_SECOND = 48_000 / 8
+
+
+def audio_seconds(mp3: bytes) -> float:
+    """Playback length of a synthesized segment (constant bitrate)."""
+    return len(mp3) / _MP3_BYTES_PER_SECOND
+
+
+_FINISH_POLL = 0.1  # seconds between interrupted() checks while waiting for audio
+
+
+class SentencePipeline:
+    """
+    Overlap Edge-TTS synthesis with LLM streaming.
+
+    Feed tokens from stream_ai() with feed(); every finished sentence is
+    submitted to the background TTS loop right away. take_lead() hands out
+    the first sentence's audio as soon as it is ready, so it can play while
+    the reply still streams. Call finish() once the stream ends to flush the
+    tail and collect the remaining MP3 segments in spoken order, or cancel()
+    to abort the syntheses still in flight.
+    """
+
+    def __init__(self, voice: str = EDGE_TTS_VOICE, user_key: str = ""):
+        self.voice = voice
+        self.user_key = user_key
+        self.sentences: list[str] = []
+        self.first_audio_s: float | None = None  # first token → first audio ready
+        self._buffer = ""
+        self._futures = []
+        self._started = None
+        self._lead_taken = False
+
+    def feed(self, token: str):
+        """Add a streamed token; submits any sentence it completes."""
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._buffer += token
+        complete, self._buffer = split_sentences(self._buffer)
+        for sentence in complete:
+            self._submit(sentence)
+
+    def take_lead(self) -> bytes | None:
+        """
+        The first sentence's audio if it is ready now (never blocks).
+
+        Returns it at most once; finish() then leaves it out, since the
+        caller is playing it.
+        """
+        if self._lead_taken or not self._futures or not self._futures[0].done():
+            return None
+        fut = self._futures[0]
+        if fut.cancelled() or fut.exception() is not None or not fut.result():
+            return None
+        self._lead_taken = True
+        return fut.result()
+
+    def finish(self, timeout: float = TTS_SEGMENT_TIMEOUT + ADMISSION_TIMEOUT,
+               interrupted=None) -> list[bytes] | None:
+        """
+        Flush the remaining text and wait for all segments.
+
+        Args:
+            timeout: Seconds to wait for each segment
+            interrupted: Polled while waiting; once it returns True the rest
+                         is cancelled (e.g. the user barged in)
+
+        Returns:
+            MP3 bytes per sentence, in order, without the one take_lead()
+            returned. Failed segments are dropped. None if interrupted.
+        """
+        if self._buffer.strip():
+            self._submit(self._buffer.strip())
+        self._buffer = ""
+
+        segments = []
+        for fut in self._futures[1:] if self._lead_taken else self._futures:
+            deadline = time.monotonic() + timeout
+            while interrupted is not None and not fut.done() and time.monotonic() < deadline:
+                if interrupted():
+                    self.cancel()
+                    return None
+                wait([fut], timeout=_FINISH_POLL)
+            try:
+                audio = fut.result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception as e:
+                print(f"[TTS Pipeline Error] {e}")
+                continue
+            if audio:
+                segments.append(audio)
+        return segments
+
+    def cancel(self) -> int:
+        """Abort every synthesis of this reply that hasn't finished yet; returns how many."""
+        cancelled = sum(fut.cancel() for fut in self._futures)
+        self._buffer = ""
+        return cancelled
+
+    def _submit(self, sentence: str):
+        self.sentences.append(sentence)
+        fut = submit_synthesis(sentence, self.voice, user_key=self.user_key)
+        if not self._futures:
+            fut.add_done_callback(self._mark_first_audio)
+        self._futures.append(fut)
+
+    def _mark_first_audio(self, _fut):
+        if self._started is not None:
+            self.first_audio_s = time.perf_counter() - self._started
+
+
 async def list_voices(language: str = "en") -> list[dict]:
     """
     List available Edge-TTS voices for a language.
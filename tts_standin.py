@@ -0,0 +1,129 @@
+# ─── tts_standin.py ───────────────────────────────────────────────────────────
+# Local stand-in for the Edge-TTS websocket service.
+# Speaks the same framing (speech.config / ssml → turn.start, audio frames,
+# turn.end) and returns deterministic fake MP3 bytes, so the pooled transport
+# can be exercised without network access:
+#
+#   python tts_standin.py                       # serve on ws://127.0.0.1:8765/tts
+#   python tts_standin.py --connect-delay 0.2   # simulate handshake latency
+#   python tts_standin.py --check 20            # pooled vs unpooled comparison
+#
+# To drive the app against it, set TTS_TRANSPORT_URL in config.py.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import re
+import time
+import asyncio
+import hashlib
+import argparse
+
+from aiohttp import web, WSMsgType
+
+from config import EDGE_TTS_VOICE, EDGE_TTS_RATE, TTS_POOL_SIZE, TTS_POOL_IDLE_TIMEOUT
+from tts_transport import PooledTTSTransport, parse_headers
+
+_PROSODY_RE = re.compile(r"<prosody[^>]*>(.*)</prosody>", re.S)
+_FRAME_BYTES = 4096
+
+
+def fake_audio(text: str) -> bytes:
+    """Deterministic pseudo-MP3 payload, roughly proportional to text length."""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    return b"ID3" + seed * max(1, len(text) // 4)
+
+
+class StandInServer:
+    """aiohttp websocket app mimicking the read-aloud endpoint."""
+
+    def __init__(self, connect_delay: float = 0.0, synth_delay: float = 0.0):
+        self.connect_delay = connect_delay
+        self.synth_delay = synth_delay
+        self.stats = {"connections": 0, "requests": 0}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/tts", self._handle)
+        return app
+
+    async def _handle(self, request):
+        # Stands in for DNS + TLS + upgrade on the real service
+        await asyncio.sleep(self.connect_delay)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.stats["connections"] += 1
+
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            head, _, body = msg.data.partition("\r\n\r\n")
+            headers = parse_headers(head)
+            if headers.get("Path") == "ssml":
+                await self._speak(ws, headers.get("X-RequestId", ""), body)
+        return ws
+
+    async def _speak(self, ws, request_id: str, ssml: str):
+        self.stats["requests"] += 1
+        m = _PROSODY_RE.search(ssml)
+        audio = fake_audio(m.group(1) if m else "")
+        await ws.send_str(f"X-RequestId:{request_id}\r\nPath:turn.start\r\n\r\n{{}}")
+        await asyncio.sleep(self.synth_delay)
+        header = f"X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n".encode()
+        for i in range(0, len(audio), _FRAME_BYTES):
+            frame = len(header).to_bytes(2, "big") + header + audio[i:i + _FRAME_BYTES]
+            await ws.send_bytes(frame)
+        await ws.send_str(f"X-RequestId:{request_id}\r\nPath:turn.end\r\n\r\n{{}}")
+
+
+# ─── Offline Check ──────────────────────────────────────────────────────────
+
+async def _run_check(count: int, connect_delay: float):
+    """Synthesize `count` sentences with and without pooling; print the cost."""
+    server = StandInServer(connect_delay=connect_delay)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"ws://127.0.0.1:{port}/tts"
+
+    try:
+        for label, size in (("unpooled", 0), ("pooled", TTS_POOL_SIZE)):
+            server.stats = {"connections": 0, "requests": 0}
+            transport = PooledTTSTransport(lambda: url, dict, size, TTS_POOL_IDLE_TIMEOUT)
+            started = time.perf_counter()
+            for i in range(count):
+                text = f"Sentence number {i} of the offline check."
+                audio = await transport.synthesize(text, EDGE_TTS_VOICE, EDGE_TTS_RATE)
+                assert audio == fake_audio(text), "audio mismatch"
+            elapsed = time.perf_counter() - started
+            await transport.close()
+            print(f"{label:>9}: {count} syntheses in {elapsed * 1000:.0f}ms · "
+                  f"{server.stats['connections']} connection(s) · "
+                  f"{transport.stats['reused']} reused")
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Edge-TTS websocket service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--connect-delay", type=float, default=0.0,
+                        help="Seconds to stall each new connection (simulated handshake)")
+    parser.add_argument("--synth-delay", type=float, default=0.0,
+                        help="Seconds to stall before streaming each reply's audio")
+    parser.add_argument("--check", type=int, metavar="N",
+                        help="Run N syntheses pooled vs unpooled against an in-process server and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        asyncio.run(_run_check(args.check, args.connect_delay or 0.05))
+        return
+
+    server = StandInServer(args.connect_delay, args.synth_delay)
+    print(f"Edge-TTS stand-in on ws://{args.host}:{args.port}/tts")
+    web.run_app(server.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
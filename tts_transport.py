@@ -0,0 +1,238 @@
+# ─── tts_transport.py ─────────────────────────────────────────────────────────
+# Pooled websocket transport for Edge-TTS.
+# edge_tts.Communicate opens and tears down one websocket per utterance. This
+# transport keeps a few warm connections to the speech service and sends
+# successive synthesis requests over them (the service accepts many turns per
+# connection), so short replies skip the connect + TLS + upgrade handshake.
+# Runs on the TTS service's background event loop.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import re
+import time
+import uuid
+import asyncio
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+import aiohttp
+
+# Protocol constants and the Sec-MS-GEC token come from edge_tts itself, so
+# they track whatever the installed version requires.
+try:
+    from edge_tts.constants import WSS_URL, WSS_HEADERS, SEC_MS_GEC_VERSION
+    from edge_tts.drm import DRM
+    EDGE_PROTOCOL_AVAILABLE = True
+except ImportError:
+    EDGE_PROTOCOL_AVAILABLE = False
+
+_OUTPUT_FORMAT = "audio-24khz-48kbitrate-mono-mp3"
+_VOICE_RE = re.compile(r"^([a-z]{2,})-([A-Z]{2,})-(.+Neural)$")
+
+
+def edge_url() -> str:
+    """Fresh Edge read-aloud websocket URL (token + connection id)."""
+    return (
+        f"{WSS_URL}&Sec-MS-GEC={DRM.generate_sec_ms_gec()}"
+        f"&Sec-MS-GEC-Version={SEC_MS_GEC_VERSION}&ConnectionId={uuid.uuid4().hex}"
+    )
+
+
+def edge_headers() -> dict:
+    if hasattr(DRM, "headers_with_muid"):
+        return DRM.headers_with_muid(WSS_HEADERS)
+    return dict(WSS_HEADERS)
+
+
+# ─── Protocol Messages ──────────────────────────────────────────────────────
+
+def _timestamp() -> str:
+    return datetime.now(timezone.utc).strftime("%a %b %d %Y %H:%M:%S GMT+0000 (Coordinated Universal Time)")
+
+
+def _full_voice_name(voice: str) -> str:
+    """en-US-AriaNeural → Microsoft Server Speech Text to Speech Voice (en-US, AriaNeural)."""
+    m = _VOICE_RE.match(voice)
+    if not m:
+        return voice
+    lang, region, name = m.groups()
+    return f"Microsoft Server Speech Text to Speech Voice ({lang}-{region}, {name})"
+
+
+def _config_message() -> str:
+    return (
+        f"X-Timestamp:{_timestamp()}\r\n"
+        "Content-Type:application/json; charset=utf-8\r\n"
+        "Path:speech.config\r\n\r\n"
+        '{"context":{"synthesis":{"audio":{"metadataoptions":{'
+        '"sentenceBoundaryEnabled":"false","wordBoundaryEnabled":"false"},'
+        f'"outputFormat":"{_OUTPUT_FORMAT}"}}}}}}\r\n'
+    )
+
+
+def _ssml_message(request_id: str, text: str, voice: str, rate: str) -> str:
+    return (
+        f"X-RequestId:{request_id}\r\n"
+        "Content-Type:application/ssml+xml\r\n"
+        f"X-Timestamp:{_timestamp()}Z\r\n"
+        "Path:ssml\r\n\r\n"
+        "<speak version='1.0' xmlns='http://www.w3.org/2001/10/synthesis' xml:lang='en-US'>"
+        f"<voice name='{_full_voice_name(voice)}'>"
+        f"<prosody pitch='+0Hz' rate='{rate}' volume='+0%'>{escape(text)}</prosody>"
+        "</voice></speak>"
+    )
+
+
+def parse_headers(raw: bytes | str) -> dict:
+    """Parse 'Key:Value' header lines of a service message."""
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8", errors="replace")
+    headers = {}
+    for line in raw.split("\r\n"):
+        key, sep, value = line.partition(":")
+        if sep:
+            headers[key] = value
+    return headers
+
+
+# ─── Connection Pool ────────────────────────────────────────────────────────
+
+class _Conn:
+    def __init__(self, ws):
+        self.ws = ws
+        self.last_used = time.monotonic()
+        self.configured = False
+
+
+class PooledTTSTransport:
+    """
+    Keeps up to `size` idle websockets and reuses them across syntheses.
+
+    url_factory/headers_factory build the connection target, so the same
+    pool can talk to the real service or to the local stand-in server.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, url_factory, headers_factory, size: int, idle_timeout: float):
+        self.url_factory = url_factory
+        self.headers_factory = headers_factory
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle: list[_Conn] = []
+        self._connecting = 0  # warm() connects in flight (one loop — no lock needed)
+        self._session: aiohttp.ClientSession | None = None
+        self.stats = {"connects": 0, "reused": 0, "requests": 0, "errors": 0}
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    async def synthesize(self, text: str, voice: str, rate: str) -> bytes:
+        """Synthesize over a pooled connection, retrying once on a fresh one."""
+        self.stats["requests"] += 1
+        for attempt in range(2):
+            conn = await self._acquire(fresh=attempt > 0)
+            try:
+                audio = await self._request(conn, text, voice, rate)
+            except asyncio.CancelledError:
+                # Timeout, barge-in or a dropped ticket mid-request: the socket
+                # may still carry this utterance's frames, so it can't be
+                # pooled — close it without awaiting (we are being cancelled)
+                asyncio.ensure_future(self._close(conn))
+                raise
+            except Exception:
+                self.stats["errors"] += 1
+                await self._close(conn)
+                if attempt:
+                    raise
+                continue
+            self._release(conn)
+            return audio
+
+    async def warm(self, count: int | None = None):
+        """Open idle connections ahead of the next turn."""
+        target = min(count or self.size, self.size)
+        self._prune()
+        # Count connects in flight, so overlapping warm() calls don't overshoot
+        while len(self._idle) + self._connecting < target:
+            self._connecting += 1
+            try:
+                conn = await self._connect()
+            finally:
+                self._connecting -= 1
+            self._release(conn)
+
+    async def close(self):
+        for conn in self._idle:
+            await self._close(conn)
+        self._idle.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # ── Internals ───────────────────────────────────────────────────────────
+
+    def _prune(self):
+        """Drop idle connections the server has likely timed out."""
+        now = time.monotonic()
+        keep = []
+        for conn in self._idle:
+            if conn.ws.closed or now - conn.last_used > self.idle_timeout:
+                asyncio.ensure_future(self._close(conn))
+            else:
+                keep.append(conn)
+        self._idle = keep
+
+    async def _acquire(self, fresh: bool = False) -> _Conn:
+        self._prune()
+        if self._idle and not fresh:
+            self.stats["reused"] += 1
+            return self._idle.pop()
+        return await self._connect()
+
+    def _release(self, conn: _Conn):
+        conn.last_used = time.monotonic()
+        if len(self._idle) < self.size and not conn.ws.closed:
+            self._idle.append(conn)
+        else:
+            asyncio.ensure_future(self._close(conn))
+
+    async def _connect(self) -> _Conn:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        ws = await self._session.ws_connect(
+            self.url_factory(), headers=self.headers_factory(), compress=15, heartbeat=None,
+        )
+        self.stats["connects"] += 1
+        return _Conn(ws)
+
+    async def _close(self, conn: _Conn):
+        try:
+            await conn.ws.close()
+        except Exception:
+            pass
+
+    async def _request(self, conn: _Conn, text: str, voice: str, rate: str) -> bytes:
+        """Send one utterance and collect its audio until turn.end."""
+        if not conn.configured:
+            await conn.ws.send_str(_config_message())
+            conn.configured = True
+        request_id = uuid.uuid4().hex
+        await conn.ws.send_str(_ssml_message(request_id, text, voice, rate))
+
+        audio = bytearray()
+        while True:
+            msg = await conn.ws.receive()
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                head, _, _ = msg.data.partition("\r\n\r\n")
+                headers = parse_headers(head)
+                if headers.get("X-RequestId") not in (None, request_id):
+                    continue  # late frame from an abandoned request
+                if headers.get("Path") == "turn.end":
+                    return bytes(audio)
+            elif msg.type == aiohttp.WSMsgType.BINARY:
+                header_len = int.from_bytes(msg.data[:2], "big")
+                headers = parse_headers(msg.data[2:2 + header_len])
+                if headers.get("Path") == "audio" and headers.get("X-RequestId") in (None, request_id):
+                    audio += msg.data[2 + header_len:]
+            else:
+                raise ConnectionError(f"TTS websocket closed ({msg.type.name})")
@@ -2,14 +2,29 @@
 # Custom Streamlit bidirectional component for the automatic voice loop.
 #
 # This component:
-#   - Sends TTS audio (base64 MP3) to the browser for playback
-#   - Receives recorded user audio (base64 WebM) after silence detection
+#   - Sends TTS audio (MP3, one segment per sentence) to the browser
+#   - Receives recorded user audio (WebM) after silence detection
 #   - Manages the IDLE → SPEAKING → LISTENING → PROCESSING state loop
+#
+# With AUDIO_TRANSPORT = "bytes" audio travels as raw binary in both
+# directions; callers pass audio_store handles and get bytes back.
 # ──────────────────────────────────────────────────────────────────────────────
 
 import os
+import json
+import time
+import base64
 import streamlit.components.v1 as components
-from config import SILENCE_THRESHOLD, SILENCE_DURATION, MIC_DELAY_MS, MIN_SPEECH_DURATION
+from config import (
+    SILENCE_THRESHOLD, SILENCE_DURATION, MIC_DELAY_MS, MIN_SPEECH_DURATION,
+    AUDIO_TRANSPORT, AUDIO_PREPARE_CLIENT, AUDIO_SAMPLE_RATE, AUDIO_UPLOAD_BITRATE,
+    AUDIO_TRIM_PAD_MS, AUDIO_LEAD_TRIM_MS,
+    STT_STREAMING, STT_SEGMENT_PAUSE_MS, STT_SEGMENT_MIN_MS, STT_SEGMENT_MAX_MS,
+    BARGE_IN, BARGE_IN_THRESHOLD, BARGE_IN_MS,
+    VAD_WORKLET, VAD_FRAME_MS, VAD_SNR_RATIO, VAD_MIN_THRESHOLD, VAD_START_FRAMES,
+    VAD_HANGOVER_MIN_MS, VAD_HANGOVER_FACTOR,
+)
+from audio_store import audio_store
 
 # Path to the frontend HTML
 _COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend")
@@ -17,9 +32,28 @@ _COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "front
 # Declare the component (development mode uses local files)
 _voice_component = components.declare_component("voice_loop", path=_COMPONENT_DIR)
 
+# Adaptive VAD settings sent to the AudioWorklet (keys as vad-processor.js expects)
+VAD_DEFAULTS = {
+    "worklet": VAD_WORKLET,
+    "frameMs": VAD_FRAME_MS,
+    "snrRatio": VAD_SNR_RATIO,
+    "minThreshold": VAD_MIN_THRESHOLD,
+    "startFrames": VAD_START_FRAMES,
+    "hangoverMinMs": VAD_HANGOVER_MIN_MS,
+    "hangoverMaxMs": SILENCE_DURATION * 1000,
+    "hangoverFactor": VAD_HANGOVER_FACTOR,
+}
+
 
 def voice_loop_component(
     tts_audio_b64: str = "",
+    tts_segments_b64: list[str] | None = None,
+    tts_id: str = "",
+    tts_handles: list[str] | None = None,
+    tts_offset_ms: int = 0,
+    vad: dict | None = None,
+    stt_utterance: str = "",
+    stt_acked: list[int] | None = None,
     key: str = "voice_loop",
 ) -> dict | None:
     """
@@ -28,19 +62,129 @@ def voice_loop_component(
     Args:
         tts_audio_b64: Base64-encoded MP3 audio for TTS playback.
                        Pass empty string when no audio to play.
+        tts_segments_b64: Base64-encoded MP3 segments (one per sentence),
+                          played back-to-back. Takes precedence over
+                          tts_audio_b64 when given.
+        tts_id: Unique id for this reply's audio, so the browser plays
+                each reply exactly once across reruns. A new id with no
+                audio means the reply has nothing (left) to play — the
+                browser goes back to listening.
+        tts_handles: audio_store handles of MP3 segments, in order. Takes
+                     precedence over the base64 arguments; expired handles
+                     are skipped.
+        tts_offset_ms: Start the first segment this far in (it has been
+                       playing from the page while the reply streamed).
+        vad: Overrides for VAD_DEFAULTS (e.g. {"snrRatio": 4.0}).
+        stt_utterance, stt_acked: The utterance being streamed and the
+                     segment seqs already received for it. The browser
+                     re-sends unacknowledged segments with the final value.
         key: Streamlit component key for state management.
 
     Returns:
-        dict with 'audio_b64' (base64 WebM) when user audio is captured,
-        or None if nothing captured yet.
+        dict with 'audio' (WebM bytes), 'timestamp', 'mime', 'decode_ms' and
+        'prepared' (True if the browser already downmixed and trimmed it)
+        when user audio is captured, or None if nothing captured yet.
+        With STT_STREAMING, values also arrive mid-utterance: 'utterance' and
+        'seq' identify the segment and 'final' marks the last one (whose
+        audio may be empty). The final value's 'endpoint' says how the VAD
+        ended the turn: mode, eos_ms (silence waited after the last voiced
+        frame), hangover_ms, noise_floor and threshold. Its 'resend' lists
+        earlier segments ({"seq", "audio", "mime", "prepared"}) the browser
+        had no acknowledgement for. A value with 'barge_in' set ("speaking" or
+        "processing") carries no audio: the user talked over the reply.
     """
+    args = {}
+    if tts_handles:
+        clips = [c for c in (audio_store.get(h) for h in tts_handles) if c]
+        if AUDIO_TRANSPORT == "bytes":
+            # One binary arg plus offsets — components take bytes args but not lists of them
+            args["tts_audio"] = b"".join(clips)
+            args["tts_offsets"] = _offsets(clips)
+        else:
+            args["tts_segments_b64"] = [base64.b64encode(c).decode("utf-8") for c in clips]
+    else:
+        args["tts_segments_b64"] = tts_segments_b64 or ([tts_audio_b64] if tts_audio_b64 else [])
+
     result = _voice_component(
-        tts_audio_b64=tts_audio_b64,
+        **args,
+        tts_id=tts_id,
+        tts_offset_ms=tts_offset_ms,
+        transport=AUDIO_TRANSPORT,
         silence_threshold=SILENCE_THRESHOLD,
         silence_duration=SILENCE_DURATION,
         mic_delay_ms=MIC_DELAY_MS,
         min_speech_duration=MIN_SPEECH_DURATION,
+        prepare_audio=AUDIO_PREPARE_CLIENT,
+        sample_rate=AUDIO_SAMPLE_RATE,
+        upload_bitrate=AUDIO_UPLOAD_BITRATE,
+        trim_pad_ms=AUDIO_TRIM_PAD_MS,
+        lead_trim_ms=AUDIO_LEAD_TRIM_MS,
+        streaming=STT_STREAMING,
+        segment_pause_ms=STT_SEGMENT_PAUSE_MS,
+        segment_min_ms=STT_SEGMENT_MIN_MS,
+        segment_max_ms=STT_SEGMENT_MAX_MS,
+        barge_in=BARGE_IN,
+        barge_in_threshold=BARGE_IN_THRESHOLD,
+        barge_in_ms=BARGE_IN_MS,
+        vad={**VAD_DEFAULTS, **(vad or {})},
+        stt_utterance=stt_utterance,
+        stt_acked=stt_acked or [],
         key=key,
         default=None,
     )
-    return result
+    return _decode_value(result)
+
+
+def _offsets(clips: list[bytes]) -> list[int]:
+    """End offset of each clip within the concatenated buffer."""
+    ends, total = [], 0
+    for clip in clips:
+        total += len(clip)
+        ends.append(total)
+    return ends
+
+
+def _decode_value(value) -> dict | None:
+    """
+    Normalize a component value to {"audio": bytes, "timestamp", "mime", "decode_ms", ...}.
+
+    Binary values are framed as a 4-byte big-endian header length, a JSON
+    header, then the raw audio. Dict values are the legacy base64 form.
+    """
+    if not value:
+        return None
+    started = time.perf_counter()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value)
+        header_len = int.from_bytes(raw[:4], "big")
+        header = json.loads(raw[4:4 + header_len].decode("utf-8"))
+        # Audio, then any re-sent segments back to back
+        end = len(raw) - sum(r["length"] for r in header.get("resend", []))
+        audio = raw[4 + header_len:end]
+        resend = []
+        for r in header.get("resend", []):
+            resend.append({**r, "audio": raw[end:end + r["length"]]})
+            end += r["length"]
+    elif isinstance(value, dict) and "audio_b64" in value:
+        header = value
+        audio = base64.b64decode(value["audio_b64"])
+        resend = [{**r, "audio": base64.b64decode(r["audio_b64"])} for r in value.get("resend", [])]
+    else:
+        return value if isinstance(value, dict) else None
+    return {
+        "audio": audio,
+        "timestamp": header.get("timestamp", 0),
+        "mime": header.get("mime", "audio/webm"),
+        "prepared": bool(header.get("prepared")),
+        "trimmed_ms": header.get("trimmed_ms", 0),
+        "speech_ms": header.get("speech_ms", 0),
+        "utterance": header.get("utterance", ""),
+        "seq": header.get("seq", 0),
+        "final": header.get("final", True),
+        "barge_in": header.get("barge_in", ""),
+        "unplayed_segments": header.get("unplayed_segments", 0),
+        "endpoint": header.get("endpoint"),
+        "resend": [{"seq": r["seq"], "audio": r["audio"], "mime": r.get("mime", "audio/webm"),
+                    "prepared": bool(r.get("prepared"))} for r in resend],
+        "decode_ms": (time.perf_counter() - started) * 1000,
+    }
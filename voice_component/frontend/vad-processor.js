@@ -0,0 +1,109 @@
+// ─── vad-processor.js ─────────────────────────────────────────────────────────
+// AudioWorklet voice activity detector for the voice loop.
+// Runs on the audio thread: RMS per frame, a noise floor that follows the
+// room, a speech threshold relative to that floor, and an end-of-turn
+// hangover that adapts to how long this speaker pauses mid-sentence.
+// Posts one message per frame; the main thread only reacts to decisions.
+// ──────────────────────────────────────────────────────────────────────────────
+
+class VadProcessor extends AudioWorkletProcessor {
+  constructor(options) {
+    super();
+    const p = options.processorOptions || {};
+    this.configure(p);
+    this.floor = p.initialFloor || this.minThreshold / this.snrRatio;
+    // Start cautious: the first turns wait the full hangover until pauses are learned
+    this.pauseEma = this.hangoverMaxMs / this.hangoverFactor;
+    this.sum = 0;
+    this.count = 0;
+    this.reset();
+    this.port.onmessage = (e) => {
+      if (!e.data) return;
+      if (e.data.type === 'reset') this.reset();
+      if (e.data.type === 'config') this.configure(e.data);
+    };
+  }
+
+  // Tuning from processorOptions, later from {type: 'config'} messages when
+  // the page changes it; a field a message leaves out keeps its value.
+  // The learned floor and pause length carry over.
+  configure(p) {
+    this.frameMs = p.frameMs || this.frameMs || 20;
+    this.frameSamples = Math.max(1, Math.round(sampleRate * this.frameMs / 1000));
+    this.minThreshold = p.minThreshold || this.minThreshold || 0.005;   // never treat quieter than this as speech
+    this.snrRatio = p.snrRatio || this.snrRatio || 3.0;                 // speech = floor × ratio
+    this.floorFall = p.floorFall || this.floorFall || 0.1;              // per-frame smoothing when the room gets quieter
+    this.floorRise = p.floorRise || this.floorRise || 0.02;             // ... when quiet frames get louder
+    this.floorCreep = p.floorCreep || this.floorCreep || 0.002;         // ... during "speech" (sustained noise creeps in)
+    this.startFrames = p.startFrames || this.startFrames || 3;          // loud frames before speech starts
+    this.minPauseMs = p.minPauseMs || this.minPauseMs || 150;           // shorter gaps aren't pauses
+    this.hangoverMinMs = p.hangoverMinMs || this.hangoverMinMs || 500;
+    this.hangoverMaxMs = p.hangoverMaxMs || this.hangoverMaxMs || 1500;
+    this.hangoverFactor = p.hangoverFactor || this.hangoverFactor || 2.0; // end after factor × typical pause
+  }
+
+  // New turn: forget speech state, keep the learned floor and pause length
+  reset() {
+    this.inSpeech = false;
+    this.loudRun = 0;
+    this.silenceMs = 0;
+    this.ended = false;
+  }
+
+  process(inputs) {
+    const channel = inputs[0] && inputs[0][0];
+    if (channel) {
+      for (let i = 0; i < channel.length; i++) {
+        this.sum += channel[i] * channel[i];
+        if (++this.count >= this.frameSamples) {
+          this.frame(Math.sqrt(this.sum / this.count));
+          this.sum = 0;
+          this.count = 0;
+        }
+      }
+    }
+    return true;
+  }
+
+  frame(rms) {
+    const threshold = Math.max(this.minThreshold, this.floor * this.snrRatio);
+    const loud = rms > threshold;
+
+    // Quiet frames pull the floor quickly; loud frames only let it creep up,
+    // so speech doesn't raise it but a noisier room eventually does
+    const rate = !loud ? (rms < this.floor ? this.floorFall : this.floorRise) : this.floorCreep;
+    this.floor += (rms - this.floor) * rate;
+
+    this.loudRun = loud ? this.loudRun + 1 : 0;
+    if (!this.inSpeech && this.loudRun >= this.startFrames) this.inSpeech = true;
+
+    let voiced = false;
+    if (this.inSpeech && loud) {
+      // Speaker resumed after a pause — learn how long their pauses are
+      if (this.silenceMs >= this.minPauseMs) {
+        this.pauseEma += (this.silenceMs - this.pauseEma) * 0.2;
+      }
+      this.silenceMs = 0;
+      voiced = true;
+    } else if (this.inSpeech) {
+      this.silenceMs += this.frameMs;
+    }
+
+    const hangover = Math.min(this.hangoverMaxMs,
+      Math.max(this.hangoverMinMs, this.pauseEma * this.hangoverFactor));
+    const end = this.inSpeech && !this.ended && this.silenceMs >= hangover;
+    if (end) this.ended = true;
+
+    this.port.postMessage({
+      rms: rms,
+      floor: this.floor,
+      threshold: threshold,
+      voiced: voiced,
+      pauseMs: this.silenceMs,
+      hangover: hangover,
+      end: end
+    });
+  }
+}
+
+registerProcessor('vad-processor', VadProcessor);
@@ -0,0 +1,296 @@
+# ─── write_behind.py ──────────────────────────────────────────────────────────
+# Background write-behind queue for chat persistence.
+# Saves are accepted instantly, coalesced per session and flushed in batches
+# by a daemon thread. When the database is unreachable they are spooled to a
+# local append-only file and replayed once writes succeed again.
+# ──────────────────────────────────────────────────────────────────────────────
+
+import os
+import json
+import time
+import atexit
+import threading
+from collections import deque
+
+
+class WriteBehindQueue:
+    """
+    Coalescing write-behind buffer in front of a batch flush function.
+
+    flush_fn receives a list of save ops — dicts with user_key, session_id,
+    messages and title — and must raise on failure. Only the newest op per
+    (user_key, session_id) is kept, since each carries the full conversation.
+    """
+
+    def __init__(self, flush_fn, spool_path: str, interval: float,
+                 batch_size: int, retry_interval: float):
+        self.flush_fn = flush_fn
+        self.spool_path = spool_path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending: dict[tuple[str, str], dict] = {}
+        self._inflight: dict[tuple[str, str], dict] = {}
+        # Keys of the batch whose write (or spool) hasn't finished yet
+        self._writing: set[tuple[str, str]] = set()
+        self._written = threading.Condition(self._lock)
+        self._discarded: set[tuple[str, str]] = set()
+        self._db_down_since = None
+        self._flushed_at: dict[tuple[str, str], float] = {}
+        self._latencies = deque(maxlen=200)
+        self._thread = None
+
+        self.stats = {
+            "enqueued": 0,
+            "coalesced": 0,
+            "flushed": 0,
+            "flush_batches": 0,
+            "flush_failures": 0,
+            "spooled": 0,
+            "replayed": 0,
+        }
+
+    # ── Producer side ───────────────────────────────────────────────────────
+
+    def submit(self, user_key: str, session_id: str, messages: list, title: str):
+        """Queue a save and return immediately."""
+        op = {
+            "user_key": user_key,
+            "session_id": session_id,
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+            "title": title,
+            "queued_at": time.time(),
+        }
+        key = (user_key, session_id)
+        with self._lock:
+            if key in self._pending:
+                self.stats["coalesced"] += 1
+            self._pending[key] = op
+            self._discarded.discard(key)
+            self.stats["enqueued"] += 1
+        self._ensure_worker()
+        self._wake.set()
+
+    def discard(self, user_key: str, session_id: str, timeout: float = 10.0):
+        """
+        Drop unflushed saves for a session that is being deleted.
+
+        A batch already being written can't be recalled, so this blocks until
+        no write in progress still carries the session (or timeout) — the
+        caller's delete then lands after it instead of being undone by it.
+        """
+        key = (user_key, session_id)
+        with self._written:
+            self._pending.pop(key, None)
+            self._inflight.pop(key, None)
+            self._discarded.add(key)
+            self._written.wait_for(lambda: key not in self._writing, timeout=timeout)
+
+    def pending_for(self, user_key: str) -> dict[str, dict]:
+        """Unflushed save ops for a user, by session_id (read-your-writes)."""
+        with self._lock:
+            ops = {**self._inflight, **self._pending}
+        return {sid: op for (uk, sid), op in ops.items() if uk == user_key}
+
+    def flush(self, timeout: float = 5.0):
+        """
+        Block until the queue is drained and the worker's current batch is
+        written (or timeout). Used at shutdown; on timeout both are spooled.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._pending and not self._writing:
+                    return
+            self._wake.set()
+            time.sleep(0.05)
+        self._spool_pending()
+
+    def snapshot(self) -> dict:
+        """Queue depth, flush latency and counters for dashboards."""
+        with self._lock:
+            lat = sorted(self._latencies)
+            last = self._latencies[-1] if lat else 0.0
+            spool_bytes = os.path.getsize(self.spool_path) if os.path.exists(self.spool_path) else 0
+            return {
+                **self.stats,
+                "queue_depth": len(self._pending),
+                "spool_bytes": spool_bytes,
+                "db_down": self._db_down_since is not None,
+                "flush_ms_last": last * 1000,
+                "flush_ms_p50": lat[len(lat) // 2] * 1000 if lat else 0.0,
+                "flush_ms_p95": lat[int(len(lat) * 0.95)] * 1000 if lat else 0.0,
+            }
+
+    # ── Worker ──────────────────────────────────────────────────────────────
+
+    def _ensure_worker(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.retry_interval)
+            self._wake.clear()
+            # Let a burst of saves coalesce before flushing
+            time.sleep(self.interval)
+            try:
+                # While the database is down each loop doubles as a retry probe
+                if self._flush_pending():
+                    self._replay_spool()
+            except Exception as e:
+                print(f"[Write-Behind Error] {e}")
+
+    def _flush_pending(self) -> bool:
+        """Flush one batch. Returns False if the database rejected it."""
+        with self._lock:
+            keys = list(self._pending)[:self.batch_size]
+            batch = [self._pending.pop(k) for k in keys]
+            self._inflight.update(zip(keys, batch))
+            if not batch:
+                return True
+            self._writing.update(keys)
+        try:
+            ok = self._write(batch)
+            with self._lock:
+                for k, op in zip(keys, batch):
+                    if self._inflight.get(k) is op:
+                        del self._inflight[k]
+            if not ok:
+                # Database unreachable — keep the data durable locally
+                self._append_spool(batch)
+                return False
+        finally:
+            self._done_writing(keys)
+        with self._lock:
+            if self._pending:
+                self._wake.set()
+        return True
+
+    def _write(self, batch: list[dict]) -> bool:
+        started = time.perf_counter()
+        try:
+            self.flush_fn(batch)
+        except Exception as e:
+            with self._lock:
+                self.stats["flush_failures"] += 1
+                if self._db_down_since is None:
+                    self._db_down_since = time.time()
+            print(f"[Write-Behind] Flush of {len(batch)} session(s) failed: {e}")
+            return False
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+            self.stats["flushed"] += len(batch)
+            self.stats["flush_batches"] += 1
+            self._db_down_since = None
+            for op in batch:
+                key = (op["user_key"], op["session_id"])
+                self._flushed_at[key] = max(self._flushed_at.get(key, 0.0), op["queued_at"])
+        return True
+
+    def _done_writing(self, keys):
+        with self._written:
+            self._writing.difference_update(keys)
+            self._written.notify_all()
+
+    # ── Spool ───────────────────────────────────────────────────────────────
+
+    def _append_spool(self, batch: list[dict]):
+        with self._lock:
+            # A session deleted while its save was in flight stays deleted
+            batch = [op for op in batch
+                     if (op["user_key"], op["session_id"]) not in self._discarded]
+        if not batch:
+            return
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                for op in batch:
+                    f.write(json.dumps(op) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                self.stats["spooled"] += len(batch)
+        except OSError as e:
+            print(f"[Write-Behind] Spool write failed, {len(batch)} save(s) lost: {e}")
+
+    def _spool_pending(self):
+        with self._lock:
+            # In-flight ops may still land in the database too — replay
+            # skips what was flushed since
+            batch = list(self._pending.values()) + list(self._inflight.values())
+            self._pending.clear()
+        if batch:
+            self._append_spool(batch)
+
+    def _replay_spool(self):
+        """Re-send spooled saves after the database is reachable again."""
+        if not os.path.exists(self.spool_path):
+            return
+        replaying = f"{self.spool_path}.replay"
+        try:
+            os.replace(self.spool_path, replaying)
+            with open(replaying, encoding="utf-8") as f:
+                lines = [ln for ln in f if ln.strip()]
+        except OSError as e:
+            print(f"[Write-Behind] Spool replay failed: {e}")
+            return
+
+        # Coalesce — the newest op per session wins; live or already-flushed
+        # newer saves beat the spool
+        latest: dict[tuple[str, str], dict] = {}
+        for ln in lines:
+            try:
+                op = json.loads(ln)
+            except ValueError:
+                continue
+            latest[(op["user_key"], op["session_id"])] = op
+        with self._lock:
+            ops = [op for k, op in latest.items()
+                   if k not in self._pending and k not in self._discarded
+                   and op["queued_at"] > self._flushed_at.get(k, 0.0)]
+
+        failed = []
+        for i in range(0, len(ops), self.batch_size):
+            with self._lock:
+                # Skip sessions deleted since the snapshot above
+                chunk = [op for op in ops[i:i + self.batch_size]
+                         if (op["user_key"], op["session_id"]) not in self._discarded]
+                keys = [(op["user_key"], op["session_id"]) for op in chunk]
+                self._writing.update(keys)
+            try:
+                ok = self._write(chunk) if chunk else True
+            finally:
+                self._done_writing(keys)
+            if ok:
+                with self._lock:
+                    self.stats["replayed"] += len(chunk)
+            else:
+                failed = ops[i:]
+                break
+        if failed:
+            self._append_spool(failed)
+        os.remove(replaying)
+
+    def recover(self):
+        """Replay a spool left over from a previous process, if any."""
+        if os.path.exists(f"{self.spool_path}.replay"):
+            # Crashed mid-replay — fold it back into the spool
+            with open(f"{self.spool_path}.replay", encoding="utf-8") as src, \
+                    open(self.spool_path, "a", encoding="utf-8") as dst:
+                dst.write(src.read())
+            os.remove(f"{self.spool_path}.replay")
+        if os.path.exists(self.spool_path):
+            self._ensure_worker()
+            self._wake.set()
+
+    def install_exit_hook(self):
+        """Drain the queue on interpreter exit; anything left is spooled."""
+        atexit.register(self.flush)